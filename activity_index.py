@@ -0,0 +1,85 @@
+# activity_index.py
+
+import time
+from collections import OrderedDict
+from itertools import islice
+
+# سطل‌های ساعتی بر اساس ساعت محلی تراز می‌شوند تا ساعت‌های غیرکامل (مثل +03:30) هم درست در
+# نمودار ساعتی قرار بگیرند. اختلاف با UTC برای هر زمان جداگانه خوانده می‌شود تا با تغییر ساعت
+# تابستانی در طول اجرای ربات، سطل‌ها یک ساعت جابه‌جا نشوند.
+def _hour_bucket(ts: float) -> int:
+    return int((ts + time.localtime(ts).tm_gmtoff) // 3600)
+
+
+class ActivityIndex:
+    """ایندکس مرتب کاربران بر اساس آخرین فعالیت که با هر پیام به‌صورت تدریجی به‌روز می‌شود.
+
+    - `_order` کاربران را به ترتیب آخرین فعالیت نگه می‌دارد (قدیمی‌ترین اول)؛ چون هر به‌روزرسانی
+      زمان «اکنون» را ثبت می‌کند، کافی است کاربر به انتهای آن منتقل شود (O(1)).
+    - `_buckets` کاربران را بر اساس ساعت آخرین فعالیت دسته‌بندی می‌کند تا شمارش کاربران فعال
+      در یک بازه به‌جای O(N) با O(تعداد ساعت‌ها) انجام شود.
+    """
+
+    def __init__(self):
+        self._order = OrderedDict()
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._order)
+
+    def build(self, last_seen_by_user):
+        """ایندکس را از روی نگاشت آیدی کاربر به زمان آخرین فعالیت (epoch) از نو می‌سازد."""
+        self._order.clear()
+        self._buckets.clear()
+        for user_id, ts in sorted(last_seen_by_user, key=lambda item: item[1]):
+            self._order[user_id] = ts
+            self._buckets.setdefault(_hour_bucket(ts), set()).add(user_id)
+
+    def touch(self, user_id, ts: float):
+        """زمان آخرین فعالیت کاربر را ثبت کرده و او را به انتهای ترتیب منتقل می‌کند."""
+        old_ts = self._order.get(user_id)
+        if old_ts is not None:
+            old_bucket = _hour_bucket(old_ts)
+            members = self._buckets.get(old_bucket)
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self._buckets[old_bucket]
+        self._order[user_id] = ts
+        self._order.move_to_end(user_id)
+        self._buckets.setdefault(_hour_bucket(ts), set()).add(user_id)
+
+    def count_since(self, cutoff: float) -> int:
+        """تعداد کاربرانی که آخرین فعالیتشان بعد از (یا برابر) زمان cutoff است؛ هم‌مرز با ids_since."""
+        cutoff_bucket = _hour_bucket(cutoff)
+        now_bucket = _hour_bucket(time.time())
+        total = 0
+        for bucket in range(cutoff_bucket + 1, now_bucket + 1):
+            members = self._buckets.get(bucket)
+            if members:
+                total += len(members)
+        # فقط در سطل مرزی لازم است زمان دقیق تک‌تک کاربران بررسی شود
+        boundary = self._buckets.get(cutoff_bucket)
+        if boundary:
+            total += sum(1 for user_id in boundary if self._order[user_id] >= cutoff)
+        return total
+
+    def ids_since(self, cutoff: float) -> list:
+        """آیدی کاربرانی که آخرین فعالیتشان بعد از (یا برابر) زمان cutoff است، جدیدترین اول."""
+        result = []
+        for user_id in reversed(self._order):
+            if self._order[user_id] < cutoff:
+                break
+            result.append(user_id)
+        return result
+
+    def recent(self, limit: int, offset: int = 0) -> list:
+        """آیدی کاربران به ترتیب آخرین فعالیت (جدیدترین اول) با صفحه‌بندی."""
+        return list(islice(reversed(self._order), offset, offset + limit))
+
+    def hourly_histogram(self) -> list:
+        """تعداد کاربران بر اساس ساعت محلی آخرین فعالیت (۲۴ خانه)."""
+        hours = [0] * 24
+        for bucket, members in self._buckets.items():
+            hours[bucket % 24] += len(members)
+        return hours
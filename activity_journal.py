@@ -0,0 +1,305 @@
+# activity_journal.py
+
+import os
+import re
+import json
+import time
+import struct
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# هر رکورد: آیدی کاربر، زمان (ثانیه epoch)، تأخیر پاسخ (ثانیه) و روز اولین فعالیت کاربر (روز از epoch)
+RECORD = struct.Struct('<qIfH')
+_JOURNAL_NAME = re.compile(r"^activity-(\d+)\.bin$")
+ROLLUPS_FILE = "rollups.json"
+
+# مانند activity_index، سطل‌های ساعتی و روزانه بر اساس ساعت محلی تراز می‌شوند؛ اختلاف با UTC
+# برای هر زمان جداگانه محاسبه می‌شود تا پس از تغییر ساعت تابستانی سطل‌ها جابه‌جا نشوند.
+def local_hour(ts: float) -> int:
+    return int((ts + time.localtime(ts).tm_gmtoff) // 3600)
+
+
+def local_day(ts: float) -> int:
+    return int((ts + time.localtime(ts).tm_gmtoff) // 86400)
+
+
+def week_of(day: int) -> int:
+    # روز صفر epoch پنجشنبه است؛ هفته‌ها از دوشنبه شروع می‌شوند
+    return (day + 3) // 7
+
+
+def weekday(day: int) -> int:
+    """روز هفته (۰ دوشنبه تا ۶ یکشنبه)."""
+    return (day + 3) % 7
+
+
+def day_label(day: int) -> str:
+    return datetime.fromtimestamp(day * 86400, timezone.utc).strftime('%Y-%m-%d')
+
+
+class Rollups:
+    """تجمیع‌های ساعتی، روزانه، هفتگی و ماتریس ماندگاری (cohort) که با هر رکورد به‌روز می‌شوند.
+
+    فقط مجموعه کاربران ساعت، روز و هفته جاری در حافظه نگه داشته می‌شود؛ با بسته شدن هر بازه
+    فقط تعداد کاربران یکتای آن باقی می‌ماند، پس کوئری‌ها به جای پیمایش کاربران با O(تعداد سطل‌ها)
+    پاسخ داده می‌شوند.
+    """
+
+    def __init__(self, keep_hours: int = 60 * 24, keep_days: int = 400, keep_cohorts: int = 120):
+        self.keep_hours = keep_hours
+        self.keep_days = keep_days
+        self.keep_cohorts = keep_cohorts
+        self.hourly = {}    # ساعت -> [پیام‌ها، کاربران یکتا، مجموع تأخیر]
+        self.daily = {}     # روز -> [پیام‌ها، کاربران یکتا، مجموع تأخیر، کاربران جدید]
+        self.weekly = {}    # هفته -> کاربران یکتا
+        self.cohorts = {}   # روز اولین فعالیت -> {سن به روز: کاربران فعال}
+        self._hour, self._hour_users = None, set()
+        self._day, self._day_users = None, set()
+        self._week, self._week_users = None, set()
+
+    def apply(self, user_id: int, ts: int, latency: float, cohort: int):
+        hour, day = local_hour(ts), local_day(ts)
+        week = week_of(day)
+        # رکوردهای دیرتر رسیده (با ساعت عقب‌تر) در بازه جاری شمرده می‌شوند
+        if self._hour is None or hour > self._hour:
+            self._hour, self._hour_users = hour, set()
+        if self._day is None or day > self._day:
+            self._day, self._day_users = day, set()
+            self._prune()
+        if self._week is None or week > self._week:
+            self._week, self._week_users = week, set()
+
+        h = self.hourly.setdefault(self._hour, [0, 0, 0.0])
+        h[0] += 1
+        h[2] += latency
+        if user_id not in self._hour_users:
+            self._hour_users.add(user_id)
+            h[1] += 1
+
+        d = self.daily.setdefault(self._day, [0, 0, 0.0, 0])
+        d[0] += 1
+        d[2] += latency
+        if user_id not in self._day_users:
+            self._day_users.add(user_id)
+            d[1] += 1
+            if cohort >= self._day:
+                d[3] += 1
+            ages = self.cohorts.setdefault(min(cohort, self._day), {})
+            age = max(0, self._day - cohort)
+            ages[age] = ages.get(age, 0) + 1
+
+        if user_id not in self._week_users:
+            self._week_users.add(user_id)
+            self.weekly[self._week] = self.weekly.get(self._week, 0) + 1
+
+    def _prune(self):
+        for table, keep, current in ((self.hourly, self.keep_hours, self._hour),
+                                     (self.daily, self.keep_days, self._day),
+                                     (self.cohorts, self.keep_cohorts, self._day)):
+            cutoff = current - keep
+            for key in [k for k in table if k < cutoff]:
+                del table[key]
+        cutoff = week_of(self._day) - self.keep_days // 7
+        for key in [k for k in self.weekly if k < cutoff]:
+            del self.weekly[key]
+
+    # --- کوئری‌ها ---
+    def weekday_hour_matrix(self, days: int, now: float = None) -> list:
+        """ماتریس ۷×۲۴ (دوشنبه تا یکشنبه × ساعت محلی) از تعداد پیام‌ها در `days` روز گذشته."""
+        matrix = [[0] * 24 for _ in range(7)]
+        end = local_hour(now or time.time())
+        for hour in range(end - days * 24 + 1, end + 1):
+            counts = self.hourly.get(hour)
+            if counts:
+                matrix[weekday(hour // 24)][hour % 24] += counts[0]
+        return matrix
+
+    def hour_of_day(self, days: int, now: float = None) -> list:
+        """میانگین کاربران یکتای هر ساعت محلی (۲۴ خانه) در `days` روز گذشته."""
+        totals = [0] * 24
+        end = local_hour(now or time.time())
+        for hour in range(end - days * 24 + 1, end + 1):
+            counts = self.hourly.get(hour)
+            if counts:
+                totals[hour % 24] += counts[1]
+        return [total / days for total in totals]
+
+    def daily_series(self, days: int, now: float = None) -> list:
+        """[(روز، پیام‌ها، کاربران فعال، میانگین تأخیر، کاربران جدید)] برای `days` روز گذشته."""
+        today = local_day(now or time.time())
+        series = []
+        for day in range(today - days + 1, today + 1):
+            messages, users, latency, new = self.daily.get(day, (0, 0, 0.0, 0))
+            series.append((day, messages, users, latency / messages if messages else 0.0, new))
+        return series
+
+    def wau(self, weeks: int, now: float = None) -> list:
+        """[(روز شروع هفته، کاربران یکتا)] برای `weeks` هفته گذشته."""
+        current = week_of(local_day(now or time.time()))
+        return [(week * 7 - 3, self.weekly.get(week, 0)) for week in range(current - weeks + 1, current + 1)]
+
+    def retention(self, cohorts: int, ages=(1, 7, 30), now: float = None) -> list:
+        """[(روز cohort، اندازه، {سن: درصد})] برای `cohorts` روز گذشته؛ سن‌های آینده None هستند."""
+        today = local_day(now or time.time())
+        rows = []
+        for cohort in range(today - cohorts + 1, today + 1):
+            active = self.cohorts.get(cohort, {})
+            size = active.get(0, 0)
+            rows.append((cohort, size, {
+                age: (100 * active.get(age, 0) / size if size else 0.0) if cohort + age <= today else None
+                for age in ages
+            }))
+        return rows
+
+    # --- ذخیره‌سازی ---
+    def to_dict(self) -> dict:
+        """کپی مستقل از وضعیت (روی حلقه رویداد) تا نوشتن آن در ترد با تغییرات بعدی تداخل نکند."""
+        return {
+            'hourly': {k: list(v) for k, v in self.hourly.items()},
+            'daily': {k: list(v) for k, v in self.daily.items()},
+            'weekly': dict(self.weekly),
+            'cohorts': {c: dict(ages) for c, ages in self.cohorts.items()},
+            'current': {
+                'hour': [self._hour, list(self._hour_users)],
+                'day': [self._day, list(self._day_users)],
+                'week': [self._week, list(self._week_users)],
+            },
+        }
+
+    def load(self, data: dict):
+        self.hourly = {int(k): v for k, v in data.get('hourly', {}).items()}
+        self.daily = {int(k): v for k, v in data.get('daily', {}).items()}
+        self.weekly = {int(k): v for k, v in data.get('weekly', {}).items()}
+        self.cohorts = {int(c): {int(a): n for a, n in ages.items()} for c, ages in data.get('cohorts', {}).items()}
+        current = data.get('current', {})
+        self._hour, hour_users = current.get('hour', [None, []])
+        self._day, day_users = current.get('day', [None, []])
+        self._week, week_users = current.get('week', [None, []])
+        self._hour_users, self._day_users, self._week_users = set(hour_users), set(day_users), set(week_users)
+
+
+class ActivityJournal:
+    """ژورنال دودویی فقط‌افزودنی فعالیت کاربران با فایل‌های روزانه و تجمیع‌های تدریجی.
+
+    رکوردها (۱۸ بایت) روی حلقه رویداد در بافر جمع شده و به‌صورت دوره‌ای در ترد به فایل
+    `activity-<روز>.bin` اضافه می‌شوند. تجمیع‌ها همراه با محل آخرین رکورد اعمال شده در
+    `rollups.json` ذخیره می‌شوند؛ هنگام شروع فقط رکوردهای پس از آن محل دوباره خوانده می‌شوند و
+    اگر فایل تجمیع‌ها وجود نداشته باشد همه آن‌ها از روی ژورنال بازسازی می‌شوند.
+    """
+
+    def __init__(self, directory: str, keep_days: int):
+        self.directory = directory
+        self.keep_days = keep_days
+        os.makedirs(directory, exist_ok=True)
+        self.rollups = Rollups()
+        self._pending = {}  # روز -> bytearray
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def _path(self, day: int) -> str:
+        return os.path.join(self.directory, f"activity-{day}.bin")
+
+    def _journal_days(self) -> list:
+        days = []
+        for name in os.listdir(self.directory):
+            match = _JOURNAL_NAME.match(name)
+            if match:
+                days.append(int(match.group(1)))
+        return sorted(days)
+
+    def record(self, user_id: int, latency: float, first_seen: float = None, now: float = None):
+        """یک پیام پاسخ داده شده را ثبت می‌کند (روی حلقه رویداد، بدون دسترسی به دیسک)."""
+        ts = int(now if now is not None else time.time())
+        cohort = local_day(first_seen) if first_seen else local_day(ts)
+        self._pending.setdefault(local_day(ts), bytearray()).extend(RECORD.pack(user_id, ts, latency, cohort))
+        self.rollups.apply(user_id, ts, latency, cohort)
+        self.records += 1
+
+    # --- نوشتن ---
+    def _write(self, chunks: dict, rollups: dict):
+        with self._lock:
+            checkpoint = None
+            for day in sorted(chunks):
+                path = self._path(day)
+                with open(path, 'ab') as f:
+                    f.write(chunks[day])
+                    checkpoint = [day, f.tell()]
+            if checkpoint is None:
+                return
+            rollups['checkpoint'] = checkpoint
+            tmp_path = os.path.join(self.directory, ROLLUPS_FILE + ".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(rollups, f, separators=(',', ':'))
+            os.replace(tmp_path, os.path.join(self.directory, ROLLUPS_FILE))
+            self._prune_files()
+
+    def _prune_files(self):
+        cutoff = local_day(time.time()) - self.keep_days
+        for day in self._journal_days():
+            if day < cutoff:
+                os.remove(self._path(day))
+
+    async def flush(self):
+        """رکوردهای بافر شده و وضعیت تجمیع‌ها را (در ترد) روی دیسک می‌نویسد."""
+        if not self._pending:
+            return
+        chunks, self._pending = self._pending, {}
+        # تجمیع‌ها دقیقاً تا آخرین رکورد همین بافر را شامل می‌شوند
+        rollups = self.rollups.to_dict()
+        try:
+            await asyncio.to_thread(self._write, chunks, rollups)
+        except Exception as e:
+            logger.error("Failed to write activity journal: %s", e)
+            for day, data in chunks.items():
+                self._pending[day] = data + self._pending.get(day, bytearray())
+
+    # --- بازیابی ---
+    def _recover(self):
+        checkpoint = None
+        path = os.path.join(self.directory, ROLLUPS_FILE)
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    saved = json.load(f)
+                self.rollups.load(saved)
+                checkpoint = saved.get('checkpoint')
+            except (OSError, ValueError) as e:
+                logger.warning("Activity rollups unreadable, rebuilding from journal: %s", e)
+                self.rollups = Rollups()
+        replayed = 0
+        for day in self._journal_days():
+            offset = 0
+            if checkpoint is not None:
+                if day < checkpoint[0]:
+                    continue
+                if day == checkpoint[0]:
+                    offset = checkpoint[1]
+            with open(self._path(day), 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            # رکورد نیمه‌کاره انتهای فایل (پس از قطع ناگهانی) حذف می‌شود تا رکوردهای بعدی جابه‌جا نشوند
+            usable = len(data) - len(data) % RECORD.size
+            if usable != len(data):
+                os.truncate(self._path(day), offset + usable)
+            for user_id, ts, latency, cohort in RECORD.iter_unpack(data[:usable]):
+                self.rollups.apply(user_id, ts, latency, cohort)
+                replayed += 1
+        if replayed:
+            logger.info("Replayed %d activity journal records into rollups.", replayed)
+
+    async def recover(self):
+        """تجمیع‌ها را بارگذاری کرده و رکوردهای پس از آخرین ذخیره را از ژورنال دوباره اعمال می‌کند."""
+        await asyncio.to_thread(self._recover)
+
+
+# --- نمونه سراسری ---
+ACTIVITY_JOURNAL_DIR = os.environ.get(
+    "ACTIVITY_JOURNAL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "activity")
+)
+ACTIVITY_JOURNAL_KEEP_DAYS = int(os.environ.get("ACTIVITY_JOURNAL_KEEP_DAYS", "90"))
+
+journal = ActivityJournal(ACTIVITY_JOURNAL_DIR, ACTIVITY_JOURNAL_KEEP_DAYS)
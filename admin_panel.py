@@ -5,19 +5,17 @@ import json
 import logging
 import csv
 import io
+import gzip
+import time
 import asyncio
-from datetime import datetime, timedelta
+import functools
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
 from telegram.error import TelegramError
 
 # --- کتابخانه‌های جدید برای ویژگی‌های اضافه شده ---
-import matplotlib
-matplotlib.use('Agg') # تنظیم برای استفاده در محیط بدون رابط کاربری گرافیکی
-import matplotlib.pyplot as plt
-import pandas as pd
 import tempfile
-import psutil
 import platform
 
 # --- تنظیمات ---
@@ -25,9 +23,44 @@ ADMIN_IDS = list(map(int, os.environ.get("ADMIN_IDS", "").split(','))) if os.env
 
 # وارد کردن مدیر داده‌ها
 import data_manager
+from response_cache import cache as response_cache
+from admission import controller as admission
+from rate_limit import limiter as rate_limiter
+import broadcast
+import scheduler
+from conversation import store as conversation_store
+from model_router import router as model_router
+import latency_metrics
+import log_reader
+import exporter
+from backup import manager as backup_manager
+import activity_journal
+from activity_journal import journal as activity
+import charts
+from charts import renderer as chart_renderer
 
 logger = logging.getLogger(__name__)
 
+# --- بارگذاری تنبل کتابخانه‌های سنگین ---
+# matplotlib (در charts) و psutil فقط در چند دستور ادمین استفاده می‌شوند؛ بارگذاری آن‌ها هنگام شروع
+# ربات صدها میلی‌ثانیه و ده‌ها مگابایت حافظه هزینه دارد، پس در اولین استفاده (در یک ترد) وارد می‌شوند.
+@functools.lru_cache(maxsize=None)
+def _psutil():
+    import psutil
+    return psutil
+
+async def prewarm_heavy_modules():
+    """کتابخانه‌های سنگین را در پس‌زمینه بارگذاری می‌کند تا اولین دستور ادمین منتظر نماند."""
+    for loader in (charts.load_matplotlib, _psutil):
+        try:
+            await asyncio.to_thread(loader)
+        except ImportError as e:
+            logger.warning("Could not pre-load admin dependency: %s", e)
+    logger.info("Admin dependencies pre-loaded.")
+
+# حداکثر تعداد خطوط قابل درخواست با /logs
+LOG_TAIL_MAX = 200
+
 # --- دکوراتور برای دسترسی ادمین ---
 
 def admin_only(func):
@@ -49,29 +82,42 @@ async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📊 `/stats` - نمایش آمار ربات\n"
         "📢 `/broadcast [پیام]` - ارسال پیام به تمام کاربران\n"
         "🎯 `/targeted_broadcast [معیار] [مقدار] [پیام]` - ارسال پیام هدفمند\n"
-        "📅 `/schedule_broadcast [YYYY-MM-DD] [HH:MM] [پیام]` - ارسال برنامه‌ریزی شده\n"
+        "📅 `/schedule_broadcast [YYYY-MM-DD] [HH:MM[:SS]] [پیام]` - ارسال برنامه‌ریزی شده\n"
+        "🔁 `/schedule_recurring [دقیقه] [ساعت] [روز] [ماه] [روز هفته] [پیام]` - ارسال تکرارشونده (مانند cron)\n"
         "📋 `/list_scheduled` - نمایش لیست ارسال‌های برنامه‌ریزی شده\n"
         "🗑️ `/remove_scheduled [شماره]` - حذف ارسال برنامه‌ریزی شده\n"
         "🚫 `/ban [آیدی]` - مسدود کردن کاربر\n"
         "✅ `/unban [آیدی]` - رفع مسدودیت کاربر\n"
         "💌 `/direct_message [آیدی] [پیام]` - ارسال پیام مستقیم به کاربر\n"
         "ℹ️ `/user_info [آیدی]` - نمایش اطلاعات کاربر\n"
-        "📝 `/logs` - نمایش آخرین لاگ‌ها\n"
-        "📂 `/logs_file` - دانلود فایل کامل لاگ‌ها\n"
+        "📝 `/logs [تعداد] [سطح] [متن]` - نمایش و جستجوی آخرین لاگ‌ها\n"
+        "📂 `/logs_file [شماره]` - دانلود فشرده فایل لاگ (یا فایل چرخیده)\n"
         "👥 `/users_list [صفحه]` - نمایش لیست کاربران\n"
         "🔍 `/user_search [نام]` - جستجوی کاربر بر اساس نام\n"
-        "💾 `/backup` - ایجاد نسخه پشتیبان از داده‌ها\n"
-        "📊 `/export_csv` - دانلود اطلاعات کاربران در فایل CSV\n"
+        "💾 `/backup [new]` - دریافت آخرین نسخه پشتیبان (تصویر کامل و لاگ تغییرات)\n"
+        "♻️ `/restore YYYY-MM-DD HH:MM` - بازسازی داده‌ها در یک لحظه مشخص\n"
+        "📊 `/export_csv [csv|jsonl|parquet] [active_days=N] [min_messages=N] [banned=yes|no]` - دانلود فشرده اطلاعات کاربران\n"
         "🔧 `/maintenance [on/off]` - فعال/غیرفعال کردن حالت نگهداری\n"
         "👋 `/set_welcome [پیام]` - تنظیم پیام خوشامدگویی\n"
         "👋 `/set_goodbye [پیام]` - تنظیم پیام خداحافظی\n"
-        "📈 `/activity_heatmap` - دریافت نمودار فعالیت کاربران\n"
-        "⏱️ `/response_stats` - نمایش آمار زمان پاسخگویی\n"
+        "📈 `/activity_heatmap [روز]` - نمودار فعالیت کاربران بر اساس روز هفته و ساعت\n"
+        "📅 `/messages_chart [روز]` - نمودار پیام‌ها و کاربران فعال روزانه\n"
+        "📆 `/analytics [روز]` - کاربران فعال روزانه/هفتگی و ماندگاری کاربران جدید\n"
+        "⏱️ `/response_stats [1m|1h|24h|all]` - صدک‌های زمان پاسخگویی و تفکیک مراحل\n"
+        "📉 `/latency_chart [1h|24h] [مرحله]` - نمودار صدک‌های تأخیر در طول زمان\n"
         "🚫 `/add_blocked_word [کلمه]` - افزودن کلمه مسدود\n"
         "✅ `/remove_blocked_word [کلمه]` - حذف کلمه مسدود\n"
         "📜 `/list_blocked_words` - نمایش لیست کلمات مسدود\n"
         "💻 `/system_info` - نمایش اطلاعات سیستم\n"
         "🔄 `/reset_stats [messages/all]` - ریست کردن آمار\n"
+        "🗃️ `/cache_stats` - نمایش آمار کش پاسخ‌ها\n"
+        "🧹 `/cache_clear` - پاک کردن کش پاسخ‌ها\n"
+        "🚦 `/queue_status` - نمایش وضعیت صف درخواست‌های مدل\n"
+        "⏳ `/rate_limit [user/global] [پیام در دقیقه] [ظرفیت]` - نمایش/تنظیم محدودیت نرخ پیام‌ها\n"
+        "📡 `/broadcast_status [شماره]` - وضعیت ارسال‌های همگانی\n"
+        "💬 `/conversation [آیدی]` - آمار حافظه گفتگو یا نمایش تاریخچه یک کاربر\n"
+        "🛰️ `/router_status` - وضعیت سرورهای مدل (تأخیر، خطا، مدارشکن)\n"
+        "🛑 `/broadcast_cancel [شماره]` - لغو یک ارسال همگانی در حال اجرا\n"
         "📋 `/commands` - نمایش این لیست دستورات"
     )
     await update.message.reply_text(commands_text, parse_mode='Markdown')
@@ -79,28 +125,17 @@ async def admin_commands(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @admin_only
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """آمار ربات را نمایش می‌دهد."""
-    total_users = len(data_manager.DATA['users'])
+    total_users = data_manager.user_count()
     total_messages = data_manager.DATA['stats']['total_messages']
     banned_count = len(data_manager.DATA['banned_users'])
     
-    now = datetime.now()
-    active_24h = sum(1 for user in data_manager.DATA['users'].values() 
-                    if 'last_seen' in user and 
-                    datetime.strptime(user['last_seen'], '%Y-%m-%d %H:%M:%S') > now - timedelta(hours=24))
-    
-    active_7d = sum(1 for user in data_manager.DATA['users'].values() 
-                   if 'last_seen' in user and 
-                   datetime.strptime(user['last_seen'], '%Y-%m-%d %H:%M:%S') > now - timedelta(days=7))
-
-    active_users = sorted(
-        data_manager.DATA['users'].items(),
-        key=lambda item: item[1].get('last_seen', ''),
-        reverse=True
-    )[:5]
+    active_24h = data_manager.count_active_users(24)
+    active_7d = data_manager.count_active_users(24 * 7)
+    active_users = data_manager.get_recent_users(5)
 
     active_users_text = "\n".join(
-        [f"• {user_id}: {info.get('first_name', 'N/A')} (آخرین فعالیت: {info.get('last_seen', 'N/A')})"
-         for user_id, info in active_users]
+        [f"• {user_id}: {record.first_name or 'N/A'} (آخرین فعالیت: {data_manager.format_timestamp(record.last_seen)})"
+         for user_id, record in active_users]
     )
 
     text = (
@@ -122,27 +157,12 @@ async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     message_text = " ".join(context.args)
-    user_ids = list(data_manager.DATA['users'].keys())
-    total_sent = 0
-    total_failed = 0
-
-    await update.message.reply_text(f"📣 در حال ارسال پیام به `{len(user_ids)}` کاربر...")
-
-    for user_id_str in user_ids:
-        try:
-            await context.bot.send_message(chat_id=int(user_id_str), text=message_text)
-            total_sent += 1
-            await asyncio.sleep(0.05)
-        except TelegramError as e:
-            logger.warning(f"Failed to send broadcast to {user_id_str}: {e}")
-            total_failed += 1
-
-    result_text = (
-        f"✅ **ارسال همگانی تمام شد**\n\n"
-        f"✅ موفق: `{total_sent}`\n"
-        f"❌ ناموفق: `{total_failed}`"
+    job = broadcast.create_job(context.bot, message_text, notify_chat=update.effective_chat.id)
+    await update.message.reply_text(
+        f"📣 ارسال همگانی #{job['id']} به `{data_manager.user_count()}` کاربر آغاز شد.\n"
+        f"برای مشاهده پیشرفت: `/broadcast_status {job['id']}`",
+        parse_mode='Markdown'
     )
-    await update.message.reply_text(result_text, parse_mode='Markdown')
 
 @admin_only
 async def admin_targeted_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -156,98 +176,107 @@ async def admin_targeted_broadcast(update: Update, context: ContextTypes.DEFAULT
     value = context.args[1]
     message_text = " ".join(context.args[2:])
     
-    target_users = []
-    
     if criteria == "active_days":
         try:
-            days = int(value)
-            target_users = data_manager.get_active_users(days)
+            audience = {'criteria': criteria, 'value': int(value)}
         except ValueError:
             await update.message.reply_text("⚠️ مقدار روز باید یک عدد صحیح باشد.")
             return
     
     elif criteria == "message_count":
         try:
-            min_count = int(value)
-            target_users = data_manager.get_users_by_message_count(min_count)
+            audience = {'criteria': criteria, 'value': int(value)}
         except ValueError:
             await update.message.reply_text("⚠️ تعداد پیام باید یک عدد صحیح باشد.")
             return
     
     elif criteria == "banned":
-        if value.lower() == "true":
-            target_users = list(data_manager.DATA['banned_users'])
-        elif value.lower() == "false":
-            for user_id in data_manager.DATA['users']:
-                if int(user_id) not in data_manager.DATA['banned_users']:
-                    target_users.append(int(user_id))
-        else:
+        if value.lower() not in ("true", "false"):
             await update.message.reply_text("⚠️ مقدار برای معیار banned باید true یا false باشد.")
             return
+        audience = {'criteria': criteria, 'value': value.lower() == "true"}
     
     else:
         await update.message.reply_text("⚠️ معیار نامعتبر است. معیارهای موجود: active_days, message_count, banned")
         return
     
-    if not target_users:
+    target_count = len(broadcast.resolve_audience(audience))
+    if not target_count:
         await update.message.reply_text("هیچ کاربری با معیارهای مشخص شده یافت نشد.")
         return
     
-    await update.message.reply_text(f"📣 در حال ارسال پیام به `{len(target_users)}` کاربر...")
-    
-    total_sent, total_failed = 0, 0
-    for user_id in target_users:
-        try:
-            await context.bot.send_message(chat_id=user_id, text=message_text)
-            total_sent += 1
-            await asyncio.sleep(0.05)
-        except TelegramError as e:
-            logger.warning(f"Failed to send targeted broadcast to {user_id}: {e}")
-            total_failed += 1
-    
-    result_text = f"✅ **ارسال هدفمند تمام شد**\n\n✅ موفق: `{total_sent}`\n❌ ناموفق: `{total_failed}`"
-    await update.message.reply_text(result_text, parse_mode='Markdown')
+    job = broadcast.create_job(context.bot, message_text, audience, notify_chat=update.effective_chat.id, label="targeted")
+    await update.message.reply_text(
+        f"📣 ارسال هدفمند #{job['id']} به `{target_count}` کاربر آغاز شد.\n"
+        f"برای مشاهده پیشرفت: `/broadcast_status {job['id']}`",
+        parse_mode='Markdown'
+    )
 
 @admin_only
 async def admin_schedule_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """تنظیم ارسال برنامه‌ریزی شده پیام به همه کاربران."""
     if len(context.args) < 3:
-        await update.message.reply_text("⚠️ فرمت صحیح: `/schedule_broadcast [YYYY-MM-DD] [HH:MM] [پیام]`")
+        await update.message.reply_text("⚠️ فرمت صحیح: `/schedule_broadcast [YYYY-MM-DD] [HH:MM[:SS]] [پیام]`")
         return
     
     try:
         date_str, time_str = context.args[0], context.args[1]
         message_text = " ".join(context.args[2:])
         
-        scheduled_time = datetime.strptime(f"{date_str} {time_str}", '%Y-%m-%d %H:%M')
+        time_format = '%Y-%m-%d %H:%M:%S' if time_str.count(':') == 2 else '%Y-%m-%d %H:%M'
+        scheduled_time = datetime.strptime(f"{date_str} {time_str}", time_format)
         
         if scheduled_time <= datetime.now():
             await update.message.reply_text("⚠️ زمان برنامه‌ریزی شده باید در آینده باشد.")
             return
         
-        data_manager.DATA['scheduled_broadcasts'].append({
-            'time': scheduled_time.strftime('%Y-%m-%d %H:%M:%S'),
-            'message': message_text,
-            'status': 'pending'
-        })
-        data_manager.save_data()
+        entry = scheduler.add(message_text, when=scheduled_time)
         
-        await update.message.reply_text(f"✅ پیام برای زمان `{scheduled_time.strftime('%Y-%m-%d %H:%M')}` برنامه‌ریزی شد.")
+        await update.message.reply_text(f"✅ پیام برای زمان `{entry['time']}` برنامه‌ریزی شد.")
         
     except ValueError:
         await update.message.reply_text("⚠️ فرمت زمان نامعتبر است. لطفاً از فرمت YYYY-MM-DD HH:MM استفاده کنید.")
 
+@admin_only
+async def admin_schedule_recurring(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تنظیم ارسال تکرارشونده به همه کاربران با عبارت cron."""
+    if len(context.args) < 6:
+        await update.message.reply_text(
+            "⚠️ فرمت صحیح: `/schedule_recurring [دقیقه] [ساعت] [روز] [ماه] [روز هفته] [پیام]`\n"
+            "مثال (هر دوشنبه ساعت ۹): `/schedule_recurring 0 9 * * 1 سلام!`",
+            parse_mode='Markdown'
+        )
+        return
+
+    cron = " ".join(context.args[:5])
+    message_text = " ".join(context.args[5:])
+    try:
+        entry = scheduler.add(message_text, cron=cron)
+    except ValueError as e:
+        await update.message.reply_text(f"⚠️ عبارت زمان‌بندی نامعتبر است: {e}")
+        return
+
+    await update.message.reply_text(f"✅ ارسال تکرارشونده `{cron}` ثبت شد. اولین ارسال: `{entry['time']}`", parse_mode='Markdown')
+
 @admin_only
 async def admin_list_scheduled_broadcasts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """نمایش لیست ارسال‌های برنامه‌ریزی شده."""
-    if not data_manager.DATA['scheduled_broadcasts']:
+    pending = scheduler.pending()
+    recent = scheduler.archived()[-5:]
+    if not pending and not recent:
         await update.message.reply_text("هیچ ارسال برنامه‌ریزی شده‌ای وجود ندارد.")
         return
     
     broadcasts_text = "📅 **لیست ارسال‌های برنامه‌ریزی شده:**\n\n"
-    for i, broadcast in enumerate(data_manager.DATA['scheduled_broadcasts'], 1):
-        status_emoji = "✅" if broadcast['status'] == 'sent' else "⏳"
-        broadcasts_text += f"{i}. {status_emoji} `{broadcast['time']}` - {broadcast['message'][:50]}...\n"
+    for i, entry in enumerate(pending, 1):
+        repeat = f" 🔁 `{entry['cron']}`" if entry.get('cron') else ""
+        broadcasts_text += f"{i}. ⏳ `{entry['time']}`{repeat} - {entry['message'][:50]}...\n"
+    
+    if recent:
+        broadcasts_text += "\n**آخرین ارسال‌های انجام شده:**\n"
+        for entry in reversed(recent):
+            job = f" (#{entry['job_id']})" if entry.get('job_id') else ""
+            broadcasts_text += f"✅ `{entry.get('sent_time', entry['time'])}`{job} - {entry['message'][:50]}...\n"
     
     await update.message.reply_text(broadcasts_text, parse_mode='Markdown')
 
@@ -258,15 +287,12 @@ async def admin_remove_scheduled_broadcast(update: Update, context: ContextTypes
         await update.message.reply_text("⚠️ لطفاً شماره ارسال برنامه‌ریزی شده را وارد کنید.\nمثال: `/remove_scheduled 1`")
         return
     
-    index = int(context.args[0]) - 1
+    removed_broadcast = scheduler.remove(int(context.args[0]) - 1)
     
-    if not data_manager.DATA['scheduled_broadcasts'] or not (0 <= index < len(data_manager.DATA['scheduled_broadcasts'])):
+    if removed_broadcast is None:
         await update.message.reply_text("⚠️ شماره ارسال برنامه‌ریزی شده نامعتبر است.")
         return
     
-    removed_broadcast = data_manager.DATA['scheduled_broadcasts'].pop(index)
-    data_manager.save_data()
-    
     await update.message.reply_text(f"✅ ارسال برنامه‌ریزی شده برای زمان `{removed_broadcast['time']}` حذف شد.")
 
 @admin_only
@@ -295,7 +321,7 @@ async def admin_ban(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text="⛔️ شما توسط ادمین ربات مسدود شدید و دیگر نمی‌توانید از خدمات ربات استفاده کنید."
         )
     except TelegramError as e:
-        logger.warning(f"Could not send ban notification to user {user_id_to_ban}: {e}")
+        logger.warning("Could not send ban notification to user %s: %s", user_id_to_ban, e)
 
     await update.message.reply_text(f"✅ کاربر `{user_id_to_ban}` با موفقیت مسدود شد.", parse_mode='Markdown')
 
@@ -321,7 +347,7 @@ async def admin_unban(update: Update, context: ContextTypes.DEFAULT_TYPE):
             text="✅ مسدودیت شما توسط ادمین ربات برداشته شد. می‌توانید دوباره از ربات استفاده کنید."
         )
     except TelegramError as e:
-        logger.warning(f"Could not send unban notification to user {user_id_to_unban}: {e}")
+        logger.warning("Could not send unban notification to user %s: %s", user_id_to_unban, e)
 
     await update.message.reply_text(f"✅ مسدودیت کاربر `{user_id_to_unban}` با موفقیت برداشته شد.", parse_mode='Markdown')
 
@@ -354,100 +380,129 @@ async def admin_userinfo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     user_id = int(context.args[0])
-    user_info = data_manager.DATA['users'].get(str(user_id))
+    record = data_manager.get_user(user_id)
 
-    if not user_info:
+    if not record:
         await update.message.reply_text(f"کاربری با آیدی `{user_id}` در دیتابیس یافت نشد.")
         return
 
     is_banned = "بله" if data_manager.is_user_banned(user_id) else "خیر"
     
-    if 'first_seen' in user_info and 'last_seen' in user_info:
-        first_date = datetime.strptime(user_info['first_seen'], '%Y-%m-%d %H:%M:%S')
-        last_date = datetime.strptime(user_info['last_seen'], '%Y-%m-%d %H:%M:%S')
-        days_active = max(1, (last_date - first_date).days)
-        avg_messages = user_info.get('message_count', 0) / days_active
+    if record.first_seen is not None and record.last_seen is not None:
+        days_active = max(1, int((record.last_seen - record.first_seen) // 86400))
+        avg_messages = record.message_count / days_active
     else:
-        avg_messages = user_info.get('message_count', 0)
+        avg_messages = record.message_count
     
     text = (
         f"ℹ️ **اطلاعات کاربر**\n\n"
         f"🆔 **آیدی:** `{user_id}`\n"
-        f"👤 **نام:** {user_info.get('first_name', 'N/A')}\n"
-        f"🔷 **نام کاربری:** @{user_info.get('username', 'N/A')}\n"
-        f"📊 **تعداد پیام‌ها:** `{user_info.get('message_count', 0)}`\n"
+        f"👤 **نام:** {record.first_name or 'N/A'}\n"
+        f"🔷 **نام کاربری:** @{record.username or 'N/A'}\n"
+        f"📊 **تعداد پیام‌ها:** `{record.message_count}`\n"
         f"📈 **میانگین پیام در روز:** `{avg_messages:.2f}`\n"
-        f"📅 **اولین پیام:** {user_info.get('first_seen', 'N/A')}\n"
-        f"🕒 **آخرین فعالیت:** {user_info.get('last_seen', 'N/A')}\n"
+        f"📅 **اولین پیام:** {data_manager.format_timestamp(record.first_seen)}\n"
+        f"🕒 **آخرین فعالیت:** {data_manager.format_timestamp(record.last_seen)}\n"
         f"🚫 **وضعیت مسدودیت:** {is_banned}"
     )
     await update.message.reply_text(text, parse_mode='Markdown')
 
 @admin_only
 async def admin_logs(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """آخرین خطوط لاگ ربات را ارسال می‌کند."""
-    try:
-        with open(data_manager.LOG_FILE, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            last_lines = lines[-30:]
-            log_text = "".join(last_lines)
-            if not log_text:
-                await update.message.reply_text("فایل لاگ خالی است.")
-                return
-            
-            if len(log_text) > 4096:
-                for i in range(0, len(log_text), 4096):
-                    await update.message.reply_text(f"```{log_text[i:i+4096]}```", parse_mode='Markdown')
-            else:
-                await update.message.reply_text(f"```{log_text}```", parse_mode='Markdown')
+    """آخرین خطوط لاگ ربات را با فیلتر اختیاری سطح و متن ارسال می‌کند.
+
+    استفاده: `/logs [تعداد] [سطح] [متن]` (مثلاً `/logs 50 ERROR timeout`).
+    """
+    count = 30
+    level = None
+    terms = []
+    for arg in context.args or []:
+        if arg.isdigit() and count == 30 and not terms:
+            count = min(int(arg), LOG_TAIL_MAX)
+        elif arg.upper() in log_reader.LEVELS and level is None and not terms:
+            level = arg.upper()
+        else:
+            terms.append(arg)
+    pattern = " ".join(terms) or None
 
-    except FileNotFoundError:
-        await update.message.reply_text("فایل لاگ یافت نشد.")
+    try:
+        lines = await asyncio.to_thread(log_reader.search, data_manager.LOG_FILE, count, level, pattern)
     except Exception as e:
         await update.message.reply_text(f"خطایی در خواندن لاگ رخ داد: {e}")
+        return
+    if not lines:
+        await update.message.reply_text("خط لاگی با این شرایط یافت نشد." if level or pattern else "فایل لاگ خالی است.")
+        return
+
+    # تقسیم بر اساس خط تا هر پیام در سقف طول تلگرام (همراه با علامت‌های کد) جا شود
+    chunk = ""
+    for line in lines:
+        line = line[:3900] + "\n"
+        if len(chunk) + len(line) > 3900:
+            await update.message.reply_text(f"```\n{chunk}```", parse_mode='Markdown')
+            chunk = ""
+        chunk += line
+    if chunk:
+        await update.message.reply_text(f"```\n{chunk}```", parse_mode='Markdown')
 
 @admin_only
 async def admin_logs_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """فایل کامل لاگ ربات را ارسال می‌کند."""
-    try:
-        await update.message.reply_document(
-            document=open(data_manager.LOG_FILE, 'rb'),
-            caption="📂 فایل کامل لاگ‌های ربات"
-        )
-    except FileNotFoundError:
+    """فایل لاگ جاری را به صورت فشرده (gzip) یا یک فایل چرخیده را با `/logs_file [شماره]` ارسال می‌کند."""
+    files = log_reader.log_files(data_manager.LOG_FILE)
+    if context.args and context.args[0].isdigit():
+        index = int(context.args[0])
+        if index < 1 or index >= len(files):
+            await update.message.reply_text(f"فایل لاگ چرخیده شماره {index} وجود ندارد. ({len(files) - 1} فایل موجود است)")
+            return
+        with open(files[index], 'rb') as f:
+            await update.message.reply_document(document=f, caption=f"📂 فایل لاگ چرخیده شماره {index}")
+        return
+
+    if not files or files[0] != data_manager.LOG_FILE:
         await update.message.reply_text("فایل لاگ یافت نشد.")
+        return
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".log.gz", delete=False) as temp:
+            temp_path = temp.name
+        await asyncio.to_thread(log_reader.compress_copy, data_manager.LOG_FILE, temp_path)
+        with open(temp_path, 'rb') as f:
+            await update.message.reply_document(
+                document=f,
+                filename=f"bot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log.gz",
+                caption=f"📂 فایل کامل لاگ‌های ربات (فشرده)\n🗂 فایل‌های چرخیده: {len(files) - 1}"
+            )
     except Exception as e:
         await update.message.reply_text(f"خطایی در ارسال فایل لاگ رخ داد: {e}")
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
 
 @admin_only
 async def admin_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """نمایش لیست کامل کاربران با صفحه‌بندی."""
-    users = data_manager.DATA['users']
-    
     page = 1
     if context.args and context.args[0].isdigit():
         page = int(context.args[0])
         if page < 1: page = 1
     
     users_per_page = 20
-    total_users = len(users)
+    total_users = data_manager.user_count()
     total_pages = (total_users + users_per_page - 1) // users_per_page
     
     if page > total_pages: page = total_pages
     
-    start_idx = (page - 1) * users_per_page
-    end_idx = min(start_idx + users_per_page, total_users)
-    
-    sorted_users = sorted(users.items(), key=lambda item: item[1].get('last_seen', ''), reverse=True)
+    start_idx = max(0, (page - 1) * users_per_page)
+    page_users = data_manager.get_recent_users(users_per_page, start_idx)
     
     users_text = f"👥 **لیست کاربران (صفحه {page}/{total_pages})**\n\n"
     
-    for i, (user_id, user_info) in enumerate(sorted_users[start_idx:end_idx], start=start_idx + 1):
-        is_banned = "🚫" if int(user_id) in data_manager.DATA['banned_users'] else "✅"
-        username = user_info.get('username', 'N/A')
-        first_name = user_info.get('first_name', 'N/A')
-        last_seen = user_info.get('last_seen', 'N/A')
-        message_count = user_info.get('message_count', 0)
+    for i, (user_id, record) in enumerate(page_users, start=start_idx + 1):
+        is_banned = "🚫" if user_id in data_manager.DATA['banned_users'] else "✅"
+        username = record.username or 'N/A'
+        first_name = record.first_name or 'N/A'
+        last_seen = data_manager.format_timestamp(record.last_seen)
+        message_count = record.message_count
         
         users_text += f"{i}. {is_banned} `{user_id}` - {first_name} (@{username})\n"
         users_text += f"   پیام‌ها: `{message_count}` | آخرین فعالیت: `{last_seen}`\n\n"
@@ -467,19 +522,11 @@ async def admin_user_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     search_term = " ".join(context.args).lower()
-    users = data_manager.DATA['users']
     
     matching_users = []
-    for user_id, user_info in users.items():
-        # --- کد اصلاح شده ---
-        # استفاده از (value or '') برای جلوگیری از خطا در صورت وجود None
-        first_name = (user_info.get('first_name') or '').lower()
-        username = (user_info.get('username') or '').lower()
-        # --- پایان کد اصلاح شده ---
-        
-        if search_term in first_name or search_term in username:
-            is_banned = "🚫" if int(user_id) in data_manager.DATA['banned_users'] else "✅"
-            matching_users.append((user_id, user_info, is_banned))
+    for user_id, record in data_manager.search_users(search_term):
+        is_banned = "🚫" if user_id in data_manager.DATA['banned_users'] else "✅"
+        matching_users.append((user_id, record, is_banned))
     
     if not matching_users:
         await update.message.reply_text(f"هیچ کاربری با نام «{search_term}» یافت نشد.")
@@ -487,11 +534,11 @@ async def admin_user_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     results_text = f"🔍 **نتایج جستجو برای «{search_term}»**\n\n"
     
-    for user_id, user_info, is_banned in matching_users:
-        username_display = user_info.get('username', 'N/A') # برای نمایش نیازی به lower نیست
-        first_name_display = user_info.get('first_name', 'N/A') # برای نمایش نیازی به lower نیست
-        last_seen = user_info.get('last_seen', 'N/A')
-        message_count = user_info.get('message_count', 0)
+    for user_id, record, is_banned in matching_users:
+        username_display = record.username or 'N/A' # برای نمایش نیازی به lower نیست
+        first_name_display = record.first_name or 'N/A' # برای نمایش نیازی به lower نیست
+        last_seen = data_manager.format_timestamp(record.last_seen)
+        message_count = record.message_count
         
         results_text += f"{is_banned} `{user_id}` - {first_name_display} (@{username_display})\n"
         results_text += f"   پیام‌ها: `{message_count}` | آخرین فعالیت: `{last_seen}`\n\n"
@@ -500,58 +547,117 @@ async def admin_user_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 @admin_only
 async def admin_backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """ایجاد نسخه پشتیبان از داده‌های ربات."""
+    """ارسال آخرین نسخه پشتیبان (تصویر کامل فشرده و لاگ تغییرات پس از آن)؛ `/backup new` تصویر جدید می‌گیرد."""
+    if backup_manager is None:
+        await update.message.reply_text("ℹ️ نسخه پشتیبان‌گیری غیرفعال است (BACKUP_ENABLED=0).")
+        return
     try:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_file = f"bot_backup_{timestamp}.json"
-        
-        data_to_backup = data_manager.DATA.copy()
-        data_to_backup['banned_users'] = list(data_manager.DATA['banned_users'])
-        
-        with open(backup_file, 'w', encoding='utf-8') as f:
-            json.dump(data_to_backup, f, indent=4, ensure_ascii=False)
-        
-        await update.message.reply_document(
-            document=open(backup_file, 'rb'),
-            caption=f"✅ نسخه پشتیبان با موفقیت ایجاد شد: {backup_file}"
+        if (context.args and context.args[0].lower() == "new") or backup_manager.latest() is None:
+            await data_manager.create_backup_snapshot()
+        snapshot_path, delta_path = backup_manager.latest()
+        stats = backup_manager.stats()
+
+        with open(snapshot_path, 'rb') as f:
+            await update.message.reply_document(
+                document=f,
+                caption=f"✅ تصویر کامل داده‌ها: {data_manager.format_timestamp(stats['latest'])}"
+            )
+        if delta_path is not None:
+            with open(delta_path, 'rb') as f:
+                await update.message.reply_document(
+                    document=f,
+                    caption="🧾 لاگ تغییرات پس از این تصویر (برای بازیابی تا آخرین لحظه)"
+                )
+        await update.message.reply_text(
+            f"🗂 تصویرهای نگه‌داری شده: `{stats['snapshots']}` (قدیمی‌ترین: `{data_manager.format_timestamp(stats['oldest'])}`)\n"
+            f"💾 حجم کل نسخه‌های پشتیبان: `{stats['total_bytes'] / 1024:.0f}` KB\n"
+            "برای بازیابی به یک لحظه خاص: `/restore YYYY-MM-DD HH:MM`",
+            parse_mode='Markdown'
         )
-        
-        logger.info(f"Backup created: {backup_file}")
-        os.remove(backup_file) # حذف فایل پس از ارسال
+        logger.info("Backup sent: %s", os.path.basename(snapshot_path))
     except Exception as e:
-        await update.message.reply_text(f"❌ خطا در ایجاد نسخه پشتیبان: {e}")
-        logger.error(f"Error creating backup: {e}")
+        await update.message.reply_text(f"❌ خطا در ارسال نسخه پشتیبان: {e}")
+        logger.error("Error sending backup: %s", e)
+
+@admin_only
+async def admin_restore(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """بازسازی داده‌ها در یک لحظه مشخص از روی تصویرها و لاگ تغییرات و ارسال فایل حاصل.
+
+    فایل خروجی همان قالب bot_data.json را دارد؛ داده‌های در حال اجرا تغییر نمی‌کنند.
+    """
+    if backup_manager is None:
+        await update.message.reply_text("ℹ️ نسخه پشتیبان‌گیری غیرفعال است (BACKUP_ENABLED=0).")
+        return
+    try:
+        when = datetime.strptime(" ".join(context.args or []), '%Y-%m-%d %H:%M')
+    except ValueError:
+        try:
+            when = datetime.strptime(" ".join(context.args or []), '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            await update.message.reply_text("⚠️ فرمت صحیح: `/restore YYYY-MM-DD HH:MM[:SS]`", parse_mode='Markdown')
+            return
+
+    restored = await asyncio.to_thread(backup_manager.restore, when.timestamp())
+    if restored is None:
+        await update.message.reply_text("⚠️ نسخه پشتیبانی پیش از این زمان وجود ندارد.")
+        return
+
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".json.gz", delete=False) as temp:
+            temp_path = temp.name
+        payload = json.dumps(restored, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        await asyncio.to_thread(_write_gzip, temp_path, payload)
+        with open(temp_path, 'rb') as f:
+            await update.message.reply_document(
+                document=f,
+                filename=f"bot_data_{when.strftime('%Y%m%d_%H%M%S')}.json.gz",
+                caption=(f"♻️ داده‌های بازسازی شده در {when.strftime('%Y-%m-%d %H:%M:%S')} "
+                         f"({len(restored.get('users', {}))} کاربر).\n"
+                         "برای اعمال، فایل را از حالت فشرده خارج کرده و پیش از راه‌اندازی مجدد جایگزین bot_data.json کنید.")
+            )
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+def _write_gzip(path: str, payload: bytes):
+    with gzip.open(path, 'wb') as f:
+        f.write(payload)
 
 @admin_only
 async def admin_export_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """ایجاد و ارسال فایل CSV از اطلاعات کاربران."""
-    users = data_manager.DATA['users']
-    
-    df_data = []
-    for user_id, user_info in users.items():
-        is_banned = "بله" if int(user_id) in data_manager.DATA['banned_users'] else "خیر"
-        df_data.append({
-            'User ID': user_id,
-            'First Name': user_info.get('first_name', 'N/A'),
-            'Username': user_info.get('username', 'N/A'),
-            'Message Count': user_info.get('message_count', 0),
-            'First Seen': user_info.get('first_seen', 'N/A'),
-            'Last Seen': user_info.get('last_seen', 'N/A'),
-            'Banned': is_banned
-        })
-    
-    df = pd.DataFrame(df_data)
-    
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False, encoding='utf-8') as f:
-        df.to_csv(f.name, index=False)
-        temp_file_path = f.name
-    
-    await update.message.reply_document(
-        document=open(temp_file_path, 'rb'),
-        caption="📊 فایل CSV اطلاعات کاربران"
-    )
-    
-    os.unlink(temp_file_path)
+    """خروجی فشرده اطلاعات کاربران با فیلترهای اختیاری.
+
+    استفاده: `/export_csv [csv|jsonl|parquet] [active_days=N] [min_messages=N] [banned=yes|no]`
+    """
+    try:
+        filters = exporter.parse_filters(context.args or [])
+    except exporter.ExportError as e:
+        await update.message.reply_text(f"⚠️ {e}")
+        return
+
+    user_ids = exporter.select_user_ids(filters)
+    status = await update.message.reply_text(f"⏳ در حال آماده‌سازی خروجی از {len(user_ids)} کاربر...")
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix=exporter.EXTENSIONS[filters['format']], delete=False) as temp:
+            temp_path = temp.name
+        rows = await asyncio.to_thread(exporter.export_users, temp_path, user_ids, filters)
+        with open(temp_path, 'rb') as f:
+            await update.message.reply_document(
+                document=f,
+                filename=exporter.export_filename(filters),
+                caption=f"📊 فایل {filters['format'].upper()} اطلاعات کاربران ({rows} کاربر)"
+            )
+        await status.delete()
+    except exporter.ExportError as e:
+        await status.edit_text(f"⚠️ {e}")
+    except Exception as e:
+        logger.error("Error exporting users: %s", e)
+        await status.edit_text(f"❌ خطا در ایجاد خروجی کاربران: {e}")
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.unlink(temp_path)
 
 @admin_only
 async def admin_maintenance(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -568,22 +674,16 @@ async def admin_maintenance(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
             
         data_manager.DATA['maintenance_mode'] = True
-        data_manager.save_data()
+        data_manager.mark_dirty(keys=('maintenance_mode',))
         
         await update.message.reply_text("✅ حالت نگهداری ربات فعال شد. در حال اطلاع‌رسانی به کاربران...")
         
-        user_ids = list(data_manager.DATA['users'].keys())
-        for user_id_str in user_ids:
-            try:
-                # به ادمین‌ها پیام ارسال نشود
-                if int(user_id_str) not in ADMIN_IDS:
-                    await context.bot.send_message(
-                        chat_id=int(user_id_str), 
-                        text="🔧 ربات در حال حاضر در حالت به‌روزرسانی و نگهداری قرار دارد. لطفاً چند لحظه دیگر صبر کنید. از صبر شما سپاسگزاریم!"
-                    )
-                    await asyncio.sleep(0.05) # جلوگیری از محدودیت تلگرام
-            except TelegramError:
-                continue # نادیده گرفتن کاربرانی که ربات را مسدود کرده‌اند
+        broadcast.create_job(
+            context.bot,
+            "🔧 ربات در حال حاضر در حالت به‌روزرسانی و نگهداری قرار دارد. لطفاً چند لحظه دیگر صبر کنید. از صبر شما سپاسگزاریم!",
+            {'exclude': ADMIN_IDS},
+            label="maintenance"
+        )
 
     elif status == 'off':
         if not data_manager.DATA.get('maintenance_mode', False):
@@ -591,21 +691,16 @@ async def admin_maintenance(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         data_manager.DATA['maintenance_mode'] = False
-        data_manager.save_data()
+        data_manager.mark_dirty(keys=('maintenance_mode',))
 
         await update.message.reply_text("✅ حالت نگهداری ربات غیرفعال شد. در حال اطلاع‌رسانی به کاربران...")
 
-        user_ids = list(data_manager.DATA['users'].keys())
-        for user_id_str in user_ids:
-            try:
-                if int(user_id_str) not in ADMIN_IDS:
-                    await context.bot.send_message(
-                        chat_id=int(user_id_str), 
-                        text="✅ به‌روزرسانی ربات به پایان رسید. از صبر شما سپاسگزاریم! می‌توانید دوباره از ربات استفاده کنید."
-                    )
-                    await asyncio.sleep(0.05)
-            except TelegramError:
-                continue
+        broadcast.create_job(
+            context.bot,
+            "✅ به‌روزرسانی ربات به پایان رسید. از صبر شما سپاسگزاریم! می‌توانید دوباره از ربات استفاده کنید.",
+            {'exclude': ADMIN_IDS},
+            label="maintenance"
+        )
 
 @admin_only
 async def admin_set_welcome_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -617,7 +712,7 @@ async def admin_set_welcome_message(update: Update, context: ContextTypes.DEFAUL
     
     new_message = " ".join(context.args)
     data_manager.DATA['welcome_message'] = new_message
-    data_manager.save_data()
+    data_manager.mark_dirty(keys=('welcome_message',))
     
     await update.message.reply_text("✅ پیام خوشامدگویی با موفقیت به‌روزرسانی شد.")
 
@@ -631,57 +726,149 @@ async def admin_set_goodbye_message(update: Update, context: ContextTypes.DEFAUL
     
     new_message = " ".join(context.args)
     data_manager.DATA['goodbye_message'] = new_message
-    data_manager.save_data()
+    data_manager.mark_dirty(keys=('goodbye_message',))
     
     await update.message.reply_text("✅ پیام خداحافظی با موفقیت به‌روزرسانی شد.")
 
 @admin_only
 async def admin_activity_heatmap(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """ایجاد و ارسال نمودار فعالیت کاربران."""
-    users = data_manager.DATA['users']
-    activity_hours = [0] * 24
-    
-    for user_info in users.values():
-        if 'last_seen' in user_info:
-            try:
-                last_seen = datetime.strptime(user_info['last_seen'], '%Y-%m-%d %H:%M:%S')
-                activity_hours[last_seen.hour] += 1
-            except ValueError:
-                continue
-    
-    plt.figure(figsize=(12, 6))
-    plt.bar(range(24), activity_hours, color='skyblue')
-    plt.title('نمودار فعالیت کاربران بر اساس ساعت')
-    plt.xlabel('ساعت')
-    plt.ylabel('تعداد کاربران فعال')
-    plt.xticks(range(24))
-    plt.grid(axis='y', alpha=0.3)
-    
-    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as f:
-        plt.savefig(f.name, bbox_inches='tight')
-        temp_file_path = f.name
-    
-    plt.close()
-    
+    """ایجاد و ارسال نمودار فعالیت کاربران (تعداد پیام‌ها بر اساس روز هفته و ساعت) از تجمیع‌های ژورنال فعالیت."""
+    days = 7
+    if context.args:
+        if not context.args[0].isdigit() or not 1 <= int(context.args[0]) <= 60:
+            await update.message.reply_text("⚠️ تعداد روزها باید عددی بین 1 و 60 باشد.")
+            return
+        days = int(context.args[0])
+    # نسخه داده‌ها: تعداد رکوردهای ژورنال و ساعت جاری (پنجره با گذشت زمان جابه‌جا می‌شود)
+    key = ('activity_heatmap', days, activity.records, activity_journal.local_hour(time.time()))
+    matrix = activity.rollups.weekday_hour_matrix(days)
+    png = await chart_renderer.render(key, charts.draw_activity_heatmap, matrix, days)
     await update.message.reply_photo(
-        photo=open(temp_file_path, 'rb'),
-        caption="📊 نمودار فعالیت کاربران بر اساس ساعت"
+        photo=png,
+        caption=f"📊 نمودار فعالیت کاربران بر اساس روز هفته و ساعت ({days} روز گذشته)"
     )
-    
-    os.unlink(temp_file_path)
 
 @admin_only
-async def admin_response_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """نمایش آمار زمان پاسخگویی ربات."""
-    stats = data_manager.DATA['stats']
-    await update.message.reply_text(
-        "📈 **آمار زمان پاسخگویی ربات**\n\n"
-        f"🟢 میانگین زمان پاسخگویی: `{stats.get('avg_response_time', 'N/A'):.2f}` ثانیه\n"
-        f"🔴 بیشترین زمان پاسخگویی: `{stats.get('max_response_time', 'N/A'):.2f}` ثانیه\n"
-        f"🟢 کمترین زمان پاسخگویی: `{stats.get('min_response_time', 'N/A'):.2f}` ثانیه\n"
-        f"📊 کل پاسخ‌های ثبت شده: `{stats.get('total_responses', 'N/A')}`"
+async def admin_messages_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمودار تعداد پیام‌ها و کاربران فعال روزانه؛ `/messages_chart [روز]`."""
+    days = 30
+    if context.args:
+        if not context.args[0].isdigit() or not 2 <= int(context.args[0]) <= 365:
+            await update.message.reply_text("⚠️ تعداد روزها باید عددی بین 2 و 365 باشد.")
+            return
+        days = int(context.args[0])
+    key = ('messages_per_day', days, activity.records, activity_journal.local_day(time.time()))
+    series = activity.rollups.daily_series(days)
+    labels = [activity_journal.day_label(row[0])[5:] for row in series]
+    png = await chart_renderer.render(key, charts.draw_messages_per_day, labels,
+                                      [row[1] for row in series], [row[2] for row in series])
+    await update.message.reply_photo(photo=png, caption=f"📅 پیام‌ها و کاربران فعال روزانه ({days} روز گذشته)")
+
+@admin_only
+async def admin_latency_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمودار صدک‌های تأخیر در طول زمان؛ `/latency_chart [1h|24h] [مرحله]`."""
+    window = context.args[0].lower() if context.args else "24h"
+    stage = context.args[1] if len(context.args) > 1 else "total"
+    if window not in latency_metrics.WINDOWS:
+        await update.message.reply_text(f"⚠️ پنجره نامعتبر است. گزینه‌های موجود: {', '.join(latency_metrics.WINDOWS)}")
+        return
+    if stage not in latency_metrics.STAGES:
+        await update.message.reply_text(f"⚠️ مرحله نامعتبر است. گزینه‌های موجود: {', '.join(latency_metrics.STAGES)}")
+        return
+    metrics = latency_metrics.metrics
+    slot_seconds = latency_metrics.WINDOWS[window][0]
+    key = ('latency_percentiles', window, stage, metrics.version(stage), int(time.time() // slot_seconds))
+    timeline = metrics.timeline(stage, window)
+    if not timeline:
+        await update.message.reply_text("ℹ️ هنوز داده‌ای برای این بازه ثبت نشده است.")
+        return
+    # صدک‌ها روی حلقه رویداد محاسبه می‌شوند (چند ده برش) و فقط اعداد به ترد رسم فرستاده می‌شوند
+    time_format = '%H:%M' if slot_seconds < 3600 else '%m-%d %H:00'
+    labels = [datetime.fromtimestamp(start).strftime(time_format) for start, _ in timeline]
+    series = {name: [histogram.percentile(q) for _, histogram in timeline]
+              for name, q in charts.LATENCY_PERCENTILES}
+    png = await chart_renderer.render(key, charts.draw_latency_percentiles, labels, series,
+                                      f'صدک‌های تأخیر {stage} ({window})')
+    await update.message.reply_photo(photo=png, caption=f"⏱️ صدک‌های تأخیر `{stage}` در {window} گذشته",
+                                     parse_mode='Markdown')
+
+@admin_only
+async def admin_analytics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """کاربران فعال روزانه و هفتگی، پیام‌ها و ماندگاری کاربران جدید (D1/D7/D30) از تجمیع‌های ژورنال فعالیت."""
+    days = 7
+    if context.args:
+        if not context.args[0].isdigit() or not 1 <= int(context.args[0]) <= 30:
+            await update.message.reply_text("⚠️ تعداد روزها باید عددی بین 1 و 30 باشد.")
+            return
+        days = int(context.args[0])
+    rollups = activity.rollups
+
+    series = rollups.daily_series(days)
+    daily_lines = "\n".join(
+        f"`{activity_journal.day_label(day)}`: {users} کاربر، {messages} پیام، {new} جدید، تأخیر {_format_seconds(latency)}"
+        for day, messages, users, latency, new in reversed(series)
+    )
+    average_dau = sum(row[2] for row in series) / len(series)
+    weekly_lines = "\n".join(
+        f"`{activity_journal.day_label(start)}`: {users} کاربر" for start, users in reversed(rollups.wau(4))
     )
 
+    def cell(value):
+        return "-" if value is None else f"{value:.0f}%"
+    retention_lines = "\n".join(
+        f"`{activity_journal.day_label(cohort)}` ({size}): D1 {cell(ages[1])} | D7 {cell(ages[7])} | D30 {cell(ages[30])}"
+        for cohort, size, ages in reversed(rollups.retention(45)) if size
+    )
+
+    text = (
+        f"📆 **تحلیل فعالیت کاربران**\n\n"
+        f"**کاربران فعال روزانه ({days} روز، میانگین {average_dau:.1f}):**\n{daily_lines}\n\n"
+        f"**کاربران فعال هفتگی (از دوشنبه):**\n{weekly_lines}\n\n"
+        f"**ماندگاری کاربران جدید (روز عضویت و تعداد):**\n{retention_lines or 'بدون داده'}"
+    )
+    await update.message.reply_text(text[:4000], parse_mode='Markdown')
+
+def _format_seconds(value) -> str:
+    if value is None:
+        return "-"
+    return f"{value * 1000:.0f}ms" if value < 1 else f"{value:.2f}s"
+
+def _format_percentiles(histogram) -> str:
+    if not histogram.count:
+        return "بدون داده"
+    return " | ".join(
+        f"p{label} {_format_seconds(histogram.percentile(q))}"
+        for label, q in (("50", 0.5), ("90", 0.9), ("99", 0.99), ("99.9", 0.999))
+    ) + f" (n={histogram.count})"
+
+@admin_only
+async def admin_response_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش صدک‌های زمان پاسخگویی ربات؛ `/response_stats [1m|1h|24h|all]` پنجره جزئیات را تعیین می‌کند."""
+    window = context.args[0].lower() if context.args else "1h"
+    if window not in latency_metrics.WINDOWS and window != "all":
+        await update.message.reply_text("⚠️ پنجره نامعتبر است. گزینه‌های موجود: 1m, 1h, 24h, all")
+        return
+    detail_window = None if window == "all" else window
+    metrics = latency_metrics.metrics
+
+    lines = ["📈 **آمار زمان پاسخگویی ربات**\n", "⏱ **زمان کل پاسخ:**"]
+    for name in list(latency_metrics.WINDOWS) + ["all"]:
+        histogram = metrics.histogram('total', None if name == "all" else name)
+        lines.append(f"• `{name}`: `{_format_percentiles(histogram)}`")
+
+    stage_labels = {'queue_wait': "انتظار در صف", 'upstream': "سرور مدل", 'telegram_send': "ارسال در تلگرام"}
+    lines.append(f"\n🧩 **تفکیک مراحل ({window}):**")
+    for stage, label in stage_labels.items():
+        lines.append(f"• {label}: `{_format_percentiles(metrics.histogram(stage, detail_window))}`")
+
+    models = metrics.models('upstream')
+    if len(models) > 1:
+        lines.append(f"\n🤖 **سرور مدل به تفکیک مدل ({window}):**")
+        for model in models:
+            lines.append(f"• `{model}`: `{_format_percentiles(metrics.histogram('upstream', detail_window, model))}`")
+    lines.append(f"\n📊 کل پاسخ‌های ثبت شده: `{data_manager.DATA['stats'].get('total_responses', 0)}`")
+    await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+
 @admin_only
 async def admin_add_blocked_word(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """افزودن کلمه یا عبارت به لیست کلمات مسدود شده."""
@@ -692,13 +879,10 @@ async def admin_add_blocked_word(update: Update, context: ContextTypes.DEFAULT_T
     
     word = " ".join(context.args).lower()
     
-    if word in data_manager.DATA['blocked_words']:
+    if not data_manager.add_blocked_word(word):
         await update.message.reply_text(f"⚠️ کلمه «{word}» از قبل در لیست کلمات مسدود شده وجود دارد.")
         return
     
-    data_manager.DATA['blocked_words'].append(word)
-    data_manager.save_data()
-    
     await update.message.reply_text(f"✅ کلمه «{word}» به لیست کلمات مسدود شده اضافه شد.")
 
 @admin_only
@@ -711,13 +895,10 @@ async def admin_remove_blocked_word(update: Update, context: ContextTypes.DEFAUL
     
     word = " ".join(context.args).lower()
     
-    if word not in data_manager.DATA['blocked_words']:
+    if not data_manager.remove_blocked_word(word):
         await update.message.reply_text(f"⚠️ کلمه «{word}» در لیست کلمات مسدود شده وجود ندارد.")
         return
     
-    data_manager.DATA['blocked_words'].remove(word)
-    data_manager.save_data()
-    
     await update.message.reply_text(f"✅ کلمه «{word}» از لیست کلمات مسدود شده حذف شد.")
 
 @admin_only
@@ -736,6 +917,7 @@ async def admin_system_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     bot_start_time_str = data_manager.DATA.get('bot_start_time', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
     bot_start_time = datetime.strptime(bot_start_time_str, '%Y-%m-%d %H:%M:%S')
     uptime = datetime.now() - bot_start_time
+    psutil = await asyncio.to_thread(_psutil)
     
     system_info = (
         f"💻 **اطلاعات سیستم:**\n\n"
@@ -762,28 +944,215 @@ async def admin_reset_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if stat_type == "messages":
         data_manager.DATA['stats']['total_messages'] = 0
-        for user_id in data_manager.DATA['users']:
-            data_manager.DATA['users'][user_id]['message_count'] = 0
+        data_manager.reset_message_counts()
         await update.message.reply_text("✅ آمار پیام‌ها با موفقیت ریست شد.")
     
     elif stat_type == "all":
         data_manager.DATA['stats'] = {
             'total_messages': 0,
-            'total_users': len(data_manager.DATA['users']),
-            'avg_response_time': 0,
-            'max_response_time': 0,
-            'min_response_time': 0,
+            'total_users': data_manager.user_count(),
             'total_responses': 0
         }
-        for user_id in data_manager.DATA['users']:
-            data_manager.DATA['users'][user_id]['message_count'] = 0
+        latency_metrics.metrics.reset()
+        data_manager.DATA['latency_metrics'] = {}
+        data_manager.reset_message_counts()
         await update.message.reply_text("✅ تمام آمارها با موفقیت ریست شد.")
     
     else:
         await update.message.reply_text("⚠️ نوع آمار نامعتبر است. گزینه‌های موجود: messages, all")
         return
     
-    data_manager.save_data()
+    data_manager.mark_dirty(keys=('stats', 'latency_metrics'))
+
+@admin_only
+async def admin_cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش آمار کش پاسخ‌های مدل."""
+    if response_cache is None:
+        await update.message.reply_text("کش پاسخ‌ها غیرفعال است.")
+        return
+
+    stats = await response_cache.stats()
+    disk_line = f"💽 ورودی‌های روی دیسک: `{stats['disk_entries']}`\n" if stats['disk_entries'] is not None else ""
+    await update.message.reply_text(
+        "🗃️ **آمار کش پاسخ‌ها**\n\n"
+        f"📦 ورودی‌ها: `{stats['entries']}`\n"
+        f"💾 حجم: `{stats['bytes'] / 1024:.1f}` از `{stats['max_bytes'] / 1024:.0f}` کیلوبایت\n"
+        f"{disk_line}"
+        f"✅ برخورد (حافظه): `{stats['hits']}`\n"
+        f"✅ برخورد (دیسک): `{stats['disk_hits']}`\n"
+        f"❌ عدم برخورد: `{stats['misses']}`\n"
+        f"📊 نرخ برخورد: `{stats['hit_rate'] * 100:.1f}%`\n"
+        f"🗑️ حذف‌شده (LRU): `{stats['evictions']}`\n"
+        f"⏳ TTL: `{stats['ttl']:.0f}` ثانیه",
+        parse_mode='Markdown'
+    )
+
+@admin_only
+async def admin_cache_clear(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """پاک کردن کامل کش پاسخ‌های مدل."""
+    if response_cache is None:
+        await update.message.reply_text("کش پاسخ‌ها غیرفعال است.")
+        return
+
+    await response_cache.clear()
+    await update.message.reply_text("✅ کش پاسخ‌ها پاک شد.")
+
+@admin_only
+async def admin_queue_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش وضعیت صف و درخواست‌های در حال اجرای مدل."""
+    await update.message.reply_text(
+        "🚦 **وضعیت صف درخواست‌های مدل**\n\n"
+        f"⚙️ در حال اجرا: `{admission.inflight}` از `{admission.max_inflight}`\n"
+        f"⏳ در صف: `{admission.queued}` از `{admission.max_queue}`\n"
+        f"👥 کاربران دارای درخواست در صف: `{admission.queued_users()}`\n"
+        f"✅ پذیرفته شده: `{admission.admitted}`\n"
+        f"⛔️ رد شده (صف پر): `{admission.rejected}`",
+        parse_mode='Markdown'
+    )
+
+@admin_only
+async def admin_rate_limit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش یا تنظیم محدودیت نرخ پیام‌های کاربران (0 یعنی بدون محدودیت)."""
+    if context.args:
+        if len(context.args) not in (2, 3) or context.args[0].lower() not in ('user', 'global'):
+            await update.message.reply_text(
+                "⚠️ فرمت صحیح: `/rate_limit user 12 5` یا `/rate_limit global 600 100`\n"
+                "(تعداد پیام مجاز در دقیقه و ظرفیت پیام‌های پشت سر هم؛ 0 برای غیرفعال کردن)",
+                parse_mode='Markdown'
+            )
+            return
+        scope = context.args[0].lower()
+        try:
+            per_minute = float(context.args[1])
+            burst = int(context.args[2]) if len(context.args) == 3 else None
+        except ValueError:
+            await update.message.reply_text("⚠️ مقادیر باید عددی باشند.")
+            return
+        if per_minute < 0 or (burst is not None and burst < 1):
+            await update.message.reply_text("⚠️ نرخ نمی‌تواند منفی باشد و ظرفیت باید حداقل 1 باشد.")
+            return
+
+        settings = data_manager.DATA.setdefault('rate_limits', {})
+        settings[f'{scope}_per_minute'] = per_minute
+        if burst is not None:
+            settings[f'{scope}_burst'] = burst
+        rate_limiter.configure(**settings)
+        data_manager.mark_dirty(keys=('rate_limits',))
+        logger.info("Admin %s set %s rate limit to %s/min (burst %s).", update.effective_user.id, scope, per_minute, burst)
+
+    def describe(per_minute, burst):
+        return "بدون محدودیت" if per_minute <= 0 else f"{per_minute:g} پیام در دقیقه (ظرفیت {burst})"
+
+    limits = rate_limiter.settings()
+    await update.message.reply_text(
+        "⏳ **محدودیت نرخ پیام‌ها**\n\n"
+        f"👤 هر کاربر: `{describe(limits['user_per_minute'], limits['user_burst'])}`\n"
+        f"🌐 سراسری: `{describe(limits['global_per_minute'], limits['global_burst'])}`\n"
+        f"📦 کاربران دارای سطل فعال: `{len(rate_limiter)}`\n"
+        f"⛔️ پیام‌های رد شده: `{rate_limiter.rejected}`",
+        parse_mode='Markdown'
+    )
+
+@admin_only
+async def admin_broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش وضعیت زنده ارسال‌های همگانی (یا یک ارسال مشخص)."""
+    if context.args:
+        if not context.args[0].isdigit() or broadcast.get_job(int(context.args[0])) is None:
+            await update.message.reply_text("⚠️ شماره ارسال همگانی نامعتبر است.")
+            return
+        jobs = [broadcast.get_job(int(context.args[0]))]
+    else:
+        jobs = broadcast.active_jobs()
+        if not jobs:
+            finished = data_manager.DATA['broadcast_jobs'][-1:]
+            if not finished:
+                await update.message.reply_text("هیچ ارسال همگانی ثبت نشده است.")
+                return
+            jobs = finished
+
+    reports = []
+    for job in jobs:
+        progress = broadcast.get_progress(job['id'])
+        reports.append(broadcast.format_report(job, progress.result if progress else None))
+    await update.message.reply_text("\n\n".join(reports), parse_mode='Markdown')
+
+@admin_only
+async def admin_broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """لغو یک ارسال همگانی در حال اجرا."""
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("⚠️ لطفاً شماره ارسال همگانی را وارد کنید.\nمثال: `/broadcast_cancel 3`", parse_mode='Markdown')
+        return
+
+    job_id = int(context.args[0])
+    if not broadcast.cancel_job(job_id):
+        await update.message.reply_text("⚠️ ارسال همگانی فعالی با این شماره وجود ندارد.")
+        return
+    logger.info("Admin %s cancelled broadcast job #%s.", update.effective_user.id, job_id)
+    await update.message.reply_text(f"🛑 ارسال همگانی #{job_id} لغو شد.")
+
+@admin_only
+async def admin_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش آمار حافظه گفتگو یا تاریخچه گفتگوی یک کاربر."""
+    if conversation_store is None:
+        await update.message.reply_text("حافظه گفتگو غیرفعال است.")
+        return
+
+    if not context.args:
+        stats = await conversation_store.stats()
+        spilled_line = f"💽 گفتگوهای روی دیسک: `{stats['spilled']}`\n" if stats['spilled'] is not None else ""
+        await update.message.reply_text(
+            "💬 **حافظه گفتگو**\n\n"
+            f"🧠 گفتگوهای در حافظه: `{stats['conversations']}` از `{stats['max_conversations']}`\n"
+            f"{spilled_line}"
+            f"🔢 بودجه توکن هر گفتگو: `{stats['max_tokens']}`\n"
+            f"⏳ انقضا پس از: `{stats['ttl'] / 3600:.1f}` ساعت عدم فعالیت\n"
+            f"🗑️ حذف‌شده (LRU): `{stats['evictions']}`",
+            parse_mode='Markdown'
+        )
+        return
+
+    try:
+        user_id = int(context.args[0])
+    except ValueError:
+        await update.message.reply_text("⚠️ لطفاً یک آیدی عددی معتبر وارد کنید.")
+        return
+
+    found = await conversation_store.inspect(user_id)
+    if found is None:
+        await update.message.reply_text(f"کاربر `{user_id}` تاریخچه گفتگوی فعالی ندارد.", parse_mode='Markdown')
+        return
+
+    turns, tokens, updated = found
+    lines = [f"💬 تاریخچه گفتگوی {user_id} ({len(turns)} پیام، حدود {tokens} توکن، آخرین فعالیت {data_manager.format_timestamp(updated)}):", ""]
+    for role, content in turns[-10:]:
+        prefix = "👤" if role == "user" else "🤖"
+        lines.append(f"{prefix} {content[:200]}")
+    # بدون Markdown ارسال می‌شود چون متن گفتگو ممکن است کاراکترهای خاص داشته باشد
+    await update.message.reply_text("\n".join(lines)[:4000])
+
+@admin_only
+async def admin_router_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش وضعیت سرورهای مدل: تأخیر، نرخ خطا و وضعیت مدارشکن."""
+    state_labels = {'closed': "🟢 سالم", 'half_open': "🟡 در حال آزمایش", 'open': "🔴 قطع (مدارشکن باز)"}
+
+    def seconds(value):
+        return f"{value:.2f}s" if value is not None else "-"
+
+    lines = ["🛰️ **وضعیت سرورهای مدل**", ""]
+    for stats in model_router.stats():
+        lines.append(
+            f"**{stats['name']}** ({state_labels.get(stats['state'], stats['state'])})\n"
+            f"  پاسخ کامل p50: `{seconds(stats['p50'])}` | p95: `{seconds(stats['p95'])}`\n"
+            f"  اولین توکن p50: `{seconds(stats['ttft_p50'])}` | p95: `{seconds(stats['ttft_p95'])}`\n  "
+            f"خطا: `{stats['error_rate'] * 100:.0f}%` | درخواست‌ها: `{stats['requests']}`"
+            + (f" | میانگین دسته: `{stats['avg_batch']:.1f}`" if stats['avg_batch'] is not None else "")
+        )
+    lines.append("")
+    lines.append(
+        f"🔀 درخواست‌های پشتیبان (hedge): `{model_router.hedged}` (برنده: `{model_router.hedge_wins}`) | "
+        f"انتقال به سرور دیگر: `{model_router.failovers}`"
+    )
+    await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
 
 # --- هندلر برای دکمه‌های صفحه‌بندی ---
 async def users_list_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -796,47 +1165,6 @@ async def users_list_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         context.args = [str(page)]
         await admin_users_list(update, context)
 
-# --- تابع برای پردازش ارسال‌های برنامه‌ریزی شده ---
-async def process_scheduled_broadcasts(context: ContextTypes.DEFAULT_TYPE):
-    """پردازش ارسال‌های برنامه‌ریزی شده و ارسال پیام‌ها در زمان مقرر."""
-    now = datetime.now()
-    broadcasts_to_send_indices = []
-    
-    for i, broadcast in enumerate(data_manager.DATA['scheduled_broadcasts']):
-        if broadcast['status'] == 'pending':
-            broadcast_time = datetime.strptime(broadcast['time'], '%Y-%m-%d %H:%M:%S')
-            if broadcast_time <= now:
-                broadcasts_to_send_indices.append(i)
-
-    if not broadcasts_to_send_indices:
-        return
-    
-    user_ids = list(data_manager.DATA['users'].keys())
-    
-    for index in broadcasts_to_send_indices:
-        broadcast = data_manager.DATA['scheduled_broadcasts'][index]
-        message_text = broadcast['message']
-        total_sent, total_failed = 0, 0
-        
-        for user_id_str in user_ids:
-            try:
-                await context.bot.send_message(chat_id=int(user_id_str), text=message_text)
-                total_sent += 1
-                await asyncio.sleep(0.05)
-            except TelegramError as e:
-                logger.warning(f"Failed to send scheduled broadcast to {user_id_str}: {e}")
-                total_failed += 1
-        
-        # به‌روزرسانی وضعیت ارسال
-        data_manager.DATA['scheduled_broadcasts'][index]['status'] = 'sent'
-        data_manager.DATA['scheduled_broadcasts'][index]['sent_time'] = now.strftime('%Y-%m-%d %H:%M:%S')
-        data_manager.DATA['scheduled_broadcasts'][index]['sent_count'] = total_sent
-        data_manager.DATA['scheduled_broadcasts'][index]['failed_count'] = total_failed
-        
-        logger.info(f"Scheduled broadcast sent: {total_sent} successful, {total_failed} failed")
-    
-    data_manager.save_data()
-
 # --- تابع راه‌اندازی هندلرها ---
 def setup_admin_handlers(application):
     """هندلرهای پنل ادمین را به اپلیکیشن اضافه می‌کند."""
@@ -852,10 +1180,12 @@ def setup_admin_handlers(application):
     application.add_handler(CommandHandler("users_list", admin_users_list))
     application.add_handler(CommandHandler("user_search", admin_user_search))
     application.add_handler(CommandHandler("backup", admin_backup))
+    application.add_handler(CommandHandler("restore", admin_restore))
     
     # هندلرهای جدید
     application.add_handler(CommandHandler("targeted_broadcast", admin_targeted_broadcast))
     application.add_handler(CommandHandler("schedule_broadcast", admin_schedule_broadcast))
+    application.add_handler(CommandHandler("schedule_recurring", admin_schedule_recurring))
     application.add_handler(CommandHandler("list_scheduled", admin_list_scheduled_broadcasts))
     application.add_handler(CommandHandler("remove_scheduled", admin_remove_scheduled_broadcast))
     application.add_handler(CommandHandler("direct_message", admin_direct_message))
@@ -864,17 +1194,28 @@ def setup_admin_handlers(application):
     application.add_handler(CommandHandler("set_welcome", admin_set_welcome_message))
     application.add_handler(CommandHandler("set_goodbye", admin_set_goodbye_message))
     application.add_handler(CommandHandler("activity_heatmap", admin_activity_heatmap))
+    application.add_handler(CommandHandler("analytics", admin_analytics))
+    application.add_handler(CommandHandler("messages_chart", admin_messages_chart))
+    application.add_handler(CommandHandler("latency_chart", admin_latency_chart))
     application.add_handler(CommandHandler("response_stats", admin_response_stats))
     application.add_handler(CommandHandler("add_blocked_word", admin_add_blocked_word))
     application.add_handler(CommandHandler("remove_blocked_word", admin_remove_blocked_word))
     application.add_handler(CommandHandler("list_blocked_words", admin_list_blocked_words))
     application.add_handler(CommandHandler("system_info", admin_system_info))
     application.add_handler(CommandHandler("reset_stats", admin_reset_stats))
+    application.add_handler(CommandHandler("cache_stats", admin_cache_stats))
+    application.add_handler(CommandHandler("cache_clear", admin_cache_clear))
+    application.add_handler(CommandHandler("queue_status", admin_queue_status))
+    application.add_handler(CommandHandler("rate_limit", admin_rate_limit))
+    application.add_handler(CommandHandler("broadcast_status", admin_broadcast_status))
+    application.add_handler(CommandHandler("broadcast_cancel", admin_broadcast_cancel))
+    application.add_handler(CommandHandler("conversation", admin_conversation))
+    application.add_handler(CommandHandler("router_status", admin_router_status))
     
     # هندلر برای دکمه‌های صفحه‌بندی
     application.add_handler(CallbackQueryHandler(users_list_callback, pattern="^users_list:"))
     
-    # شروع وظیفه دوره‌ای برای بررسی ارسال‌های برنامه‌ریزی شده
-    application.job_queue.run_repeating(process_scheduled_broadcasts, interval=60, first=0)
+    # تنظیم زمان‌بند ارسال‌های برنامه‌ریزی شده (فقط برای نزدیک‌ترین ارسال یک callback تنظیم می‌شود)
+    scheduler.start(application)
     
     logger.info("Admin panel handlers have been set up.")
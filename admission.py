@@ -0,0 +1,126 @@
+# admission.py
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """صف انتظار پر است و درخواست باید فوراً با پیام «مشغول» رد شود."""
+
+
+class AdmissionController:
+    """محدودکننده سراسری درخواست‌های هم‌زمان به مدل با صف عادلانه بین کاربران.
+
+    حداکثر `max_inflight` درخواست هم‌زمان اجرا می‌شود و بقیه در صفی با ظرفیت `max_queue`
+    منتظر می‌مانند. صف هر کاربر جداست و نوبت‌ها به‌صورت چرخشی (round-robin) بین کاربران
+    تقسیم می‌شود تا یک کاربر پرکار نتواند بقیه را پشت سر خود نگه دارد. درخواست‌های ادمین
+    صف جداگانه با اولویت بالاتر دارند و مشمول سقف صف نمی‌شوند.
+    """
+
+    def __init__(self, max_inflight: int, max_queue: int):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self._inflight = 0
+        self._queued = 0
+        self._priority = deque()
+        self._queues = {}      # user_id -> deque of futures
+        self._ring = deque()   # کاربرانی که درخواست در صف دارند، به ترتیب نوبت
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def queued_users(self) -> int:
+        return len(self._queues)
+
+    async def acquire(self, user_id: int, priority: bool = False) -> float:
+        """یک جایگاه اجرا می‌گیرد و مدت انتظار در صف (ثانیه) را برمی‌گرداند."""
+        if self._inflight < self.max_inflight and self._queued == 0:
+            self._inflight += 1
+            self.admitted += 1
+            return 0.0
+
+        if not priority and self._queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError()
+
+        future = asyncio.get_running_loop().create_future()
+        if priority:
+            self._priority.append(future)
+        else:
+            queue = self._queues.get(user_id)
+            if queue is None:
+                queue = self._queues[user_id] = deque()
+                self._ring.append(user_id)
+            queue.append(future)
+        self._queued += 1
+
+        start = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # جایگاه واگذار شده بود ولی منتظر لغو شد؛ آن را به نفر بعدی می‌دهیم
+                self.release()
+            else:
+                # future لغو شده در صف می‌ماند و هنگام نوبت‌دهی نادیده گرفته می‌شود
+                self._queued -= 1
+            raise
+        self.admitted += 1
+        return time.monotonic() - start
+
+    def release(self):
+        """جایگاه اجرا را آزاد کرده و به درخواست بعدی در صف می‌دهد."""
+        self._inflight -= 1
+        while self._inflight < self.max_inflight:
+            future = self._next_waiter()
+            if future is None:
+                return
+            self._queued -= 1
+            self._inflight += 1
+            future.set_result(None)
+
+    def _next_waiter(self):
+        while self._priority:
+            future = self._priority.popleft()
+            if not future.done():
+                return future
+        while self._ring:
+            user_id = self._ring.popleft()
+            queue = self._queues[user_id]
+            future = queue.popleft()
+            if queue:
+                self._ring.append(user_id)
+            else:
+                del self._queues[user_id]
+            if not future.done():
+                return future
+        return None
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, priority: bool = False):
+        """context manager برای گرفتن و آزاد کردن جایگاه اجرا؛ مدت انتظار را برمی‌گرداند."""
+        waited = await self.acquire(user_id, priority)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+
+# --- نمونه سراسری ---
+LLM_MAX_INFLIGHT = int(os.environ.get("LLM_MAX_INFLIGHT", "32"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "200"))
+
+controller = AdmissionController(LLM_MAX_INFLIGHT, LLM_MAX_QUEUE)
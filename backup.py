@@ -0,0 +1,238 @@
+# backup.py
+
+import os
+import re
+import gzip
+import json
+import time
+import logging
+import threading
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+# مجموعه‌های شناسه که در لاگ تغییرات به صورت افزوده/حذف شده ثبت می‌شوند
+_SET_KEYS = ('banned_users', 'unreachable_users')
+_SNAPSHOT_NAME = re.compile(r"^snapshot-(\d+)\.json\.gz$")
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class BackupManager:
+    """نسخه پشتیبان افزایشی: تصویر کامل فشرده به همراه لاگ تغییرات (فقط افزودنی) پس از آن.
+
+    هر بار که داده‌ها روی دیسک ذخیره می‌شوند، تغییرات همان نوبت (رکورد کاربران تغییر کرده، افزوده/حذف
+    شده‌های مجموعه‌ها و کلیدهای تغییر کرده) به عنوان یک خط JSON در `delta-<ts>.jsonl.gz` تصویر جاری
+    اضافه می‌شود. تصویر کامل جدید هر `snapshot_interval` ثانیه، با بزرگ شدن لاگ از `max_delta_bytes`
+    یا پس از ذخیره کامل داده‌ها گرفته می‌شود و فقط `keep_snapshots` تصویر آخر (با لاگ‌هایشان) نگه
+    داشته می‌شوند. بازیابی به هر لحظه با اعمال لاگ تغییرات روی آخرین تصویر پیش از آن لحظه انجام می‌شود.
+
+    `prepare` روی حلقه رویداد (جایی که DATA تغییر می‌کند) فقط کپی تغییرات را می‌گیرد (storage.copy_changes)
+    و تبدیل به JSON، محاسبه تفاضل مجموعه‌ها و نوشتن در `write` (در ترد) انجام می‌شود.
+    """
+
+    def __init__(self, directory: str, snapshot_interval: float, keep_snapshots: int, max_delta_bytes: int):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.keep_snapshots = max(1, keep_snapshots)
+        self.max_delta_bytes = max_delta_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        snapshots = self.snapshots()
+        self._current = snapshots[-1][0] if snapshots else None   # زمان تصویر جاری (میلی‌ثانیه)
+        self._last_snapshot_at = self._current / 1000 if self._current else 0.0
+        self._delta_bytes = self._size(self.delta_path(self._current)) if self._current else 0
+        self._force_snapshot = False
+        # مجموعه‌های ثبت شده تا آخرین خط لاگ؛ افزوده/حذف شده‌ها نسبت به همین وضعیت محاسبه می‌شوند
+        self._sets = {}
+
+    # --- مسیرها ---
+    def snapshot_path(self, ts: int) -> str:
+        return os.path.join(self.directory, f"snapshot-{ts}.json.gz")
+
+    def delta_path(self, ts: int) -> str:
+        return os.path.join(self.directory, f"delta-{ts}.jsonl.gz")
+
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def snapshots(self) -> list:
+        """(زمان به میلی‌ثانیه، مسیر) تصویرهای موجود از قدیم به جدید."""
+        found = []
+        for name in os.listdir(self.directory):
+            match = _SNAPSHOT_NAME.match(name)
+            if match:
+                found.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def latest(self):
+        """(مسیر تصویر، مسیر لاگ تغییرات یا None) برای آخرین نسخه پشتیبان یا None."""
+        if self._current is None:
+            return None
+        delta = self.delta_path(self._current)
+        return self.snapshot_path(self._current), delta if os.path.exists(delta) else None
+
+    # --- ثبت ---
+    def _snapshot_due(self, now: float) -> bool:
+        return (self._force_snapshot or self._current is None
+                or now - self._last_snapshot_at >= self.snapshot_interval
+                or self._delta_bytes >= self.max_delta_bytes)
+
+    def prepare(self, data: dict, dirty_users=None, dirty_keys=None, force_snapshot: bool = False):
+        """کار نوشتن این نوبت را آماده می‌کند: ('snapshot' یا 'delta'، ts، کپی تغییرات).
+
+        dirty_users و dirty_keys همان کاربران و کلیدهایی هستند که ذخیره‌ساز در این نوبت می‌نویسد؛
+        None برای dirty_users یعنی ذخیره کامل و به تصویر کامل جدید منجر می‌شود.
+        """
+        now = time.time()
+        if force_snapshot or dirty_users is None or self._snapshot_due(now):
+            return 'snapshot', now, storage.copy_changes(data)
+        return 'delta', now, storage.copy_changes(data, dirty_users, dirty_keys)
+
+    def _snapshot_payload(self, changes: dict) -> str:
+        keys = changes['keys']
+        self._sets = {key: set(keys.get(key, ())) for key in _SET_KEYS}
+        snapshot = {'users': {str(row[0]): storage.user_row_to_dict(row) for row in changes['users']}}
+        snapshot.update((key, storage.json_value(value)) for key, value in keys.items())
+        return _dumps(snapshot)
+
+    def _delta_line(self, now: float, changes: dict):
+        parts = [f'"ts":{now}']
+        if changes['users']:
+            users = {str(row[0]): storage.user_row_to_dict(row) for row in changes['users']}
+            parts.append(f'"users":{_dumps(users)}')
+
+        keys = changes['keys']
+        sets = {}
+        for key in _SET_KEYS:
+            if key not in keys:
+                continue
+            current = keys[key]
+            previous = self._sets.get(key)
+            if previous is None:
+                sets[key] = {'set': list(current)}
+            else:
+                added, removed = current - previous, previous - current
+                if not added and not removed:
+                    continue
+                sets[key] = {'add': list(added), 'remove': list(removed)}
+            self._sets[key] = current
+        if sets:
+            parts.append(f'"sets":{_dumps(sets)}')
+
+        changed_keys = {key: storage.json_value(value) for key, value in keys.items() if key not in _SET_KEYS}
+        if changed_keys:
+            parts.append(f'"keys":{_dumps(changed_keys)}')
+        return '{' + ','.join(parts) + '}\n'
+
+    def write(self, job):
+        """نتیجه `prepare` را به JSON تبدیل کرده و روی دیسک می‌نویسد (برای اجرا در ترد)."""
+        if job is None:
+            return
+        kind, now, changes = job
+        with self._lock:
+            try:
+                if kind == 'snapshot':
+                    self._write_snapshot(int(now * 1000), self._snapshot_payload(changes))
+                else:
+                    line = self._delta_line(now, changes)
+                    # هر نوبت یک عضو gzip جدا به انتهای فایل اضافه می‌کند؛ gzip.open همه را پشت سر هم می‌خواند
+                    with gzip.open(self.delta_path(self._current), 'ab') as f:
+                        f.write(line.encode('utf-8'))
+                    self._delta_bytes = self._size(self.delta_path(self._current))
+            except Exception:
+                # تغییرات این نوبت در لاگ نیامده است؛ نوبت بعد تصویر کامل گرفته می‌شود
+                self._force_snapshot = True
+                raise
+
+    def _write_snapshot(self, ts: int, payload: str):
+        path = self.snapshot_path(ts)
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, 'wb') as f:
+            f.write(payload.encode('utf-8'))
+        os.replace(tmp_path, path)
+        self._current = ts
+        self._last_snapshot_at = ts / 1000
+        self._delta_bytes = 0
+        self._force_snapshot = False
+        logger.info("Backup snapshot written: %s (%d bytes)", os.path.basename(path), self._size(path))
+        self._prune()
+
+    def _prune(self):
+        for ts, path in self.snapshots()[:-self.keep_snapshots]:
+            for old in (path, self.delta_path(ts)):
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+
+    # --- بازیابی ---
+    def restore(self, target: float):
+        """داده‌ها (در قالب bot_data.json) را در لحظه `target` (epoch) بازسازی می‌کند؛ None اگر تصویری پیش از آن نباشد."""
+        base = None
+        for ts, path in self.snapshots():
+            if ts / 1000 <= target:
+                base = (ts, path)
+        if base is None:
+            return None
+        ts, path = base
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        applied = 0
+        for record in self._read_delta(self.delta_path(ts)):
+            if record['ts'] > target:
+                break
+            data.setdefault('users', {}).update(record.get('users', {}))
+            for key, change in record.get('sets', {}).items():
+                if 'set' in change:
+                    data[key] = change['set']
+                else:
+                    current = set(data.get(key, ()))
+                    current.update(change['add'])
+                    current.difference_update(change['remove'])
+                    data[key] = list(current)
+            data.update(record.get('keys', {}))
+            applied += 1
+        logger.info("Restored backup %s with %d delta records up to %s.", os.path.basename(path), applied, target)
+        return data
+
+    @staticmethod
+    def _read_delta(path: str):
+        if not os.path.exists(path):
+            return
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError) as e:
+            # آخرین عضو ممکن است هنگام قطع ناگهانی نیمه‌کاره مانده باشد
+            logger.warning("Backup delta log %s is truncated: %s", os.path.basename(path), e)
+
+    def stats(self) -> dict:
+        snapshots = self.snapshots()
+        return {
+            'snapshots': len(snapshots),
+            'oldest': snapshots[0][0] / 1000 if snapshots else None,
+            'latest': self._current / 1000 if self._current else None,
+            'delta_bytes': self._delta_bytes,
+            'total_bytes': sum(self._size(p) + self._size(self.delta_path(ts)) for ts, p in snapshots),
+        }
+
+
+# --- نمونه سراسری ---
+BACKUP_ENABLED = os.environ.get("BACKUP_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+BACKUP_DIR = os.environ.get("BACKUP_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "backups"))
+BACKUP_SNAPSHOT_HOURS = float(os.environ.get("BACKUP_SNAPSHOT_HOURS", "6"))
+BACKUP_KEEP_SNAPSHOTS = int(os.environ.get("BACKUP_KEEP_SNAPSHOTS", "8"))
+BACKUP_DELTA_MAX_MB = float(os.environ.get("BACKUP_DELTA_MAX_MB", "20"))
+
+manager = BackupManager(BACKUP_DIR, BACKUP_SNAPSHOT_HOURS * 3600, BACKUP_KEEP_SNAPSHOTS,
+                        int(BACKUP_DELTA_MAX_MB * 1024 * 1024)) if BACKUP_ENABLED else None
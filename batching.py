@@ -0,0 +1,154 @@
+# batching.py
+
+import json
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# --- قالب‌های تبدیل گفتگو به متن ورودی (برای endpoint غیرگفتگویی completions) ---
+def _render_gemma(messages: list) -> str:
+    parts = []
+    for message in messages:
+        role = "model" if message["role"] == "assistant" else "user"
+        parts.append(f"<start_of_turn>{role}\n{message['content']}<end_of_turn>\n")
+    parts.append("<start_of_turn>model\n")
+    return "".join(parts)
+
+
+def _render_chatml(messages: list) -> str:
+    parts = [f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages]
+    parts.append("<|im_start|>assistant\n")
+    return "".join(parts)
+
+
+# نام قالب -> (تابع ساخت متن، توالی‌های پایان)
+PROMPT_TEMPLATES = {
+    "gemma": (_render_gemma, ["<end_of_turn>"]),
+    "chatml": (_render_chatml, ["<|im_end|>"]),
+}
+
+
+class _Pending:
+    """یک درخواست منتظر در دسته جاری."""
+
+    __slots__ = ('prompt', 'future', 'on_text', 'text')
+
+    def __init__(self, prompt: str, future, on_text):
+        self.prompt = prompt
+        self.future = future
+        self.on_text = on_text
+        self.text = ""
+
+
+class MicroBatcher:
+    """جمع‌آوری درخواست‌های هم‌زمان در بازه‌ای کوتاه و ارسال آن‌ها در یک درخواست دسته‌ای.
+
+    درخواست‌ها تا `window` ثانیه یا تا رسیدن به `max_batch` درخواست جمع می‌شوند و سپس با یک
+    فراخوانی endpoint `completions` با لیست prompt ها ارسال می‌شوند؛ هر پاسخ (یا در حالت جریانی هر
+    تکه) با اندیس choice به درخواست خودش برگردانده می‌شود. فقط درخواست‌هایی با پارامترهای نمونه‌برداری
+    یکسان در یک دسته قرار می‌گیرند. مناسب سرورهای خودمیزبان سازگار با OpenAI (مثل vLLM) است.
+    """
+
+    def __init__(self, client, model: str, template: str = "gemma", window: float = 0.02,
+                 max_batch: int = 16, max_tokens: int = 1024):
+        if template not in PROMPT_TEMPLATES:
+            raise ValueError(f"قالب ناشناخته: {template}")
+        self.client = client
+        self.model = model
+        self._render, self._stop = PROMPT_TEMPLATES[template]
+        self.window = window
+        self.max_batch = max_batch
+        self.max_tokens = max_tokens
+        self._groups = {}   # (params, stream) -> (list of _Pending, timer handle, params)
+        # وظایف ارسال در حال اجرا؛ حلقه رویداد فقط ارجاع ضعیف به وظایف نگه می‌دارد
+        self._tasks = set()
+        self.batches = 0
+        self.batched_requests = 0
+
+    @property
+    def average_batch(self) -> float:
+        return self.batched_requests / self.batches if self.batches else 0.0
+
+    async def submit(self, messages: list, params: dict, on_text=None) -> str:
+        """درخواست را به دسته جاری اضافه کرده و متن پاسخ آن را برمی‌گرداند."""
+        loop = asyncio.get_running_loop()
+        key = (json.dumps(params, sort_keys=True), on_text is not None)
+        pending = _Pending(self._render(messages), loop.create_future(), on_text)
+
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = ([], loop.call_later(self.window, self._flush, key), params)
+        group[0].append(pending)
+        if len(group[0]) >= self.max_batch:
+            self._flush(key)
+
+        return await pending.future
+
+    def _flush(self, key):
+        group = self._groups.pop(key, None)
+        if group is None:
+            return
+        batch, timer, params = group
+        timer.cancel()
+        self.batches += 1
+        self.batched_requests += len(batch)
+        task = asyncio.create_task(self._dispatch(batch, params, key[1]))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self, timeout: float = 5.0):
+        """دسته‌های در حال جمع‌آوری را ارسال کرده و تا `timeout` ثانیه منتظر پایان ارسال‌ها می‌ماند؛ بقیه لغو می‌شوند."""
+        for key in list(self._groups):
+            self._flush(key)
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning("Cancelled %s in-flight batched completions on shutdown.", len(pending), extra={'model': self.model})
+
+    async def _dispatch(self, batch: list, params: dict, stream: bool):
+        prompts = [pending.prompt for pending in batch]
+        try:
+            response = await self.client.completions.create(
+                model=self.model, prompt=prompts, stream=stream, stop=self._stop,
+                max_tokens=self.max_tokens, **params
+            )
+            if stream:
+                try:
+                    async for chunk in response:
+                        for choice in chunk.choices:
+                            pending = batch[choice.index]
+                            if choice.text and not pending.future.done():
+                                pending.text += choice.text
+                                pending.on_text(pending.text)
+                        if all(pending.future.done() for pending in batch):
+                            # همه منتظرها لغو شده‌اند؛ ادامه تولید بی‌فایده است
+                            break
+                finally:
+                    await response.close()
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_result(pending.text)
+            else:
+                for choice in response.choices:
+                    pending = batch[choice.index]
+                    if not pending.future.done():
+                        pending.future.set_result(choice.text or "")
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_result("")
+        except asyncio.CancelledError:
+            # منتظرها نباید برای همیشه بی‌پاسخ بمانند
+            for pending in batch:
+                pending.future.cancel()
+            raise
+        except Exception as e:
+            logger.warning("Batched completion of %s prompts failed: %s", len(batch), e, extra={'model': self.model})
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
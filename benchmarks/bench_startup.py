@@ -0,0 +1,93 @@
+# benchmarks/bench_startup.py
+#
+# اندازه‌گیری زمان شروع سرد: وارد کردن ماژول‌هایی که main.py پیش از سرویس‌دهی بارگذاری می‌کند،
+# در یک فرایند تازه با `python -X importtime`. کندترین ماژول‌ها (بر اساس زمان تجمعی) و اینکه آیا
+# کتابخانه‌های سنگین پنل ادمین (matplotlib، psutil) هنگام شروع بارگذاری شده‌اند گزارش می‌شود.
+# با --with-heavy همین اندازه‌گیری با بارگذاری کتابخانه‌های سنگین هم انجام می‌شود تا صرفه‌جویی دیده شود.
+#
+# اجرا:  python benchmarks/bench_startup.py [--runs N] [--top N] [--with-heavy]
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ماژول‌هایی که main.py وارد می‌کند (خود main به دلیل اثرات جانبی مثل ترد keep-alive وارد نمی‌شود)
+STARTUP_MODULES = (
+    "telegram", "telegram.ext", "httpx", "stream_writer", "response_cache", "request_coalescer",
+    "admission", "rate_limit", "broadcast", "conversation", "model_router", "latency_metrics",
+    "log_setup", "web_server", "data_manager", "activity_journal", "charts", "admin_panel",
+)
+HEAVY_MODULES = ("matplotlib", "psutil")
+
+
+def _run_once(extra_imports=()) -> tuple:
+    """(زمان کل به ثانیه، لیست (ماژول، زمان خود، زمان تجمعی) به میکروثانیه، ماژول‌های سنگین بارگذاری شده)."""
+    imports = "; ".join(f"import {name}" for name in STARTUP_MODULES + tuple(extra_imports))
+    probe = f"{imports}; import sys; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    # کش‌های روی دیسک غیرفعال و فایل SQLite در پوشه موقت است؛ داده‌های JSON همان فایل ربات خوانده می‌شود
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, PYTHONPATH=ROOT, SQLITE_FILE=os.path.join(workdir, "bench.db"),
+                   RESPONSE_CACHE_FILE="", CONVERSATION_SPILL_FILE="")
+        started = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", probe],
+                              cwd=workdir, env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise SystemExit(f"import failed:\n{proc.stderr[-2000:]}")
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return elapsed, modules, loaded
+
+
+def _report(title: str, runs: int, top: int, extra_imports=()):
+    timings = []
+    for _ in range(runs):
+        elapsed, modules, loaded = _run_once(extra_imports)
+        timings.append(elapsed)
+    total_us = sum(self_us for _, self_us, _ in modules)
+
+    print(f"== {title} ==")
+    print(f"process wall time: median {statistics.median(timings) * 1000:.0f} ms, "
+          f"min {min(timings) * 1000:.0f} ms over {runs} runs")
+    print(f"import time (last run): {total_us / 1000:.0f} ms across {len(modules)} modules")
+    print(f"heavy admin modules loaded at startup: {', '.join(loaded) or 'none'}")
+    print(f"{'module':<40}{'self (ms)':>12}{'cumulative (ms)':>18}")
+    # فقط ماژول‌های سطح بالا (کمترین تورفتگی) تا زمان تجمعی دو بار شمرده نشود
+    depth = lambda name: len(name) - len(name.lstrip())
+    root_depth = min((depth(m[0]) for m in modules), default=0)
+    roots = [m for m in modules if depth(m[0]) == root_depth]
+    for name, self_us, cumulative_us in sorted(roots, key=lambda m: m[2], reverse=True)[:top]:
+        print(f"{name.strip():<40}{self_us / 1000:>12.1f}{cumulative_us / 1000:>18.1f}")
+    print()
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--with-heavy", action="store_true",
+                        help="also measure startup with matplotlib.figure and psutil imported eagerly")
+    args = parser.parse_args()
+
+    lazy = _report("startup (lazy admin dependencies)", args.runs, args.top)
+    if args.with_heavy:
+        eager = _report("startup (eager admin dependencies)", args.runs, args.top,
+                        ("matplotlib.figure", "psutil"))
+        print(f"saved by lazy loading: {(eager - lazy) * 1000:.0f} ms ({100 * (1 - lazy / eager):.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
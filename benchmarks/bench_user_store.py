@@ -0,0 +1,83 @@
+# benchmarks/bench_user_store.py
+#
+# مقایسه حافظه مصرفی به ازای هر کاربر و هزینه جستجو بین قالب قدیمی
+# (دیکشنری با کلید رشته‌ای و زمان‌های رشته‌ای) و UserStore فشرده.
+#
+# اجرا:  python benchmarks/bench_user_store.py [تعداد کاربران]
+
+import os
+import sys
+import time
+import random
+import timeit
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from user_store import UserRecord, UserStore
+
+
+def _sample_users(count: int):
+    base = int(time.time()) - 90 * 86400
+    rnd = random.Random(42)
+    for i in range(count):
+        user_id = 100_000_000 + i * 7
+        first_seen = base + rnd.randrange(90 * 86400)
+        last_seen = first_seen + rnd.randrange(86400)
+        yield user_id, f"user{i}", (f"name_{i}" if i % 3 else None), first_seen, last_seen, rnd.randrange(500)
+
+
+def build_legacy(count: int) -> dict:
+    users = {}
+    for user_id, first_name, username, first_seen, last_seen, message_count in _sample_users(count):
+        users[str(user_id)] = {
+            'first_name': first_name,
+            'username': username,
+            'first_seen': datetime.fromtimestamp(first_seen).strftime('%Y-%m-%d %H:%M:%S'),
+            'message_count': message_count,
+            'last_seen': datetime.fromtimestamp(last_seen).strftime('%Y-%m-%d %H:%M:%S'),
+        }
+    return users
+
+
+def build_compact(count: int) -> UserStore:
+    store = UserStore()
+    for user_id, first_name, username, first_seen, last_seen, message_count in _sample_users(count):
+        store.add(user_id, UserRecord(first_name, username, first_seen, last_seen, message_count))
+    return store
+
+
+def measure(builder, count: int):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    users = builder(count)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return users, (after - before) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    probe_ids = [100_000_000 + i * 7 for i in random.Random(1).sample(range(count), 1000)]
+
+    legacy, legacy_bytes = measure(build_legacy, count)
+    legacy_lookup = min(timeit.repeat(
+        lambda: [legacy[str(uid)]['message_count'] for uid in probe_ids], number=100, repeat=5
+    )) / (100 * len(probe_ids))
+    del legacy
+
+    compact, compact_bytes = measure(build_compact, count)
+    compact_lookup = min(timeit.repeat(
+        lambda: [compact.get(uid).message_count for uid in probe_ids], number=100, repeat=5
+    )) / (100 * len(probe_ids))
+
+    print(f"users: {count}")
+    print(f"{'store':<28}{'bytes/user':>12}{'lookup (ns)':>14}")
+    print(f"{'dict[str, dict] + str dates':<28}{legacy_bytes:>12.0f}{legacy_lookup * 1e9:>14.0f}")
+    print(f"{'UserStore (slots, int ids)':<28}{compact_bytes:>12.0f}{compact_lookup * 1e9:>14.0f}")
+    print(f"memory saved: {100 * (1 - compact_bytes / legacy_bytes):.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+# broadcast.py
+
+import os
+import time
+import struct
+import asyncio
+import logging
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+import data_manager
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastResult:
+    """نتیجه یک ارسال همگانی."""
+
+    __slots__ = ('total', 'sent', 'failed', 'blocked', 'skipped', 'started', 'finished', '_initial')
+
+    def __init__(self, total: int = 0, sent: int = 0, failed: int = 0, blocked: int = 0, skipped: int = 0):
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.blocked = blocked
+        self.skipped = skipped
+        self.started = time.monotonic()
+        self.finished = None
+        # پیشرفت پیش از این اجرا (مثلاً پیش از راه‌اندازی مجدد) در محاسبه نرخ حساب نمی‌شود
+        self._initial = sent + failed + blocked
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed + self.blocked + self.skipped
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self) -> float:
+        """تعداد ارسال انجام شده در ثانیه در اجرای جاری."""
+        elapsed = self.elapsed
+        attempted = self.sent + self.failed + self.blocked - self._initial
+        return attempted / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """زمان تخمینی باقی‌مانده (ثانیه) یا None اگر هنوز قابل تخمین نیست."""
+        rate = self.rate
+        return (self.total - self.done) / rate if rate > 0 else None
+
+
+class Broadcaster:
+    """موتور ارسال همگانی با هم‌زمانی محدود و یک سطل توکن سراسری.
+
+    همه ارسال‌های همگانی (حتی اگر هم‌زمان اجرا شوند) از یک سطل توکن مشترک استفاده می‌کنند تا
+    مجموع نرخ ارسال زیر محدودیت حدوداً ۳۰ پیام در ثانیه تلگرام بماند. با دریافت RetryAfter همه
+    ارسال‌ها تا پایان زمان انتظار متوقف شده و نرخ نصف می‌شود، سپس پس از ارسال‌های موفق به‌تدریج
+    به نرخ اصلی برمی‌گردد. خطاهای شبکه تا `max_retries` بار با تأخیر نمایی تکرار می‌شوند و کاربرانی
+    که ربات را مسدود کرده‌اند علامت‌گذاری می‌شوند تا در ارسال‌های بعدی رد شوند.
+    """
+
+    # پس از چند ارسال موفق متوالی نرخ دوباره افزایش می‌یابد
+    RECOVERY_STEP = 100
+
+    def __init__(self, rate: float, concurrency: int, max_retries: int):
+        self.max_rate = rate
+        self.min_rate = min(1.0, rate)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate, max(1.0, rate))
+        self._resume_at = 0.0
+        self._successes = 0
+        # شمارنده‌های تجمعی همه ارسال‌ها (برای /metrics)
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.flood_waits = 0
+
+    @property
+    def current_rate(self) -> float:
+        return self._bucket.rate
+
+    async def _acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._resume_at:
+                await asyncio.sleep(self._resume_at - now)
+                continue
+            if self._bucket.consume(now):
+                return
+            await asyncio.sleep(self._bucket.delay(now))
+
+    def _on_retry_after(self, retry_after: float):
+        self.flood_waits += 1
+        self._resume_at = max(self._resume_at, time.monotonic() + retry_after)
+        self._bucket.tokens = 0
+        self._successes = 0
+        if self._bucket.rate > self.min_rate:
+            self._bucket.rate = max(self.min_rate, self._bucket.rate / 2)
+            logger.warning("Broadcast hit flood limit; pausing %ss, rate lowered to %.1f/s.", retry_after, self._bucket.rate)
+
+    def _on_success(self):
+        if self._bucket.rate >= self.max_rate:
+            return
+        self._successes += 1
+        if self._successes >= self.RECOVERY_STEP:
+            self._successes = 0
+            self._bucket.rate = min(self.max_rate, self._bucket.rate * 1.25)
+
+    async def _deliver(self, bot, chat_id: int, text: str, result: BroadcastResult):
+        attempt = 0
+        while True:
+            await self._acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                result.sent += 1
+                self.sent += 1
+                self._on_success()
+                return 'sent'
+            except RetryAfter as e:
+                # مکث سراسری؛ در تعداد تلاش‌ها حساب نمی‌شود
+                self._on_retry_after(e.retry_after)
+            except Forbidden:
+                result.blocked += 1
+                self.blocked += 1
+                data_manager.mark_unreachable(chat_id)
+                return 'blocked'
+            except BadRequest as e:
+                if "chat not found" in str(e).lower():
+                    result.blocked += 1
+                    self.blocked += 1
+                    data_manager.mark_unreachable(chat_id)
+                    return 'blocked'
+                logger.warning("Failed to send broadcast to %s: %s", chat_id, e, extra={'user_id': chat_id})
+                result.failed += 1
+                self.failed += 1
+                return 'failed'
+            except NetworkError as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.warning("Failed to send broadcast to %s after %s attempts: %s", chat_id, attempt, e, extra={'user_id': chat_id})
+                    result.failed += 1
+                    self.failed += 1
+                    return 'failed'
+                await asyncio.sleep(min(30.0, 0.5 * 2 ** attempt))
+            except TelegramError as e:
+                logger.warning("Failed to send broadcast to %s: %s", chat_id, e, extra={'user_id': chat_id})
+                result.failed += 1
+                self.failed += 1
+                return 'failed'
+
+    async def send(self, bot, chat_ids, text: str, skip_unreachable: bool = True,
+                   result: BroadcastResult = None, progress=None) -> BroadcastResult:
+        """متن را به همه شناسه‌ها ارسال کرده و نتیجه را برمی‌گرداند.
+
+        اگر `progress` داده شود، begin(chat_id) پیش از و end(chat_id, نتیجه) پس از پردازش هر گیرنده
+        فراخوانی می‌شود (برای ثبت پیشرفت کارهای ماندگار)؛ نتیجه یکی از sent، failed، blocked یا skipped است.
+        """
+        chat_ids = list(chat_ids)
+        if result is None:
+            result = BroadcastResult(len(chat_ids))
+        pending = iter(chat_ids)
+
+        async def worker():
+            for chat_id in pending:
+                if progress is not None:
+                    progress.begin(chat_id)
+                if skip_unreachable and data_manager.is_user_unreachable(chat_id):
+                    result.skipped += 1
+                    outcome = 'skipped'
+                else:
+                    outcome = await self._deliver(bot, chat_id, text, result)
+                if progress is not None:
+                    progress.end(chat_id, outcome)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(chat_ids)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            result.finished = time.monotonic()
+
+        logger.info(
+            "Broadcast finished in %.1fs: %s sent, %s failed, %s blocked, %s skipped.",
+            result.elapsed, result.sent, result.failed, result.blocked, result.skipped
+        )
+        return result
+
+
+# --- نمونه سراسری ---
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_MAX_RETRIES = int(os.environ.get("BROADCAST_MAX_RETRIES", "3"))
+
+broadcaster = Broadcaster(BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES)
+
+
+# --- کارهای ارسال همگانی ماندگار ---
+# هر ارسال همگانی یک کار در DATA['broadcast_jobs'] است و پیشرفت هر گیرنده در یک لاگ دودویی فقط‌افزودنی
+# (`job-<id>.log`) ثبت می‌شود: پیش از ارسال رکورد «claimed» و پس از آن نتیجه. نوشتن بدون بافر انجام
+# می‌شود، پس هر رکورد با خروج یا قطع ناگهانی برنامه از دست نمی‌رود. پس از راه‌اندازی مجدد به هیچ
+# گیرنده‌ای که در لاگ آمده دوباره پیام داده نمی‌شود؛ گیرندگانی که هنگام قطع در حال ارسال بودند (claimed
+# بدون نتیجه) ناموفق شمرده می‌شوند، چون ممکن است پیام را گرفته باشند.
+BROADCAST_LOG_DIR = os.environ.get("BROADCAST_LOG_DIR", os.path.join(data_manager.BASE_DIR, "broadcast_logs"))
+# شمارنده‌های نمایشی رکورد کار در DATA هر چند گیرنده یک بار به‌روز می‌شوند (لاگ منبع اصلی است)
+BROADCAST_CHECKPOINT_EVERY = int(os.environ.get("BROADCAST_CHECKPOINT_EVERY", "200"))
+# تعداد کارهای پایان‌یافته‌ای که برای گزارش نگه داشته می‌شوند
+BROADCAST_JOBS_HISTORY = int(os.environ.get("BROADCAST_JOBS_HISTORY", "20"))
+
+ACTIVE_STATUSES = ('pending', 'running')
+
+_running = {}  # job_id -> _JobProgress
+
+# رکورد لاگ پیشرفت: آیدی گیرنده و کد وضعیت
+_PROGRESS_RECORD = struct.Struct('<qB')
+_OUTCOMES = ('claimed', 'sent', 'failed', 'blocked', 'skipped')
+_OUTCOME_CODES = {name: code for code, name in enumerate(_OUTCOMES)}
+
+
+def _log_path(job_id: int) -> str:
+    return os.path.join(BROADCAST_LOG_DIR, f"job-{job_id}.log")
+
+
+def _read_progress_log(job_id: int) -> dict:
+    """آخرین وضعیت هر گیرنده ثبت شده در لاگ پیشرفت کار ({آیدی: نام وضعیت})."""
+    try:
+        with open(_log_path(job_id), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}
+    # رکورد نیمه‌کاره انتهای فایل (در صورت قطع هنگام نوشتن) نادیده گرفته می‌شود
+    usable = len(data) - len(data) % _PROGRESS_RECORD.size
+    states = {}
+    for chat_id, code in _PROGRESS_RECORD.iter_unpack(data[:usable]):
+        states[chat_id] = _OUTCOMES[code]
+    return states
+
+
+class _JobProgress:
+    """پیشرفت زنده یک کار در حال اجرا؛ هر گیرنده پیش و پس از ارسال در لاگ پیشرفت کار ثبت می‌شود."""
+
+    def __init__(self, job: dict):
+        self.job = job
+        self.task = None
+        self.cancelled = False
+        states = _read_progress_log(job['id'])
+        self._done = set(states)
+        counts = {name: 0 for name in _OUTCOMES}
+        for state in states.values():
+            counts[state] += 1
+        # گیرندگانی که هنگام قطع برنامه در حال ارسال بودند ناموفق شمرده می‌شوند و دوباره ارسال نمی‌شوند
+        self.result = BroadcastResult(
+            job.get('total', 0), counts['sent'], counts['failed'] + counts['claimed'], counts['blocked'], counts['skipped']
+        )
+        self._log = None
+        self._since_checkpoint = 0
+
+    def open(self):
+        """لاگ پیشرفت را برای افزودن باز می‌کند؛ داخل وظیفه کار و همراه با close فراخوانی می‌شود."""
+        os.makedirs(BROADCAST_LOG_DIR, exist_ok=True)
+        self._log = open(_log_path(self.job['id']), 'ab', buffering=0)
+
+    def is_pending(self, chat_id: int) -> bool:
+        return chat_id not in self._done
+
+    def _append(self, chat_id: int, outcome: str):
+        self._log.write(_PROGRESS_RECORD.pack(chat_id, _OUTCOME_CODES[outcome]))
+
+    def begin(self, chat_id: int):
+        # پیش از ارسال ثبت می‌شود تا پس از قطع برنامه به این گیرنده دوباره پیام داده نشود
+        self._append(chat_id, 'claimed')
+        self._done.add(chat_id)
+
+    def end(self, chat_id: int, outcome: str):
+        self._append(chat_id, outcome)
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= BROADCAST_CHECKPOINT_EVERY:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """شمارنده‌ها را در رکورد کار نوشته و برای ذخیره علامت‌گذاری می‌کند."""
+        job = self.job
+        result = self.result
+        job['sent'], job['failed'], job['blocked'], job['skipped'] = result.sent, result.failed, result.blocked, result.skipped
+        self._since_checkpoint = 0
+        data_manager.mark_dirty(keys=('broadcast_jobs',))
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+def _jobs() -> list:
+    return data_manager.DATA['broadcast_jobs']
+
+def get_job(job_id: int):
+    for job in _jobs():
+        if job['id'] == job_id:
+            return job
+    return None
+
+def get_progress(job_id: int):
+    """پیشرفت زنده کار در حال اجرا یا None."""
+    return _running.get(job_id)
+
+def active_jobs() -> list:
+    return [job for job in _jobs() if job['status'] in ACTIVE_STATUSES]
+
+def resolve_audience(audience: dict) -> list:
+    """لیست مرتب آیدی گیرندگان یک کار را بر اساس معیار آن محاسبه می‌کند."""
+    criteria = audience.get('criteria')
+    value = audience.get('value')
+    if criteria == 'active_days':
+        user_ids = data_manager.get_active_users(int(value))
+    elif criteria == 'message_count':
+        user_ids = data_manager.get_users_by_message_count(int(value))
+    elif criteria == 'banned':
+        banned = data_manager.DATA['banned_users']
+        user_ids = list(banned) if value else [uid for uid in data_manager.all_user_ids() if uid not in banned]
+    else:
+        user_ids = data_manager.all_user_ids()
+    exclude = set(audience.get('exclude', ()))
+    return sorted(uid for uid in user_ids if uid not in exclude)
+
+def _prune_history():
+    jobs = _jobs()
+    finished = [job for job in jobs if job['status'] not in ACTIVE_STATUSES]
+    if len(finished) > BROADCAST_JOBS_HISTORY:
+        stale = finished[:len(finished) - BROADCAST_JOBS_HISTORY]
+        stale_ids = {id(job) for job in stale}
+        jobs[:] = [job for job in jobs if id(job) not in stale_ids]
+        # لاگ پیشرفت فقط پس از حذف کار از تاریخچه پاک می‌شود؛ تا آن زمان وضعیت پایانی کار حتماً ذخیره شده است
+        for job in stale:
+            try:
+                os.remove(_log_path(job['id']))
+            except FileNotFoundError:
+                pass
+
+def create_job(bot, message: str, audience: dict = None, notify_chat: int = None, label: str = "broadcast") -> dict:
+    """یک کار ارسال همگانی ماندگار ساخته و اجرای آن را شروع می‌کند."""
+    jobs = _jobs()
+    job = {
+        'id': max((j['id'] for j in jobs), default=0) + 1,
+        'label': label,
+        'message': message,
+        'audience': audience or {},
+        'notify_chat': notify_chat,
+        'status': 'pending',
+        'created': int(time.time()),
+        'finished': None,
+        'total': 0,
+        'sent': 0, 'failed': 0, 'blocked': 0, 'skipped': 0,
+    }
+    jobs.append(job)
+    _prune_history()
+    data_manager.mark_dirty(keys=('broadcast_jobs',))
+    _start(bot, job)
+    return job
+
+def _start(bot, job: dict):
+    progress = _JobProgress(job)
+    _running[job['id']] = progress
+    progress.task = asyncio.create_task(_run_job(bot, progress))
+
+async def _run_job(bot, progress: _JobProgress):
+    job = progress.job
+    resumed = job['status'] == 'running'
+    try:
+        progress.open()
+        recipients = [uid for uid in resolve_audience(job['audience']) if progress.is_pending(uid)]
+        progress.result.total = progress.result.done + len(recipients)
+        job['total'] = progress.result.total
+        job['status'] = 'running'
+        data_manager.mark_dirty(keys=('broadcast_jobs',))
+        if resumed:
+            logger.info("Resuming broadcast job #%s: %s recipients left.", job['id'], len(recipients))
+        await broadcaster.send(bot, recipients, job['message'], result=progress.result, progress=progress)
+        job['status'] = 'done'
+    except asyncio.CancelledError:
+        if progress.cancelled:
+            job['status'] = 'cancelled'
+        # در غیر این صورت برنامه در حال خاموش شدن است و کار با وضعیت running در اجرای بعدی ادامه می‌یابد
+        raise
+    except Exception as e:
+        logger.error("Broadcast job #%s failed: %s", job['id'], e)
+        job['status'] = 'failed'
+    finally:
+        progress.checkpoint()
+        progress.close()
+        if job['status'] not in ACTIVE_STATUSES:
+            job['finished'] = int(time.time())
+        _running.pop(job['id'], None)
+        # گزارش پایانی (از جمله برای کار لغو شده توسط ادمین)؛ کار متوقف شده هنگام خاموش شدن گزارش نمی‌شود
+        if job['status'] not in ACTIVE_STATUSES and job.get('notify_chat'):
+            await _notify(bot, job, progress.result)
+
+async def _notify(bot, job: dict, result: BroadcastResult):
+    try:
+        await bot.send_message(chat_id=job['notify_chat'], text=format_report(job, result), parse_mode='Markdown')
+    except TelegramError as e:
+        logger.warning("Failed to report broadcast job #%s: %s", job['id'], e)
+
+def cancel_job(job_id: int) -> bool:
+    """اجرای کار را متوقف می‌کند؛ اگر کار فعالی با این شناسه نباشد False برمی‌گرداند."""
+    job = get_job(job_id)
+    if job is None or job['status'] not in ACTIVE_STATUSES:
+        return False
+    progress = _running.get(job_id)
+    if progress is not None:
+        progress.cancelled = True
+        progress.task.cancel()
+    else:
+        job['status'] = 'cancelled'
+        job['finished'] = int(time.time())
+        data_manager.mark_dirty(keys=('broadcast_jobs',))
+    return True
+
+def format_report(job: dict, result: BroadcastResult = None) -> str:
+    """گزارش وضعیت یک کار ارسال همگانی (با نرخ و زمان باقی‌مانده برای کارهای در حال اجرا)."""
+    if result is None:
+        result = BroadcastResult(job['total'], job['sent'], job['failed'], job['blocked'], job['skipped'])
+    status = {
+        'pending': "⏳ در انتظار", 'running': "📤 در حال ارسال", 'done': "✅ تمام شده",
+        'cancelled': "🛑 لغو شده", 'failed': "❌ ناموفق",
+    }.get(job['status'], job['status'])
+    percent = result.done * 100 / result.total if result.total else 100.0
+    lines = [
+        f"📣 **ارسال همگانی #{job['id']}** ({job['label']})",
+        f"وضعیت: {status}",
+        f"📊 پیشرفت: `{result.done}` از `{result.total}` (`{percent:.1f}%`)",
+        f"✅ موفق: `{result.sent}`",
+        f"❌ ناموفق: `{result.failed}`",
+        f"🚷 ربات را مسدود کرده‌اند: `{result.blocked}`",
+        f"⏭️ رد شده (غیرقابل دسترس): `{result.skipped}`",
+    ]
+    if job['status'] == 'running':
+        eta = result.eta
+        lines.append(f"⚡️ نرخ: `{result.rate:.1f}` پیام در ثانیه")
+        lines.append(f"⏱️ زمان باقی‌مانده: `{eta:.0f}` ثانیه" if eta is not None else "⏱️ زمان باقی‌مانده: `نامشخص`")
+    elif job.get('finished'):
+        lines.append(f"⏱️ مدت: `{job['finished'] - job['created']}` ثانیه")
+    return "\n".join(lines)
+
+async def resume_jobs(application):
+    """کارهای نیمه‌تمام را پس از راه‌اندازی مجدد ادامه می‌دهد (برای post_init)."""
+    for job in active_jobs():
+        if job['id'] not in _running:
+            _start(application.bot, job)
+
+async def suspend_jobs(application=None):
+    """کارهای در حال اجرا را متوقف و پیشرفتشان را ثبت می‌کند تا پس از راه‌اندازی مجدد ادامه یابند."""
+    tasks = [progress.task for progress in _running.values()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,129 @@
+# charts.py
+
+import io
+import asyncio
+import logging
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+# صدک‌هایی که در نمودار تأخیر رسم می‌شوند: برچسب -> q
+LATENCY_PERCENTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+
+
+# --- بارگذاری تنبل matplotlib ---
+# فقط API شیءگرا (Figure) استفاده می‌شود؛ pyplot و وضعیت سراسری آن هرگز وارد نمی‌شوند.
+@functools.lru_cache(maxsize=None)
+def load_matplotlib():
+    from matplotlib.figure import Figure
+    return Figure
+
+
+# --- توابع رسم (در ترد رسم اجرا می‌شوند و فقط داده‌های آماده شده را می‌گیرند) ---
+def draw_activity_heatmap(fig, matrix: list, days: int):
+    fig.set_size_inches(12, 5)
+    ax = fig.subplots()
+    image = ax.imshow(matrix, cmap='YlOrRd', aspect='auto')
+    fig.colorbar(image, ax=ax, label='تعداد پیام‌ها')
+    ax.set_title(f'نمودار فعالیت کاربران در {days} روز گذشته')
+    ax.set_xlabel('ساعت')
+    ax.set_ylabel('روز هفته')
+    ax.set_xticks(range(24))
+    ax.set_yticks(range(7), WEEKDAYS)
+
+
+def draw_messages_per_day(fig, labels: list, messages: list, users: list):
+    fig.set_size_inches(12, 5)
+    ax = fig.subplots()
+    ax.bar(range(len(labels)), messages, color='skyblue', label='پیام‌ها')
+    ax.set_ylabel('تعداد پیام‌ها')
+    users_ax = ax.twinx()
+    users_ax.plot(range(len(labels)), users, color='darkorange', marker='o', markersize=3, label='کاربران فعال')
+    users_ax.set_ylabel('کاربران فعال')
+    step = max(1, len(labels) // 15)
+    ax.set_xticks(range(0, len(labels), step), labels[::step], rotation=45, ha='right')
+    ax.set_title('پیام‌ها و کاربران فعال روزانه')
+    ax.grid(axis='y', alpha=0.3)
+    fig.legend(loc='upper left')
+
+
+def draw_latency_percentiles(fig, labels: list, series: dict, title: str):
+    fig.set_size_inches(12, 5)
+    ax = fig.subplots()
+    for name, values in series.items():
+        ax.plot(range(len(labels)), values, marker='.', label=name)
+    step = max(1, len(labels) // 15)
+    ax.set_xticks(range(0, len(labels), step), labels[::step], rotation=45, ha='right')
+    ax.set_yscale('log')
+    ax.set_ylabel('ثانیه')
+    ax.set_title(title)
+    ax.grid(alpha=0.3)
+    ax.legend()
+
+
+def _render_png(draw, args) -> bytes:
+    Figure = load_matplotlib()
+    # هر نمودار Figure مستقل خود را دارد و پس از رسم دور انداخته می‌شود
+    fig = Figure(dpi=100)
+    draw(fig, *args)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    """رسم نمودارها خارج از حلقه رویداد با کش تصاویر PNG بر اساس نسخه داده‌ها.
+
+    کلید هر نمودار شامل نسخه داده‌هایی است که از آن رسم شده؛ تا وقتی داده‌ها تغییر نکرده باشند
+    درخواست‌های تکراری همان بایت‌ها را بدون رسم دوباره می‌گیرند. رسم در یک ترد اختصاصی و به ترتیب
+    انجام می‌شود (matplotlib برای رسم هم‌زمان چند نمودار طراحی نشده است) و درخواست‌های هم‌زمان با
+    یک کلید منتظر همان رسم می‌مانند.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()     # کلید -> بایت‌های PNG
+        self._inflight = {}             # کلید -> Future
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="charts")
+        self.hits = 0
+        self.renders = 0
+
+    async def render(self, key, draw, *args) -> bytes:
+        """تصویر PNG نمودار `draw(fig, *args)` را (از کش یا با رسم در ترد) برمی‌گرداند."""
+        png = self._cache.get(key)
+        if png is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return png
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, _render_png, draw, args)
+            self._inflight[key] = future
+            try:
+                png = await asyncio.shield(future)
+            finally:
+                self._inflight.pop(key, None)
+            self.renders += 1
+            self._cache[key] = png
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            logger.debug("Rendered chart %s (%d bytes).", key[0], len(png))
+            return png
+
+        self.hits += 1
+        return await asyncio.shield(future)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return {'entries': len(self._cache), 'bytes': sum(map(len, self._cache.values())),
+                'hits': self.hits, 'renders': self.renders}
+
+
+# --- نمونه سراسری ---
+renderer = ChartRenderer()
@@ -0,0 +1,212 @@
+# conversation.py
+
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# تخمین تقریبی تعداد توکن بدون توکنایزر مدل (برای متن فارسی و انگلیسی محافظه‌کارانه است)
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class _Conversation:
+    """تاریخچه گفتگوی یک کاربر: نوبت‌های [نقش، متن، توکن] و مجموع توکن‌ها."""
+
+    __slots__ = ('turns', 'tokens', 'updated')
+
+    def __init__(self, turns=(), updated: float = None):
+        self.turns = deque(turns)
+        self.tokens = sum(turn[2] for turn in self.turns)
+        self.updated = time.time() if updated is None else updated
+
+    def trim(self, budget: int):
+        """قدیمی‌ترین نوبت‌ها را جفت‌جفت (کاربر و پاسخ) حذف می‌کند تا مجموع در بودجه جا شود."""
+        while self.turns and self.tokens > budget:
+            for _ in range(2):
+                if self.turns:
+                    self.tokens -= self.turns.popleft()[2]
+
+    def to_json(self) -> str:
+        return json.dumps(list(self.turns), ensure_ascii=False)
+
+
+class _SpillTier:
+    """نگه‌داری گفتگوهای حذف شده از حافظه روی دیسک (SQLite) تا در بازگشت کاربر بازیابی شوند."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations (user_id INTEGER PRIMARY KEY, turns TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated)")
+
+    def take(self, user_id: int):
+        """گفتگو را از دیسک خوانده و حذف می‌کند (از این به بعد در حافظه نگه داشته می‌شود)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT turns, updated FROM conversations WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+        return row
+
+    def put_many(self, rows):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO conversations (user_id, turns, updated) VALUES (?, ?, ?)", rows
+            )
+            self._conn.execute("COMMIT")
+
+    def purge_before(self, cutoff: float):
+        with self._lock:
+            self._conn.execute("DELETE FROM conversations WHERE updated < ?", (cutoff,))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+
+class ConversationStore:
+    """حافظه گفتگوی چندنوبتی هر کاربر با بودجه توکن، حذف LRU و لایه اختیاری روی دیسک.
+
+    مجموع توکن‌های هر گفتگو حداکثر `max_tokens` است و با رسیدن به سقف، قدیمی‌ترین نوبت‌ها حذف
+    می‌شوند؛ بنابراین حجم درخواست ارسالی به مدل محدود و قابل پیش‌بینی می‌ماند. حداکثر
+    `max_conversations` گفتگو در حافظه نگه داشته می‌شود و گفتگوهای کم‌استفاده‌تر یا به دیسک منتقل
+    می‌شوند یا (بدون لایه دیسک) کنار گذاشته می‌شوند. گفتگوهایی که `ttl` ثانیه بدون فعالیت بمانند
+    منقضی می‌شوند.
+    """
+
+    def __init__(self, max_tokens: int, max_conversations: int, ttl: float, spill_path: str = None):
+        self.max_tokens = max_tokens
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self._conversations = OrderedDict()  # user_id -> _Conversation
+        self._spill = _SpillTier(spill_path) if spill_path else None
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._conversations)
+
+    async def _get(self, user_id: int):
+        conversation = self._conversations.get(user_id)
+        if conversation is None and self._spill is not None:
+            try:
+                row = await asyncio.to_thread(self._spill.take, user_id)
+            except Exception as e:
+                logger.warning("Conversation spill read failed: %s", e)
+                row = None
+            if row is not None:
+                conversation = _Conversation(json.loads(row[0]), row[1])
+                self._conversations[user_id] = conversation
+                await self._evict()
+        if conversation is None:
+            return None
+        if conversation.updated < time.time() - self.ttl:
+            del self._conversations[user_id]
+            return None
+        self._conversations.move_to_end(user_id)
+        return conversation
+
+    async def messages_for(self, user_id: int, text: str) -> list:
+        """پیام‌های ارسالی به مدل: تاریخچه (در حد بودجه توکن) و پیام جدید کاربر."""
+        conversation = await self._get(user_id)
+        messages = []
+        if conversation is not None:
+            budget = self.max_tokens - estimate_tokens(text)
+            turns = list(conversation.turns)
+            used = conversation.tokens
+            # اگر پیام جدید بزرگ است، قدیمی‌ترین نوبت‌ها جفت‌جفت کنار گذاشته می‌شوند
+            while turns and used > budget:
+                for turn in turns[:2]:
+                    used -= turn[2]
+                turns = turns[2:]
+            messages = [{"role": role, "content": content} for role, content, _ in turns]
+        messages.append({"role": "user", "content": text})
+        return messages
+
+    async def record(self, user_id: int, text: str, reply: str):
+        """یک نوبت کامل (پیام کاربر و پاسخ مدل) را به تاریخچه اضافه می‌کند."""
+        conversation = await self._get(user_id)
+        if conversation is None:
+            conversation = self._conversations[user_id] = _Conversation()
+        for role, content in (("user", text), ("assistant", reply)):
+            tokens = estimate_tokens(content)
+            conversation.turns.append([role, content, tokens])
+            conversation.tokens += tokens
+        conversation.trim(self.max_tokens)
+        conversation.updated = time.time()
+        await self._evict()
+
+    async def _evict(self):
+        spilled = []
+        while len(self._conversations) > self.max_conversations:
+            user_id, conversation = self._conversations.popitem(last=False)
+            self.evictions += 1
+            if self._spill is not None:
+                spilled.append((user_id, conversation.to_json(), conversation.updated))
+        if spilled:
+            try:
+                await asyncio.to_thread(self._spill.put_many, spilled)
+            except Exception as e:
+                logger.warning("Conversation spill write failed: %s", e)
+
+    async def reset(self, user_id: int) -> bool:
+        """تاریخچه گفتگوی کاربر را پاک می‌کند؛ اگر تاریخچه‌ای وجود داشت True برمی‌گرداند."""
+        existed = await self._get(user_id) is not None
+        self._conversations.pop(user_id, None)
+        return existed
+
+    async def inspect(self, user_id: int):
+        """(نوبت‌ها، مجموع توکن، زمان آخرین فعالیت) یا None برای نمایش به ادمین."""
+        conversation = await self._get(user_id)
+        if conversation is None:
+            return None
+        return [(role, content) for role, content, _ in conversation.turns], conversation.tokens, conversation.updated
+
+    async def purge_expired(self):
+        """گفتگوهای منقضی شده را از حافظه و دیسک حذف می‌کند."""
+        cutoff = time.time() - self.ttl
+        # ترتیب LRU تقریباً همان ترتیب آخرین فعالیت است، پس فقط ابتدای صف بررسی می‌شود؛
+        # موارد جا مانده هنگام دسترسی بعدی منقضی تشخیص داده می‌شوند
+        while self._conversations:
+            user_id, conversation = next(iter(self._conversations.items()))
+            if conversation.updated >= cutoff:
+                break
+            del self._conversations[user_id]
+        if self._spill is not None:
+            await asyncio.to_thread(self._spill.purge_before, cutoff)
+
+    async def stats(self) -> dict:
+        return {
+            'conversations': len(self._conversations),
+            'max_conversations': self.max_conversations,
+            'max_tokens': self.max_tokens,
+            'ttl': self.ttl,
+            'evictions': self.evictions,
+            'spilled': await asyncio.to_thread(self._spill.count) if self._spill is not None else None,
+        }
+
+
+# --- نمونه سراسری ---
+# CONVERSATION_SPILL_FILE خالی یعنی گفتگوهای حذف شده از حافظه کنار گذاشته می‌شوند
+CONVERSATION_ENABLED = os.environ.get("CONVERSATION_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+CONVERSATION_MAX_TOKENS = int(os.environ.get("CONVERSATION_MAX_TOKENS", "1500"))
+CONVERSATION_MAX_USERS = int(os.environ.get("CONVERSATION_MAX_USERS", "5000"))
+CONVERSATION_TTL = float(os.environ.get("CONVERSATION_TTL", str(6 * 3600)))
+CONVERSATION_SPILL_FILE = os.environ.get("CONVERSATION_SPILL_FILE", "")
+
+store = ConversationStore(CONVERSATION_MAX_TOKENS, CONVERSATION_MAX_USERS, CONVERSATION_TTL,
+                          CONVERSATION_SPILL_FILE or None) if CONVERSATION_ENABLED else None
@@ -3,125 +3,322 @@
 import os
 import json
 import logging
-from datetime import datetime, timedelta
+import asyncio
+import atexit
+import time
+from datetime import datetime
+
+import storage
+from activity_index import ActivityIndex
+from user_store import UserRecord, UserStore
+from word_filter import BlockedWordMatcher, MATCH_SUBSTRING, MATCH_MODES
+from latency_metrics import metrics as latency_metrics
+from backup import manager as backups
 
 # --- تنظیمات مسیر فایل‌ها ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_FILE = os.path.join(BASE_DIR, "bot_data.json")
+SQLITE_FILE = os.environ.get("SQLITE_FILE", os.path.join(BASE_DIR, "bot_data.db"))
 LOG_FILE = os.path.join(BASE_DIR, "bot.log")
 
+# --- تنظیمات ذخیره‌سازی تأخیری (write-behind) ---
+# داده‌ها حداکثر هر SAVE_INTERVAL_MS میلی‌ثانیه یا پس از SAVE_MAX_PENDING تغییر روی دیسک نوشته می‌شوند.
+SAVE_INTERVAL_MS = int(os.environ.get("SAVE_INTERVAL_MS", "2000"))
+SAVE_MAX_PENDING = int(os.environ.get("SAVE_MAX_PENDING", "500"))
+
 # --- کش داده‌های گلوبال ---
 DATA = {
-    "users": {},
+    "users": UserStore(),
     "banned_users": set(),
+    "unreachable_users": set(),
     "stats": {
         "total_messages": 0,
         "total_users": 0,
-        "avg_response_time": 0.0,
-        "max_response_time": 0.0,
-        "min_response_time": float('inf'),
         "total_responses": 0
     },
+    "latency_metrics": {},
     "welcome_message": "سلام {user_mention}! 🤖\n\nمن یک ربات هوشمند هستم. هر سوالی دارید بپرسید.",
     "goodbye_message": "کاربر {user_mention} گروه را ترک کرد. خداحافظ!",
     "maintenance_mode": False,
     "blocked_words": [],
     "scheduled_broadcasts": [],
+    "scheduled_archive": [],
+    "rate_limits": {},
+    "broadcast_jobs": [],
     "bot_start_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 }
 
 logger = logging.getLogger(__name__)
 
+# --- لایه ذخیره‌سازی (json یا sqlite) ---
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+_backend = storage.create_backend(STORAGE_BACKEND, DATA_FILE, SQLITE_FILE)
+
+# --- تنظیمات فیلتر کلمات مسدود ---
+# BLOCKED_WORDS_MATCH: substring (هر رخداد در متن) یا word (فقط کلمه کامل)
+# BLOCKED_WORDS_NORMALIZE: یکسان‌سازی گونه‌های حروف فارسی/عربی (ي/ی، ك/ک، اعراب، نیم‌فاصله)
+BLOCKED_WORDS_MATCH = os.environ.get("BLOCKED_WORDS_MATCH", MATCH_SUBSTRING).lower()
+if BLOCKED_WORDS_MATCH not in MATCH_MODES:
+    # مقدار نامعتبر نباید بارگذاری داده‌ها را با خطا متوقف کند و فیلتر را خالی بگذارد
+    logger.warning("BLOCKED_WORDS_MATCH=%r نامعتبر است (گزینه‌ها: %s)؛ از %s استفاده می‌شود.",
+                   BLOCKED_WORDS_MATCH, ", ".join(MATCH_MODES), MATCH_SUBSTRING)
+    BLOCKED_WORDS_MATCH = MATCH_SUBSTRING
+BLOCKED_WORDS_NORMALIZE = os.environ.get("BLOCKED_WORDS_NORMALIZE", "0").lower() in ("1", "true", "yes", "on")
+_blocked_matcher = BlockedWordMatcher()
+
+# --- ایندکس کاربران بر اساس آخرین فعالیت ---
+_activity_index = ActivityIndex()
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def format_timestamp(ts) -> str:
+    """زمان epoch ذخیره شده در رکورد کاربر را به رشته قابل نمایش تبدیل می‌کند."""
+    if ts is None:
+        return 'N/A'
+    return datetime.fromtimestamp(ts).strftime(TIME_FORMAT)
+
+def _rebuild_activity_index():
+    entries = []
+    for user_id, record in DATA['users'].items():
+        ts = record.last_seen or record.first_seen
+        # کاربرانی که هیچ زمان ثبت شده‌ای ندارند نباید در سطل ساعتی سال ۱۹۷۰ شمرده شوند
+        if ts:
+            entries.append((user_id, ts))
+    _activity_index.build(entries)
+
 def load_data():
-    """داده‌ها را از فایل JSON بارگذاری کرده و در کش گلوبال ذخیره می‌کند."""
+    """داده‌ها را از لایه ذخیره‌سازی بارگذاری کرده و در کش گلوبال ذخیره می‌کند."""
     global DATA
     try:
-        if not os.path.exists(DATA_FILE):
-            logger.info(f"فایل داده در {DATA_FILE} یافت نشد. یک فایل جدید ایجاد می‌شود.")
+        loaded_data = _backend.load()
+        if loaded_data is None:
+            logger.info("داده‌ای در لایه ذخیره‌سازی «%s» یافت نشد. یک فایل جدید ایجاد می‌شود.", _backend.name)
             save_data()
             return
 
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            loaded_data = json.load(f)
-            loaded_data['banned_users'] = set(loaded_data.get('banned_users', []))
-            
-            # اطمینان از وجود کلیدهای جدید در فایل‌های قدیمی
-            if 'blocked_words' not in loaded_data: loaded_data['blocked_words'] = []
-            if 'scheduled_broadcasts' not in loaded_data: loaded_data['scheduled_broadcasts'] = []
-            if 'maintenance_mode' not in loaded_data: loaded_data['maintenance_mode'] = False
-            if 'bot_start_time' not in loaded_data: loaded_data['bot_start_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            if 'avg_response_time' not in loaded_data['stats']:
-                loaded_data['stats']['avg_response_time'] = 0.0
-                loaded_data['stats']['max_response_time'] = 0.0
-                loaded_data['stats']['min_response_time'] = float('inf')
-                loaded_data['stats']['total_responses'] = 0
-
-            DATA.update(loaded_data)
-            logger.info(f"داده‌ها با موفقیت از {DATA_FILE} بارگذاری شدند.")
+        loaded_data['banned_users'] = set(loaded_data.get('banned_users', []))
+        loaded_data['unreachable_users'] = set(loaded_data.get('unreachable_users', []))
+        
+        # اطمینان از وجود کلیدهای جدید در فایل‌های قدیمی
+        if 'blocked_words' not in loaded_data: loaded_data['blocked_words'] = []
+        if 'scheduled_broadcasts' not in loaded_data: loaded_data['scheduled_broadcasts'] = []
+        if 'scheduled_archive' not in loaded_data: loaded_data['scheduled_archive'] = []
+        if 'maintenance_mode' not in loaded_data: loaded_data['maintenance_mode'] = False
+        if 'rate_limits' not in loaded_data: loaded_data['rate_limits'] = {}
+        if 'broadcast_jobs' not in loaded_data: loaded_data['broadcast_jobs'] = []
+        if 'bot_start_time' not in loaded_data: loaded_data['bot_start_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if 'total_responses' not in loaded_data['stats']: loaded_data['stats']['total_responses'] = 0
+        # آمار قدیمی میانگین/کمینه/بیشینه با هیستوگرام‌های تأخیر جایگزین شده است
+        for old_key in ('avg_response_time', 'max_response_time', 'min_response_time'):
+            loaded_data['stats'].pop(old_key, None)
+        if 'latency_metrics' not in loaded_data: loaded_data['latency_metrics'] = {}
+
+        migrated = storage.migrate_timestamps(loaded_data.get('users', {}))
+        loaded_data['users'] = UserStore.from_dict(loaded_data.get('users', {}))
+
+        DATA.update(loaded_data)
+        latency_metrics.load(DATA['latency_metrics'])
+        _rebuild_activity_index()
+        _rebuild_blocked_matcher()
+        logger.info("داده‌ها با موفقیت از لایه ذخیره‌سازی «%s» بارگذاری شدند.", _backend.name)
+
+        if migrated:
+            logger.info("زمان‌های %s کاربر به قالب epoch منتقل شدند.", migrated)
+            save_data()
 
     except json.JSONDecodeError as e:
-        logger.error(f"خطا در خواندن JSON از {DATA_FILE}: {e}. ربات با داده‌های اولیه شروع به کار می‌کند.")
+        logger.error("خطا در خواندن JSON از %s: %s. ربات با داده‌های اولیه شروع به کار می‌کند.", DATA_FILE, e)
     except Exception as e:
-        logger.error(f"خطای غیرمنتظره هنگام بارگذاری داده‌ها: {e}. ربات با داده‌های اولیه شروع به کار می‌کند.")
+        logger.error("خطای غیرمنتظره هنگام بارگذاری داده‌ها: %s. ربات با داده‌های اولیه شروع به کار می‌کند.", e)
 
 def save_data():
-    """کش گلوبال داده‌ها را در فایل JSON ذخیره می‌کند."""
-    global DATA
+    """کش گلوبال داده‌ها را بلافاصله و به‌صورت همگام به‌طور کامل ذخیره می‌کند.
+
+    فقط برای زمانی است که ذخیره‌ساز پس‌زمینه فعال نیست (بارگذاری اولیه، اسکریپت‌ها و خروج برنامه)؛
+    در زمان اجرای ربات از mark_dirty استفاده کنید.
+    """
+    global _pending_changes, _full_save_pending
     try:
-        data_to_save = DATA.copy()
-        data_to_save['banned_users'] = list(DATA['banned_users'])
-        
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data_to_save, f, indent=4, ensure_ascii=False)
-        logger.debug(f"داده‌ها با موفقیت در {DATA_FILE} ذخیره شدند.")
+        # نسخه پشتیبان فقط تغییرات معلق را در لاگ تغییرات ثبت می‌کند، نه یک تصویر کامل جدید
+        dirty_users = None if _full_save_pending else set(_dirty_users)
+        dirty_keys = set(_dirty_keys)
+        _pending_changes = 0
+        _full_save_pending = False
+        _dirty_users.clear()
+        _dirty_keys.clear()
+        started = time.perf_counter()
+        _backend.save(DATA)
+        latency_metrics.record('save_data', time.perf_counter() - started)
+        _write_backup(dirty_users, dirty_keys)
+        logger.debug("داده‌ها با موفقیت در لایه ذخیره‌سازی «%s» ذخیره شدند.", _backend.name)
     except Exception as e:
-        logger.error(f"خطای مهلک: امکان ذخیره داده‌ها در {DATA_FILE} وجود ندارد. خطا: {e}")
+        logger.error("خطای مهلک: امکان ذخیره داده‌ها در لایه ذخیره‌سازی «%s» وجود ندارد. خطا: %s", _backend.name, e)
+
+# --- ذخیره‌سازی تأخیری (write-behind) ---
+_pending_changes = 0
+_full_save_pending = False
+_dirty_users = set()
+_dirty_keys = set()
+_flush_event = None
+_flush_task = None
+_flush_lock = None
+_stopping = False
+
+def mark_dirty(user_id=None, full: bool = False, keys=()):
+    """تغییر داده‌ها را ثبت می‌کند تا در نوبت بعدی ذخیره‌سازی پس‌زمینه روی دیسک نوشته شوند.
+
+    user_id کاربری است که رکوردش تغییر کرده، keys کلیدهای سطح بالای DATA که تغییر کرده‌اند و full=True
+    یعنی ممکن است همه کاربران تغییر کرده باشند. فراخوانی بدون هیچ‌کدام یعنی همه کلیدها تغییر کرده‌اند.
+    stats با هر پیام تغییر می‌کند و همیشه نوشته می‌شود.
+    """
+    global _pending_changes, _full_save_pending
+    _pending_changes += 1
+    if user_id is not None:
+        _dirty_users.add(user_id)
+    if keys:
+        _dirty_keys.update(keys)
+    elif user_id is None and not full:
+        _dirty_keys.update(key for key in DATA if key != 'users')
+    if full:
+        _full_save_pending = True
+
+    # اگر ذخیره‌ساز پس‌زمینه فعال نیست (مثلاً در اسکریپت‌ها)، بلافاصله ذخیره می‌کنیم
+    if _flush_task is None or _flush_task.done():
+        save_data()
+        return
+
+    if _pending_changes >= SAVE_MAX_PENDING:
+        _flush_event.set()
+
+async def flush_data():
+    """تغییرات معلق را ذخیره می‌کند؛ آماده‌سازی روی حلقه رویداد و نوشتن روی دیسک در یک ترد انجام می‌شود."""
+    global _pending_changes, _full_save_pending
+    async with _flush_lock:
+        if not _pending_changes:
+            return
+
+        dirty_users = None if _full_save_pending else set(_dirty_users)
+        dirty_keys = None if _full_save_pending else set(_dirty_keys)
+        _pending_changes = 0
+        _full_save_pending = False
+        _dirty_users.clear()
+        _dirty_keys.clear()
+        try:
+            started = time.perf_counter()
+            # روی حلقه فقط کپی تغییرات گرفته می‌شود؛ تبدیل به JSON و نوشتن در ترد انجام می‌شود
+            payload = _backend.prepare(DATA, dirty_users, dirty_keys)
+            await asyncio.to_thread(_backend.write, payload)
+            latency_metrics.record('save_data', time.perf_counter() - started)
+            logger.debug("داده‌ها با موفقیت در لایه ذخیره‌سازی «%s» ذخیره شدند.", _backend.name)
+            if backups is not None:
+                await asyncio.to_thread(_write_backup_job, backups.prepare(DATA, dirty_users, dirty_keys))
+        except Exception as e:
+            # تلاش دوباره در نوبت بعدی
+            _pending_changes += 1
+            if dirty_users is None:
+                _full_save_pending = True
+            else:
+                _dirty_users.update(dirty_users)
+                _dirty_keys.update(dirty_keys)
+            logger.error("خطا در ذخیره پس‌زمینه داده‌ها در لایه ذخیره‌سازی «%s»: %s", _backend.name, e)
+
+# --- نسخه پشتیبان افزایشی ---
+def _write_backup_job(job):
+    try:
+        backups.write(job)
+    except Exception as e:
+        logger.error("خطا در نوشتن نسخه پشتیبان: %s", e)
+
+def _write_backup(dirty_users, dirty_keys):
+    """ثبت همگام تغییرات در نسخه پشتیبان (برای ذخیره‌های همگام خارج از ذخیره‌ساز پس‌زمینه)."""
+    if backups is not None:
+        _write_backup_job(backups.prepare(DATA, dirty_users, dirty_keys))
+
+async def create_backup_snapshot():
+    """یک تصویر کامل جدید می‌گیرد؛ هم‌زمان با ذخیره‌ساز پس‌زمینه اجرا نمی‌شود تا ترتیب لاگ تغییرات حفظ شود."""
+    if backups is None:
+        return
+    if _flush_lock is None:
+        backups.write(backups.prepare(DATA, force_snapshot=True))
+        return
+    async with _flush_lock:
+        job = backups.prepare(DATA, force_snapshot=True)
+        await asyncio.to_thread(backups.write, job)
+
+async def _write_behind_loop():
+    """حلقه پس‌زمینه‌ای که تغییرات را هر چند میلی‌ثانیه یا پس از تعداد مشخصی تغییر ذخیره می‌کند."""
+    interval = SAVE_INTERVAL_MS / 1000
+    while not _stopping:
+        try:
+            await asyncio.wait_for(_flush_event.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        _flush_event.clear()
+        await flush_data()
+
+async def start_write_behind(application=None):
+    """ذخیره‌ساز پس‌زمینه را روی حلقه رویداد جاری راه‌اندازی می‌کند."""
+    global _flush_event, _flush_task, _flush_lock, _stopping
+    if _flush_task is not None and not _flush_task.done():
+        return
+    _stopping = False
+    _flush_event = asyncio.Event()
+    _flush_lock = asyncio.Lock()
+    _flush_task = asyncio.create_task(_write_behind_loop())
+    logger.info("ذخیره‌ساز پس‌زمینه فعال شد (بازه: %sms، حداکثر تغییرات معلق: %s).", SAVE_INTERVAL_MS, SAVE_MAX_PENDING)
+
+async def stop_write_behind(application=None):
+    """ذخیره‌ساز پس‌زمینه را متوقف کرده و تغییرات باقی‌مانده را ذخیره می‌کند."""
+    global _flush_task, _stopping
+    if _flush_task is None:
+        return
+    # به‌جای لغو، حلقه را متوقف می‌کنیم تا نوشتن در حال انجام نیمه‌کاره نماند
+    _stopping = True
+    persist_latency_metrics()
+    _flush_event.set()
+    await _flush_task
+    _flush_task = None
+    await flush_data()
+    logger.info("ذخیره‌ساز پس‌زمینه متوقف شد و داده‌ها ذخیره شدند.")
+
+def _sync_backend():
+    """پیش از کوئری مستقیم از لایه ذخیره‌سازی، تغییرات معلق کاربران را همگام می‌نویسد."""
+    if _full_save_pending:
+        _backend.write(_backend.prepare(DATA))
+    elif _dirty_users:
+        # کوئری‌ها فقط به جدول کاربران نیاز دارند؛ کلیدهای تغییر کرده در نوبت بعدی ذخیره‌ساز نوشته می‌شوند
+        _backend.write(_backend.prepare(DATA, set(_dirty_users), ()))
 
 def update_user_stats(user_id: int, user):
-    """آمار کاربر را پس از هر پیام به‌روز کرده و داده‌ها را ذخیره می‌کند."""
+    """آمار کاربر را پس از هر پیام به‌روز کرده و داده‌ها را برای ذخیره علامت‌گذاری می‌کند."""
     global DATA
-    now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    user_id_str = str(user_id)
+    now = int(time.time())
+    record = DATA['users'].get(user_id)
     
-    if user_id_str not in DATA['users']:
-        DATA['users'][user_id_str] = {
-            'first_name': user.first_name,
-            'username': user.username,
-            'first_seen': now_str,
-            'message_count': 0
-        }
+    if record is None:
+        record = DATA['users'].add(user_id, UserRecord(user.first_name, user.username, now))
         DATA['stats']['total_users'] += 1
-        logger.info(f"کاربر جدید ثبت شد: {user_id} ({user.first_name})")
+        logger.info("کاربر جدید ثبت شد: %s (%s)", user_id, user.first_name, extra={'user_id': user_id})
 
-    DATA['users'][user_id_str]['last_seen'] = now_str
-    DATA['users'][user_id_str]['message_count'] += 1
+    record.last_seen = now
+    record.message_count += 1
+    # کاربری که دوباره پیام داده، ربات را از مسدودی خارج کرده است
+    reachable_again = user_id in DATA['unreachable_users']
+    DATA['unreachable_users'].discard(user_id)
+    _activity_index.touch(user_id, now)
     DATA['stats']['total_messages'] += 1
     
-    save_data()
-
-def update_response_stats(response_time: float):
-    """آمار زمان پاسخگویی را به‌روز می‌کند."""
-    global DATA
-    
-    if DATA['stats']['total_responses'] == 0:
-        DATA['stats']['min_response_time'] = response_time
+    mark_dirty(user_id, keys=('unreachable_users',) if reachable_again else ())
 
+def update_response_stats(response_time: float, model: str = ""):
+    """زمان کل پاسخ را در هیستوگرام تأخیر ثبت می‌کند؛ ذخیره روی دیسک به صورت دوره‌ای انجام می‌شود."""
     DATA['stats']['total_responses'] += 1
-    
-    # محاسبه میانگین جدید
-    current_avg = DATA['stats']['avg_response_time']
-    total_responses = DATA['stats']['total_responses']
-    new_avg = ((current_avg * (total_responses - 1)) + response_time) / total_responses
-    DATA['stats']['avg_response_time'] = new_avg
-    
-    # به‌روزرسانی حداکثر و حداقل زمان پاسخگویی
-    if response_time > DATA['stats']['max_response_time']:
-        DATA['stats']['max_response_time'] = response_time
-    
-    if response_time < DATA['stats']['min_response_time']:
-        DATA['stats']['min_response_time'] = response_time
-    
-    save_data()
+    latency_metrics.record('total', response_time, model)
+
+def persist_latency_metrics():
+    """وضعیت هیستوگرام‌های تأخیر را برای ذخیره در نوبت بعدی ذخیره‌ساز پس‌زمینه ثبت می‌کند."""
+    DATA['latency_metrics'] = latency_metrics.to_dict()
+    mark_dirty(keys=('latency_metrics',))
 
 def is_user_banned(user_id: int) -> bool:
     """بررسی می‌کند آیا کاربر مسدود شده است یا خیر."""
@@ -130,50 +327,125 @@ def is_user_banned(user_id: int) -> bool:
 def ban_user(user_id: int):
     """کاربر را مسدود کرده و ذخیره می‌کند."""
     DATA['banned_users'].add(user_id)
-    save_data()
+    mark_dirty(keys=('banned_users',))
 
 def unban_user(user_id: int):
     """مسدودیت کاربر را برداشته و ذخیره می‌کند."""
     DATA['banned_users'].discard(user_id)
-    save_data()
+    mark_dirty(keys=('banned_users',))
+
+def mark_unreachable(user_id: int):
+    """کاربری را که ربات را مسدود کرده یا حسابش حذف شده علامت می‌زند تا در ارسال‌های همگانی رد شود."""
+    if user_id not in DATA['unreachable_users']:
+        DATA['unreachable_users'].add(user_id)
+        mark_dirty(keys=('unreachable_users',))
+
+def is_user_unreachable(user_id: int) -> bool:
+    """بررسی می‌کند آیا ارسال پیام به کاربر ممکن نیست."""
+    return user_id in DATA['unreachable_users']
+
+def _rebuild_blocked_matcher():
+    """اتوماتون کلمات مسدود را از روی لیست جاری از نو می‌سازد."""
+    global _blocked_matcher
+    _blocked_matcher = BlockedWordMatcher(
+        DATA['blocked_words'], mode=BLOCKED_WORDS_MATCH, normalize=BLOCKED_WORDS_NORMALIZE
+    )
+
+def add_blocked_word(word: str) -> bool:
+    """کلمه را به لیست کلمات مسدود اضافه می‌کند؛ اگر از قبل وجود داشت False برمی‌گرداند."""
+    if word in DATA['blocked_words']:
+        return False
+    DATA['blocked_words'].append(word)
+    _rebuild_blocked_matcher()
+    mark_dirty(keys=('blocked_words',))
+    return True
+
+def remove_blocked_word(word: str) -> bool:
+    """کلمه را از لیست کلمات مسدود حذف می‌کند؛ اگر وجود نداشت False برمی‌گرداند."""
+    if word not in DATA['blocked_words']:
+        return False
+    DATA['blocked_words'].remove(word)
+    _rebuild_blocked_matcher()
+    mark_dirty(keys=('blocked_words',))
+    return True
 
 def contains_blocked_words(text: str) -> bool:
     """بررسی می‌کند آیا متن حاوی کلمات مسدود شده است یا خیر."""
-    if not DATA['blocked_words']:
-        return False
-    
-    text_lower = text.lower()
-    for word in DATA['blocked_words']:
-        if word in text_lower:
-            return True
-    
-    return False
+    return _blocked_matcher.matches(text)
+
+# --- کوئری‌های کاربران ---
+# کوئری‌های مبتنی بر آخرین فعالیت از ایندکس درون حافظه پاسخ داده می‌شوند و نیازی به پیمایش همه کاربران ندارند.
 
 def get_active_users(days: int) -> list:
     """لیست کاربران فعال در بازه زمانی مشخص را برمی‌گرداند."""
-    now = datetime.now()
-    cutoff_date = now - timedelta(days=days)
-    
-    active_users = []
-    for user_id, user_info in DATA['users'].items():
-        if 'last_seen' in user_info:
-            try:
-                last_seen = datetime.strptime(user_info['last_seen'], '%Y-%m-%d %H:%M:%S')
-                if last_seen >= cutoff_date:
-                    active_users.append(int(user_id))
-            except ValueError:
-                continue
-    
-    return active_users
+    return _activity_index.ids_since(time.time() - days * 86400)
+
+def count_active_users(hours: int) -> int:
+    """تعداد کاربرانی که در چند ساعت گذشته فعال بوده‌اند را برمی‌گرداند."""
+    return _activity_index.count_since(time.time() - hours * 3600)
+
+def get_hourly_activity() -> list:
+    """تعداد کاربران بر اساس ساعت آخرین فعالیت (۲۴ خانه) را برمی‌گرداند."""
+    return _activity_index.hourly_histogram()
 
 def get_users_by_message_count(min_count: int) -> list:
     """لیست کاربران با تعداد پیام بیشتر یا مساوی مقدار مشخص را برمی‌گرداند."""
-    users = []
-    for user_id, user_info in DATA['users'].items():
-        if user_info.get('message_count', 0) >= min_count:
-            users.append(int(user_id))
-    
-    return users
+    if _backend.supports_queries:
+        _sync_backend()
+        return _backend.user_ids_by_message_count(min_count)
+
+    return [user_id for user_id, record in DATA['users'].items() if record.message_count >= min_count]
+
+def _with_info(user_ids) -> list:
+    users = DATA['users']
+    return [(uid, users.get(uid)) for uid in user_ids if uid in users]
+
+def get_recent_users(limit: int, offset: int = 0) -> list:
+    """لیست (آیدی، رکورد) کاربران به ترتیب آخرین فعالیت را با صفحه‌بندی برمی‌گرداند."""
+    return _with_info(_activity_index.recent(limit, offset))
+
+def search_users(term: str) -> list:
+    """لیست (آیدی، رکورد) کاربرانی که نام یا نام کاربری آن‌ها شامل عبارت است را برمی‌گرداند."""
+    term = term.lower()
+    if _backend.supports_queries:
+        _sync_backend()
+        return _with_info(_backend.search_user_ids(term))
+
+    matching_users = []
+    for user_id, record in DATA['users'].items():
+        # استفاده از (value or '') برای جلوگیری از خطا در صورت وجود None
+        first_name = (record.first_name or '').lower()
+        username = (record.username or '').lower()
+        if term in first_name or term in username:
+            matching_users.append((user_id, record))
+    return matching_users
+
+# --- دسترسی به کاربران ---
+
+def get_user(user_id: int):
+    """رکورد کاربر (UserRecord) یا None را برمی‌گرداند."""
+    return DATA['users'].get(user_id)
+
+def user_count() -> int:
+    """تعداد کل کاربران ثبت شده."""
+    return len(DATA['users'])
+
+def all_user_ids() -> list:
+    """لیست آیدی عددی همه کاربران."""
+    return DATA['users'].ids()
+
+def iter_users():
+    """پیمایش (آیدی، رکورد) همه کاربران."""
+    return DATA['users'].items()
+
+def reset_message_counts():
+    """تعداد پیام همه کاربران را صفر می‌کند."""
+    for record in DATA['users'].values():
+        record.message_count = 0
+    mark_dirty(full=True)
 
 # بارگذاری اولیه داده‌ها در زمان ایمپورت شدن ماژول
 load_data()
+
+# ذخیره تغییرات معلق هنگام خروج از برنامه (در صورتی که خاموش شدن عادی انجام نشود)
+atexit.register(lambda: _pending_changes and save_data())
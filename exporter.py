@@ -0,0 +1,144 @@
+# exporter.py
+
+import csv
+import gzip
+import json
+import time
+
+import data_manager
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+COLUMNS = ('User ID', 'First Name', 'Username', 'Message Count', 'First Seen', 'Last Seen', 'Banned')
+# تعداد سطرهای هر گروه در Parquet؛ حافظه مصرفی به همین تعداد محدود است
+PARQUET_BATCH_ROWS = 10_000
+
+
+class ExportError(Exception):
+    """خطای قابل نمایش به ادمین (مثلاً قالب ناشناخته یا نبود کتابخانه Parquet)."""
+
+
+def parse_filters(args) -> dict:
+    """آرگومان‌های key=value دستور را به فیلترها تبدیل می‌کند: format، active_days، min_messages و banned."""
+    filters = {'format': 'csv', 'active_days': None, 'min_messages': None, 'banned': None}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        key = key.lower()
+        if not sep:
+            # آرگومان تنها به عنوان قالب خروجی تفسیر می‌شود (مثلاً /export_csv jsonl)
+            key, value = 'format', arg
+        value = value.lower()
+        if key == 'format':
+            if value not in FORMATS:
+                raise ExportError(f"قالب ناشناخته «{value}». قالب‌های موجود: {', '.join(FORMATS)}")
+            filters['format'] = value
+        elif key in ('active_days', 'min_messages'):
+            if not value.isdigit():
+                raise ExportError(f"مقدار {key} باید یک عدد صحیح باشد.")
+            filters[key] = int(value)
+        elif key == 'banned':
+            if value not in ('yes', 'no'):
+                raise ExportError("مقدار banned باید yes یا no باشد.")
+            filters['banned'] = value == 'yes'
+        else:
+            raise ExportError(f"فیلتر ناشناخته «{key}».")
+    return filters
+
+
+def select_user_ids(filters: dict) -> list:
+    """آیدی کاربران منطبق با فیلتر active_days (از ایندکس فعالیت، روی حلقه رویداد).
+
+    فقط لیست آیدی‌ها کپی می‌شود؛ رکوردها هنگام نوشتن تک‌تک خوانده می‌شوند.
+    """
+    if filters.get('active_days') is not None:
+        return data_manager.get_active_users(filters['active_days'])
+    return data_manager.all_user_ids()
+
+
+def _rows(user_ids, filters: dict):
+    users = data_manager.DATA['users']
+    banned = data_manager.DATA['banned_users']
+    min_messages = filters.get('min_messages')
+    banned_filter = filters.get('banned')
+    for user_id in user_ids:
+        record = users.get(user_id)
+        if record is None:
+            continue
+        if min_messages is not None and record.message_count < min_messages:
+            continue
+        is_banned = user_id in banned
+        if banned_filter is not None and is_banned != banned_filter:
+            continue
+        yield (
+            user_id,
+            record.first_name or 'N/A',
+            record.username or 'N/A',
+            record.message_count,
+            data_manager.format_timestamp(record.first_seen),
+            data_manager.format_timestamp(record.last_seen),
+            "بله" if is_banned else "خیر",
+        )
+
+
+def _write_csv(path: str, rows) -> int:
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _write_jsonl(path: str, rows) -> int:
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def _write_parquet(path: str, rows) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("برای خروجی Parquet کتابخانه pyarrow باید نصب باشد.")
+
+    schema = pa.schema([
+        ('User ID', pa.int64()), ('First Name', pa.string()), ('Username', pa.string()),
+        ('Message Count', pa.int64()), ('First Seen', pa.string()), ('Last Seen', pa.string()),
+        ('Banned', pa.string()),
+    ])
+    count = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= PARQUET_BATCH_ROWS:
+                writer.write_table(pa.Table.from_arrays([list(col) for col in zip(*batch)], schema=schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_arrays([list(col) for col in zip(*batch)], schema=schema))
+            count += len(batch)
+    return count
+
+
+_WRITERS = {'csv': _write_csv, 'jsonl': _write_jsonl, 'parquet': _write_parquet}
+EXTENSIONS = {'csv': '.csv.gz', 'jsonl': '.jsonl.gz', 'parquet': '.parquet'}
+
+
+def export_users(path: str, user_ids, filters: dict) -> int:
+    """سطرها را به صورت جریانی در فایل می‌نویسد و تعداد سطرها را برمی‌گرداند.
+
+    برای اجرا در ترد (asyncio.to_thread) طراحی شده است تا حلقه رویداد مسدود نشود؛ هیچ لیستی
+    از همه سطرها ساخته نمی‌شود و خروجی CSV/JSONL هم‌زمان با نوشتن فشرده (gzip) می‌شود.
+    """
+    return _WRITERS[filters['format']](path, _rows(user_ids, filters))
+
+
+def export_filename(filters: dict) -> str:
+    return f"users_{time.strftime('%Y%m%d_%H%M%S')}{EXTENSIONS[filters['format']]}"
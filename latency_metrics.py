@@ -0,0 +1,231 @@
+# latency_metrics.py
+
+import math
+import time
+from collections import deque
+
+# مراحل پردازش یک پیام که تأخیر آن‌ها جداگانه ثبت می‌شود، به علاوه زمان ذخیره داده‌ها و تأخیر حلقه رویداد
+STAGES = ('total', 'queue_wait', 'upstream', 'telegram_send', 'save_data', 'event_loop_lag')
+# پنجره‌های زمانی: نام -> (طول هر برش به ثانیه، تعداد برش‌ها)
+WINDOWS = {
+    '1m': (10, 6),
+    '1h': (60, 60),
+    '24h': (3600, 24),
+}
+
+
+class LogHistogram:
+    """هیستوگرام با سطل‌های لگاریتمی؛ خطای نسبی هر صدک حداکثر حدود (GROWTH-1)/2 است.
+
+    مقدار v در سطل floor(log(v / MIN_VALUE) / log(GROWTH)) شمرده می‌شود، بنابراین حافظه به جای
+    تعداد نمونه‌ها به بازه مقادیر وابسته است و دو هیستوگرام با جمع شمارنده‌های سطل‌ها ادغام می‌شوند.
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    MIN_VALUE = 0.001   # یک میلی‌ثانیه
+    GROWTH = 1.05
+    _LOG_GROWTH = math.log(GROWTH)
+
+    def __init__(self):
+        self.counts = {}    # اندیس سطل -> تعداد
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float):
+        index = int(math.log(value / self.MIN_VALUE) / self._LOG_GROWTH) if value > self.MIN_VALUE else 0
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LogHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float):
+        """مقدار تقریبی صدک q (بین ۰ و ۱)؛ میانه هندسی سطل مربوطه برگردانده می‌شود."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                value = self.MIN_VALUE * self.GROWTH ** (index + 0.5)
+                return min(value, self.max)
+        return self.max
+
+    def cumulative(self, bounds) -> list:
+        """تعداد تجمعی نمونه‌های کوچک‌تر یا مساوی هر مرز (برای خروجی هیستوگرام Prometheus).
+
+        هر سطل با مرز بالای خود مقایسه می‌شود، پس شمارش‌ها حداکثر به اندازه یک سطل تقریبی‌اند.
+        """
+        totals = [0] * len(bounds)
+        for index, count in self.counts.items():
+            upper = self.MIN_VALUE * self.GROWTH ** (index + 1)
+            for i, bound in enumerate(bounds):
+                if upper <= bound:
+                    totals[i] += count
+                    break
+        for i in range(1, len(totals)):
+            totals[i] += totals[i - 1]
+        return totals
+
+    def to_dict(self) -> dict:
+        return {'counts': {str(i): c for i, c in self.counts.items()}, 'count': self.count,
+                'total': self.total, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LogHistogram":
+        histogram = cls()
+        histogram.counts = {int(i): c for i, c in data.get('counts', {}).items()}
+        histogram.count = data.get('count', 0)
+        histogram.total = data.get('total', 0.0)
+        histogram.max = data.get('max', 0.0)
+        return histogram
+
+
+class RollingHistogram:
+    """پنجره زمانی لغزان از `slots` برش `slot_seconds` ثانیه‌ای؛ برش‌های قدیمی به‌تدریج کنار می‌روند."""
+
+    __slots__ = ('slot_seconds', 'slots', '_slots')
+
+    def __init__(self, slot_seconds: int, slots: int):
+        self.slot_seconds = slot_seconds
+        self.slots = slots
+        self._slots = deque()   # (شروع برش، هیستوگرام)
+
+    def record(self, value: float, now: float):
+        start = int(now // self.slot_seconds) * self.slot_seconds
+        if not self._slots or self._slots[-1][0] != start:
+            self._slots.append((start, LogHistogram()))
+            self._expire(now)
+        self._slots[-1][1].record(value)
+
+    def _expire(self, now: float):
+        cutoff = now - self.slot_seconds * self.slots
+        while self._slots and self._slots[0][0] + self.slot_seconds <= cutoff:
+            self._slots.popleft()
+
+    def snapshot(self, now: float) -> LogHistogram:
+        self._expire(now)
+        merged = LogHistogram()
+        for _, histogram in self._slots:
+            merged.merge(histogram)
+        return merged
+
+    def slices(self, now: float) -> list:
+        """(شروع برش، هیستوگرام) برش‌های داخل پنجره به ترتیب زمان."""
+        self._expire(now)
+        return list(self._slots)
+
+    def to_list(self) -> list:
+        return [[start, histogram.to_dict()] for start, histogram in self._slots]
+
+    def load(self, data: list, now: float):
+        self._slots = deque((start, LogHistogram.from_dict(h)) for start, h in data)
+        self._expire(now)
+
+
+class _Series:
+    """هیستوگرام‌های یک (مرحله، مدل): کل دوره و هر پنجره زمانی."""
+
+    __slots__ = ('lifetime', 'windows')
+
+    def __init__(self):
+        self.lifetime = LogHistogram()
+        self.windows = {name: RollingHistogram(*spec) for name, spec in WINDOWS.items()}
+
+
+class LatencyMetrics:
+    """نگه‌داری هیستوگرام تأخیر هر مرحله و هر مدل در حافظه؛ ذخیره‌سازی به صورت دوره‌ای انجام می‌شود."""
+
+    def __init__(self):
+        self._series = {}   # (مرحله، مدل) -> _Series
+        # شمارنده تغییرات هر مرحله و نسل داده‌ها (با reset/load عوض می‌شود)؛ کش نمودارها بر اساس آن‌ها
+        # باطل می‌شود تا نمونه‌های یک مرحله (مثلاً event_loop_lag هر نیم ثانیه) نمودار مراحل دیگر را باطل نکنند
+        self._versions = {}
+        self._generation = 0
+
+    def record(self, stage: str, seconds: float, model: str = ""):
+        series = self._series.get((stage, model))
+        if series is None:
+            series = self._series[(stage, model)] = _Series()
+        now = time.time()
+        self._versions[stage] = self._versions.get(stage, 0) + 1
+        series.lifetime.record(seconds)
+        for window in series.windows.values():
+            window.record(seconds, now)
+
+    def series(self):
+        """(مرحله، مدل، هیستوگرام کل دوره) برای همه سری‌ها."""
+        for (stage, model), series in self._series.items():
+            yield stage, model, series.lifetime
+
+    def models(self, stage: str = 'total') -> list:
+        return sorted(model for s, model in self._series if s == stage)
+
+    def histogram(self, stage: str, window: str = None, model: str = None) -> LogHistogram:
+        """هیستوگرام ادغام شده یک مرحله در پنجره `window` (None برای کل دوره) برای یک مدل یا همه مدل‌ها."""
+        now = time.time()
+        merged = LogHistogram()
+        for (s, m), series in self._series.items():
+            if s != stage or (model is not None and m != model):
+                continue
+            merged.merge(series.lifetime if window is None else series.windows[window].snapshot(now))
+        return merged
+
+    def timeline(self, stage: str, window: str, model: str = None) -> list:
+        """[(شروع برش، هیستوگرام ادغام شده همه مدل‌ها)] برش‌های پنجره `window` برای رسم تغییرات در طول زمان."""
+        now = time.time()
+        merged = {}
+        for (s, m), series in self._series.items():
+            if s != stage or (model is not None and m != model):
+                continue
+            for start, histogram in series.windows[window].slices(now):
+                merged.setdefault(start, LogHistogram()).merge(histogram)
+        return sorted(merged.items())
+
+    def version(self, stage: str) -> tuple:
+        """نسخه داده‌های یک مرحله؛ با هر نمونه جدید همان مرحله یا reset/load تغییر می‌کند."""
+        return self._generation, self._versions.get(stage, 0)
+
+    def reset(self):
+        self._series.clear()
+        self._generation += 1
+
+    def to_dict(self) -> dict:
+        return {
+            f"{stage}|{model}": {
+                'lifetime': series.lifetime.to_dict(),
+                'windows': {name: window.to_list() for name, window in series.windows.items()},
+            }
+            for (stage, model), series in self._series.items()
+        }
+
+    def load(self, data: dict):
+        now = time.time()
+        self._series.clear()
+        self._generation += 1
+        for key, saved in (data or {}).items():
+            stage, _, model = key.partition("|")
+            series = self._series[(stage, model)] = _Series()
+            series.lifetime = LogHistogram.from_dict(saved.get('lifetime', {}))
+            for name, slots in saved.get('windows', {}).items():
+                if name in series.windows:
+                    series.windows[name].load(slots, now)
+
+
+# --- نمونه سراسری ---
+metrics = LatencyMetrics()
@@ -0,0 +1,120 @@
+# log_reader.py
+
+import os
+import re
+import gzip
+import json
+import shutil
+from collections import deque
+
+BLOCK_SIZE = 64 * 1024
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+_TEXT_LEVEL = re.compile(r" - (DEBUG|INFO|WARNING|ERROR|CRITICAL) - ")
+
+
+def reverse_lines(path: str, block_size: int = BLOCK_SIZE):
+    """خطوط فایل را از آخر به اول برمی‌گرداند؛ فایل به صورت بلوک‌های ثابت از انتها خوانده می‌شود.
+
+    حافظه مصرفی مستقل از حجم فایل و در حد یک بلوک (به علاوه طولانی‌ترین خط) است.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            chunk = f.read(size) + remainder
+            lines = chunk.split(b"\n")
+            # اولین تکه ممکن است ادامه خطی از بلوک قبلی باشد
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line.decode('utf-8', errors='replace')
+        if remainder:
+            yield remainder.decode('utf-8', errors='replace')
+
+
+def log_files(base_path: str) -> list:
+    """فایل لاگ جاری و فایل‌های چرخیده (bot.log.1.gz، bot.log.2 و ...) از جدید به قدیم."""
+    directory = os.path.dirname(base_path) or "."
+    prefix = os.path.basename(base_path) + "."
+    rotated = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        index = name[len(prefix):]
+        if index.endswith(".gz"):
+            index = index[:-3]
+        if index.isdigit():
+            rotated.append((int(index), os.path.join(directory, name)))
+    files = [base_path] if os.path.exists(base_path) else []
+    return files + [path for _, path in sorted(rotated)]
+
+
+def line_level(line: str):
+    """سطح لاگ یک خط (قالب متنی یا JSON)؛ برای خطوط ادامه مانند traceback مقدار None."""
+    if line.startswith("{"):
+        try:
+            return json.loads(line).get('level')
+        except ValueError:
+            return None
+    match = _TEXT_LEVEL.search(line)
+    return match.group(1) if match else None
+
+
+def _matcher(level: str = None, pattern: str = None):
+    minimum = LEVELS.index(level) if level else None
+    needle = pattern.lower() if pattern else None
+
+    def matches(line: str) -> bool:
+        if needle is not None and needle not in line.lower():
+            return False
+        if minimum is not None:
+            found = line_level(line)
+            if found not in LEVELS or LEVELS.index(found) < minimum:
+                return False
+        return True
+    return matches
+
+
+def search(base_path: str, count: int, level: str = None, pattern: str = None) -> list:
+    """آخرین `count` خط منطبق با حداقل سطح `level` و متن `pattern` را به ترتیب زمانی برمی‌گرداند.
+
+    فایل جاری از انتها خوانده می‌شود و در صورت نیاز فایل‌های چرخیده به ترتیب از جدید به قدیم
+    بررسی می‌شوند؛ فایل‌های فشرده به صورت جریانی خوانده شده و فقط یک بافر محدود از آخرین
+    خطوط منطبق نگه داشته می‌شود.
+    """
+    matches = _matcher(level, pattern)
+    found = []  # از جدید به قدیم
+    for path in log_files(base_path):
+        needed = count - len(found)
+        if needed <= 0:
+            break
+        if path.endswith(".gz"):
+            buffer = deque(maxlen=needed)
+            with gzip.open(path, 'rt', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if line and matches(line):
+                        buffer.append(line)
+            found.extend(reversed(buffer))
+        else:
+            for line in reverse_lines(path):
+                if matches(line):
+                    found.append(line)
+                    if len(found) >= count:
+                        break
+    found.reverse()
+    return found
+
+
+def compress_copy(source: str, dest: str):
+    """نسخه فشرده gzip از فایل لاگ را به صورت جریانی (بدون بارگذاری کامل در حافظه) می‌سازد."""
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
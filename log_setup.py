@@ -0,0 +1,113 @@
+# log_setup.py
+
+import os
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import logging
+import logging.handlers
+from datetime import datetime
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# فیلدهای ساختاریافته‌ای که با extra={...} به رکوردها اضافه می‌شوند
+STRUCTURED_FIELDS = ('user_id', 'latency', 'model', 'endpoint', 'job_id')
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """هر رکورد را به یک خط JSON با زمان، سطح، نام لاگر، پیام و فیلدهای ساختاریافته تبدیل می‌کند."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """چرخش فایل لاگ بر اساس حجم یا زمان (هر کدام زودتر برسد) و فشرده‌سازی gzip فایل‌های قدیمی.
+
+    فایل‌های چرخیده با نام‌های bot.log.1.gz، bot.log.2.gz و ... نگه داشته می‌شوند (۱ جدیدترین).
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, interval: float):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval > 0 else None
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source: str, dest: str):
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record) -> bool:
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        # فایل خالی چرخانده نمی‌شود (مثلاً در بازه زمانی بدون لاگ)
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            super().doRollover()
+        if self.rollover_at is not None:
+            self.rollover_at = time.time() + self.interval
+
+
+_listener = None
+
+
+def setup_logging(log_file: str):
+    """لاگ‌ها را از طریق QueueHandler به یک رشته پس‌زمینه می‌فرستد تا نوشتن فایل حلقه رویداد را مسدود نکند.
+
+    تنظیمات از متغیرهای محیطی خوانده می‌شود: LOG_LEVEL، LOG_FORMAT (text یا json)،
+    LOG_MAX_BYTES، LOG_BACKUP_COUNT و LOG_ROTATE_HOURS.
+    """
+    global _listener
+    level = getattr(logging, os.environ.get("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    json_lines = os.environ.get("LOG_FORMAT", "text").lower() == "json"
+    max_bytes = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    backup_count = int(os.environ.get("LOG_BACKUP_COUNT", "10"))
+    rotate_hours = float(os.environ.get("LOG_ROTATE_HOURS", "24"))
+
+    try:
+        with open(log_file, 'a'):
+            pass
+        handler = CompressingRotatingFileHandler(log_file, max_bytes, backup_count, rotate_hours * 3600)
+    except Exception as e:
+        print(f"FATAL: Could not write to log file at {log_file}. Error: {e}")
+        handler = logging.StreamHandler()
+    handler.setFormatter(JsonLinesFormatter() if json_lines else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    # لاگ‌های پرحجم کتابخانه HTTP در سطح INFO برای هر درخواست ثبت می‌شوند
+    logging.getLogger("httpx").setLevel(max(level, logging.WARNING))
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """رکوردهای باقی‌مانده در صف را نوشته و رشته پس‌زمینه را متوقف می‌کند."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -7,8 +7,19 @@ import httpx
 import time
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from openai import AsyncOpenAI
 from keep_alive import start_keep_alive
+from stream_writer import TelegramStreamWriter
+from response_cache import cache as response_cache, make_key
+from request_coalescer import SingleFlight
+from admission import controller as admission, QueueFullError
+import rate_limit
+import broadcast
+from conversation import store as conversation_store
+from model_router import router as model_router
+from latency_metrics import metrics as latency_metrics
+from activity_journal import journal as activity_journal
+import log_setup
+import web_server
 
 # وارد کردن مدیر داده‌ها و پنل ادمین
 import data_manager
@@ -18,79 +29,132 @@ import admin_panel
 start_keep_alive()
 
 # --- بهبود لاگینگ ---
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", 
-    level=logging.INFO,
-    filename=data_manager.LOG_FILE, 
-    filemode='a'
-)
+# نوشتن لاگ‌ها در رشته پس‌زمینه با چرخش و فشرده‌سازی فایل (تنظیمات در log_setup)
+log_setup.setup_logging(data_manager.LOG_FILE)
 logger = logging.getLogger(__name__)
 
-try:
-    with open(data_manager.LOG_FILE, 'a') as f:
-        f.write("")
-except Exception as e:
-    print(f"FATAL: Could not write to log file at {data_manager.LOG_FILE}. Error: {e}")
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-
-# --- ایجاد یک کلاینت HTTP بهینه‌سازی‌شده ---
-http_client = httpx.AsyncClient(
-    http2=True,
-    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=30.0),
-    timeout=httpx.Timeout(timeout=60.0, connect=10.0, read=45.0, write=10.0)
-)
-
-# کلاینت OpenAI (HuggingFace)
-client = AsyncOpenAI(
-    base_url="https://router.huggingface.co/v1",
-    api_key=os.environ["HF_TOKEN"],
-    http_client=http_client
-)
+# --- تنظیمات مدل و پاسخ‌دهی ---
+# نام مدل اصلی در کلید کش استفاده می‌شود؛ پاسخ سرورهای جایگزین هم با همین کلید کش می‌شوند
+MODEL_NAME = model_router.primary.model
+GENERATION_PARAMS = {"temperature": 0.7, "top_p": 0.95}
+# نمایش تدریجی پاسخ با ویرایش پیام (STREAM_REPLIES=0 برای ارسال پاسخ کامل در یک مرحله)
+STREAM_REPLIES = os.environ.get("STREAM_REPLIES", "1").lower() in ("1", "true", "yes", "on")
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.0"))
+# بازه ذخیره هیستوگرام‌های تأخیر روی دیسک (ثانیه)
+METRICS_PERSIST_INTERVAL = float(os.environ.get("METRICS_PERSIST_INTERVAL", "60"))
+# بارگذاری پس‌زمینه کتابخانه‌های سنگین پنل ادمین چند ثانیه پس از آماده شدن سرور (ADMIN_PREWARM=1)
+ADMIN_PREWARM = os.environ.get("ADMIN_PREWARM", "0").lower() in ("1", "true", "yes", "on")
+ADMIN_PREWARM_DELAY = 10
+# بازه نوشتن ژورنال فعالیت و تجمیع‌های آن روی دیسک (ثانیه)
+ACTIVITY_FLUSH_INTERVAL = float(os.environ.get("ACTIVITY_FLUSH_INTERVAL", "30"))
 
 # --- دیکشنری برای مدیریت وظایف پس‌زمینه هر کاربر ---
 user_tasks = {}
 
+# --- ادغام درخواست‌های یکسان هم‌زمان به یک درخواست بالادستی ---
+inflight_requests = SingleFlight()
+
 # --- توابع کمکی برای مدیریت وظایف ---
 def _cleanup_task(task: asyncio.Task, user_id: int):
     if user_id in user_tasks and user_tasks[user_id] == task:
         del user_tasks[user_id]
-        logger.info(f"Cleaned up finished task for user {user_id}.")
+        logger.debug("Cleaned up finished task for user %s.", user_id, extra={'user_id': user_id})
     try:
         exception = task.exception()
         if exception:
-            logger.error(f"Background task for user {user_id} failed: {exception}")
+            logger.error("Background task for user %s failed: %s", user_id, exception, extra={'user_id': user_id})
     except asyncio.CancelledError:
-        logger.info(f"Task for user {user_id} was cancelled.")
+        logger.info("Task for user %s was cancelled.", user_id, extra={'user_id': user_id})
+
+def _record_activity(user_id: int, latency: float):
+    """ثبت پیام پاسخ داده شده در ژورنال فعالیت (روز اولین فعالیت کاربر برای تحلیل ماندگاری لازم است)."""
+    record = data_manager.get_user(user_id)
+    activity_journal.record(user_id, latency, record.first_seen if record is not None else None)
+
+async def _generate(messages: list, cache_key: str, user_id: int, publish) -> str:
+    """پاسخ مدل را تولید می‌کند؛ در حالت جریانی متن جزئی با publish به منتظرها اعلام می‌شود.
+
+    این تابع در یک وظیفه مشترک بین همه کاربرانی که پیام یکسان فرستاده‌اند اجرا می‌شود و
+    پیش از ارسال به سرور باید از کنترل پذیرش (admission) نوبت بگیرد. cache_key=None یعنی پاسخ کش نشود.
+    """
+    queued_at = time.monotonic()
+    async with admission.slot(user_id, priority=user_id in admin_panel.ADMIN_IDS):
+        latency_metrics.record('queue_wait', time.monotonic() - queued_at, MODEL_NAME)
+        text = await _call_model(messages, publish)
+
+    if text.strip() and response_cache is not None and cache_key is not None:
+        await response_cache.put(cache_key, text)
+    return text
+
+async def _call_model(messages: list, publish) -> str:
+    """فراخوانی بالادستی مدل (جریانی یا کامل) از طریق روتر سرورهای مدل."""
+    return await model_router.complete(messages, GENERATION_PARAMS, publish, stream=STREAM_REPLIES)
 
 async def _process_user_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     user_message = update.message.text
     user_id = update.effective_user.id
+    if conversation_store is not None:
+        messages = await conversation_store.messages_for(user_id, user_message)
+    else:
+        messages = [{"role": "user", "content": user_message}]
+    writer = TelegramStreamWriter(update.message, edit_interval=STREAM_EDIT_INTERVAL)
     
     start_time = time.time()
 
     try:
+        # فقط پیام‌های بدون تاریخچه گفتگو بین کاربران یکسان‌اند؛ با وجود تاریخچه کلید شامل گفتگوی
+        # همین کاربر است، پس کش و ادغام با دیگران کنار گذاشته می‌شود و کلید پرواز به کاربر اختصاص دارد.
+        shared = len(messages) == 1
+        prompt_key = make_key(messages, MODEL_NAME, GENERATION_PARAMS)
+        cache_key = prompt_key if shared else None
+        flight_key = prompt_key if shared else (user_id, prompt_key)
+
+        # پاسخ‌های تکراری مستقیماً از کش ارسال می‌شوند
+        cached = await response_cache.get(cache_key) if response_cache is not None and shared else None
+        if cached is not None:
+            send_started = time.monotonic()
+            await writer.finish(cached)
+            latency_metrics.record('telegram_send', time.monotonic() - send_started, "cache")
+            if conversation_store is not None:
+                await conversation_store.record(user_id, user_message, cached)
+            latency = time.time() - start_time
+            data_manager.update_response_stats(latency, "cache")
+            data_manager.update_user_stats(user_id, update.effective_user)
+            _record_activity(user_id, latency)
+            return
+
         await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-        response = await client.chat.completions.create(
-            model="huihui-ai/gemma-3-27b-it-abliterated:featherless-ai",
-            messages=[{"role": "user", "content": user_message}],
-            temperature=0.7,
-            top_p=0.95,
-            stream=False,
+        reply = await inflight_requests.run(
+            flight_key,
+            lambda publish: _generate(messages, cache_key, user_id, publish),
+            on_text=writer.update if STREAM_REPLIES else None,
         )
-        
-        end_time = time.time()
-        response_time = end_time - start_time
-        data_manager.update_response_stats(response_time)
-        
-        await update.message.reply_text(response.choices[0].message.content)
+
+        if not reply.strip():
+            await update.message.reply_text("❌ متاسفانه در پردازش درخواست شما مشکلی پیش آمد. لطفاً دوباره تلاش کنید.")
+            return
+
+        send_started = time.monotonic()
+        await writer.finish(reply)
+        latency_metrics.record('telegram_send', time.monotonic() - send_started, MODEL_NAME)
+        latency = time.time() - start_time
+        data_manager.update_response_stats(latency, MODEL_NAME)
+        logger.info("Replied to user %s in %.2fs.", user_id, latency,
+                    extra={'user_id': user_id, 'latency': round(latency, 3), 'model': MODEL_NAME})
+        if conversation_store is not None:
+            await conversation_store.record(user_id, user_message, reply)
         data_manager.update_user_stats(user_id, update.effective_user)
+        _record_activity(user_id, latency)
 
+    except QueueFullError:
+        logger.warning("Upstream queue full; rejected request from user %s.", user_id, extra={'user_id': user_id})
+        await update.message.reply_text("⏳ ربات در حال حاضر بسیار شلوغ است. لطفاً چند لحظه دیگر دوباره تلاش کنید.")
     except httpx.TimeoutException:
-        logger.warning(f"Request timed out for user {user_id}.")
+        logger.warning("Request timed out for user %s.", user_id, extra={'user_id': user_id})
         await update.message.reply_text("⏱️ ارتباط با سرور هوش مصنوعی طولانی شد. لطفاً دوباره تلاش کنید.")
     except Exception as e:
-        logger.error(f"Error while processing message for user {user_id}: {e}")
+        logger.error("Error while processing message for user %s: %s", user_id, e, extra={'user_id': user_id})
         await update.message.reply_text("❌ متاسفانه در پردازش درخواست شما مشکلی پیش آمد. لطفاً دوباره تلاش کنید.")
 
 # --- هندلرهای اصلی ربات ---
@@ -106,12 +170,20 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         disable_web_page_preview=True
     )
 
+async def reset_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """تاریخچه گفتگوی کاربر را پاک می‌کند تا گفتگوی جدیدی شروع شود."""
+    if conversation_store is None:
+        await update.message.reply_text("ℹ️ ربات تاریخچه گفتگو را نگه نمی‌دارد.")
+        return
+    await conversation_store.reset(update.effective_user.id)
+    await update.message.reply_text("🧹 تاریخچه گفتگو پاک شد. می‌توانید گفتگوی جدیدی را شروع کنید.")
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     
     # بررسی مسدود بودن کاربر
     if data_manager.is_user_banned(user_id):
-        logger.info(f"Banned user {user_id} tried to send a message.")
+        logger.info("Banned user %s tried to send a message.", user_id, extra={'user_id': user_id})
         return
     
     # بررسی حالت نگهداری (فقط برای کاربران عادی)
@@ -121,47 +193,106 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     # بررسی کلمات مسدود شده
     if data_manager.contains_blocked_words(update.message.text):
-        logger.info(f"User {user_id} sent a message with a blocked word.")
+        logger.info("User %s sent a message with a blocked word.", user_id, extra={'user_id': user_id})
         # می‌توانید به کاربر اطلاع دهید یا پیام را نادیده بگیرید
         # await update.message.reply_text("⚠️ پیام شما حاوی کلمات نامناسب است و ارسال نشد.")
         return
 
+    # محدودیت نرخ پیام‌ها؛ پیش از لغو وظیفه قبلی و هر درخواستی به مدل بررسی می‌شود
+    if user_id not in admin_panel.ADMIN_IDS:
+        verdict = rate_limit.limiter.check(user_id)
+        if verdict != rate_limit.ALLOWED:
+            logger.info("Rate limited message from user %s (%s).", user_id, verdict, extra={'user_id': user_id})
+            if rate_limit.limiter.should_warn(user_id):
+                if verdict == rate_limit.USER_LIMITED:
+                    await update.message.reply_text("⏳ پیام‌های شما خیلی سریع ارسال می‌شوند. لطفاً کمی صبر کنید و دوباره تلاش کنید.")
+                else:
+                    await update.message.reply_text("⏳ ربات در حال حاضر پیام‌های زیادی دریافت می‌کند. لطفاً کمی بعد دوباره تلاش کنید.")
+            return
+
     if user_id in user_tasks and not user_tasks[user_id].done():
         user_tasks[user_id].cancel()
-        logger.info(f"Cancelled previous task for user {user_id} to start a new one.")
+        logger.info("Cancelled previous task for user %s to start a new one.", user_id, extra={'user_id': user_id})
 
     task = asyncio.create_task(_process_user_request(update, context))
     user_tasks[user_id] = task
     task.add_done_callback(lambda t: _cleanup_task(t, user_id))
 
+async def _purge_response_cache(context: ContextTypes.DEFAULT_TYPE):
+    await response_cache.purge_expired()
+
+async def _purge_conversations(context: ContextTypes.DEFAULT_TYPE):
+    await conversation_store.purge_expired()
+
+async def _persist_latency_metrics(context: ContextTypes.DEFAULT_TYPE):
+    data_manager.persist_latency_metrics()
+
+async def _flush_activity_journal(context: ContextTypes.DEFAULT_TYPE):
+    await activity_journal.flush()
+
+async def _prewarm_admin(context: ContextTypes.DEFAULT_TYPE):
+    await admin_panel.prewarm_heavy_modules()
+
+async def _post_init(application: Application):
+    await data_manager.start_write_behind(application)
+    # تجمیع‌های فعالیت پیش از دریافت اولین پیام با رکوردهای ذخیره نشده ژورنال هم‌گام می‌شوند
+    await activity_journal.recover()
+    # ادامه ارسال‌های همگانی که پیش از راه‌اندازی مجدد نیمه‌تمام مانده‌اند
+    await broadcast.resume_jobs(application)
+
+async def _post_shutdown(application: Application):
+    # ابتدا پیشرفت ارسال‌های همگانی ثبت می‌شود تا در ذخیره نهایی قرار گیرد
+    await broadcast.suspend_jobs(application)
+    await model_router.close()
+    await activity_journal.flush()
+    await data_manager.stop_write_behind(application)
+
 def main() -> None:
     token = os.environ.get("BOT_TOKEN")
     if not token:
         logger.error("BOT_TOKEN not set in environment variables!")
         return
 
+    # اعمال محدودیت‌های نرخ ذخیره شده توسط ادمین
+    rate_limit.limiter.configure(**data_manager.DATA.get('rate_limits', {}))
+
     application = (
         Application.builder()
         .token(token)
         .concurrent_updates(True)
+        .updater(None)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
         .build()
     )
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("reset", reset_conversation))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
     # راه‌اندازی و ثبت هندلرهای پنل ادمین
     admin_panel.setup_admin_handlers(application)
 
+    # پاک‌سازی دوره‌ای ورودی‌های منقضی شده کش پاسخ‌ها
+    if response_cache is not None:
+        application.job_queue.run_repeating(_purge_response_cache, interval=600, first=600)
+    # پاک‌سازی دوره‌ای گفتگوهای منقضی شده
+    if conversation_store is not None:
+        application.job_queue.run_repeating(_purge_conversations, interval=600, first=600)
+
+    # ذخیره دوره‌ای هیستوگرام‌های تأخیر (به‌جای ذخیره پس از هر پاسخ)
+    application.job_queue.run_repeating(_persist_latency_metrics, interval=METRICS_PERSIST_INTERVAL, first=METRICS_PERSIST_INTERVAL)
+
+    application.job_queue.run_repeating(_flush_activity_journal, interval=ACTIVITY_FLUSH_INTERVAL, first=ACTIVITY_FLUSH_INTERVAL)
+
+    if ADMIN_PREWARM:
+        application.job_queue.run_once(_prewarm_admin, when=ADMIN_PREWARM_DELAY)
+
     port = int(os.environ.get("PORT", 8443))
     webhook_url = os.environ.get("RENDER_EXTERNAL_URL") + "/webhook"
     
-    application.run_webhook(
-        listen="0.0.0.0",
-        port=port,
-        webhook_url=webhook_url,
-        url_path="webhook"
-    )
+    # سرور وب اختصاصی: webhook تلگرام به همراه /metrics برای Prometheus
+    asyncio.run(web_server.run(application, port=port, webhook_url=webhook_url, url_path="webhook"))
 
 if __name__ == "__main__":
     main()
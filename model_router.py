@@ -0,0 +1,375 @@
+# model_router.py
+
+import os
+import json
+import time
+import asyncio
+import logging
+import httpx
+from collections import deque
+from openai import AsyncOpenAI
+from batching import MicroBatcher
+from latency_metrics import metrics as latency_metrics
+
+logger = logging.getLogger(__name__)
+
+
+# حالت‌های درخواست با سری تأخیر جداگانه: جریانی (تأخیر تا اولین توکن) و غیرجریانی (تأخیر کل پاسخ)
+MODES = ('stream', 'full')
+
+
+class NoEndpointAvailable(Exception):
+    """همه سرورهای مدل در دسترس نیستند (مدارشکن باز است یا همه تلاش‌ها شکست خورده‌اند)."""
+
+
+class Endpoint:
+    """یک سرور/مدل بالادستی با آمار تأخیر، نرخ خطا و مدارشکن (circuit breaker)."""
+
+    # مدارشکن پس از این تعداد خطای متوالی باز می‌شود
+    FAILURE_THRESHOLD = 5
+    BASE_COOLDOWN = 30.0
+    MAX_COOLDOWN = 300.0
+
+    def __init__(self, name: str, model: str, client, window: int = 200, batcher: MicroBatcher = None):
+        self.name = name
+        self.model = model
+        self.client = client
+        self.batcher = batcher
+        self._latencies = {mode: deque(maxlen=window) for mode in MODES}
+        self._outcomes = deque(maxlen=50)   # True برای موفق و False برای خطا
+        self._consecutive_failures = 0
+        self._cooldown = self.BASE_COOLDOWN
+        self._open_until = 0.0
+        self._probing = False
+        self.requests = 0
+        self.failures = 0
+
+    # --- آمار ---
+    def percentile(self, q: float, mode: str = 'full'):
+        latencies = self._latencies[mode]
+        if not latencies:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def samples(self, mode: str = 'full') -> int:
+        return len(self._latencies[mode])
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    # --- مدارشکن ---
+    @property
+    def state(self) -> str:
+        if self._open_until == 0.0:
+            return "closed"
+        return "open" if time.monotonic() < self._open_until else "half_open"
+
+    def available(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        # در حالت نیمه‌باز فقط یک درخواست آزمایشی هم‌زمان مجاز است
+        return state == "half_open" and not self._probing
+
+    def begin(self):
+        self.requests += 1
+        if self.state == "half_open":
+            self._probing = True
+
+    def record_success(self, latency: float, mode: str = 'full'):
+        self._latencies[mode].append(latency)
+        self._outcomes.append(True)
+        self._consecutive_failures = 0
+        if self._open_until:
+            logger.info("Model endpoint %s recovered; circuit closed.", self.name, extra={'endpoint': self.name})
+        self._open_until = 0.0
+        self._cooldown = self.BASE_COOLDOWN
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._outcomes.append(False)
+        self._consecutive_failures += 1
+        was_probe = self._probing
+        self._probing = False
+        if was_probe or self._consecutive_failures >= self.FAILURE_THRESHOLD:
+            if was_probe:
+                self._cooldown = min(self.MAX_COOLDOWN, self._cooldown * 2)
+            self._open_until = time.monotonic() + self._cooldown
+            logger.warning("Model endpoint %s circuit opened for %.0fs.", self.name, self._cooldown, extra={'endpoint': self.name})
+
+    def release_probe(self):
+        """درخواست آزمایشی بدون نتیجه (مثلاً لغو شده) پایان یافت."""
+        self._probing = False
+
+
+class _Race:
+    """وضعیت مشترک بین درخواست اصلی و درخواست پشتیبان (hedge)."""
+
+    def __init__(self, publish):
+        self.publish = publish
+        self.winner = None
+        self.started = asyncio.Event()
+
+
+class ModelRouter:
+    """انتخاب سالم‌ترین سرور مدل با failover خودکار و درخواست‌های پشتیبان (hedged requests).
+
+    هر درخواست به سروری با کمترین امتیاز (میانه تأخیر ضربدر جریمه نرخ خطا) فرستاده می‌شود و سرورهای
+    دارای مدارشکن باز نادیده گرفته می‌شوند. اگر پاسخ (در حالت جریانی: اولین توکن) از صدک ۹۵ تأخیر
+    آن سرور دیرتر شود، یک درخواست پشتیبان به سرور بعدی فرستاده می‌شود و هر کدام زودتر پاسخ دهد
+    برنده است؛ درخواست دیگر لغو می‌شود. اگر سروری پیش از تولید هر متنی خطا دهد، درخواست به سرور
+    بعدی منتقل می‌شود.
+    """
+
+    # تأخیر فرضی سرورهایی که هنوز نمونه‌ای ندارند (ترتیب تعریف سرورها در این حالت تعیین‌کننده است)
+    DEFAULT_LATENCY = 10.0
+
+    def __init__(self, endpoints: list, hedge: bool = True, hedge_min_samples: int = 20, hedge_min_delay: float = 0.5):
+        if not endpoints:
+            raise ValueError("حداقل یک سرور مدل لازم است.")
+        self.endpoints = endpoints
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    @property
+    def primary(self) -> Endpoint:
+        return self.endpoints[0]
+
+    def _score(self, endpoint: Endpoint, mode: str) -> float:
+        p50 = endpoint.percentile(0.5, mode)
+        return (p50 if p50 is not None else self.DEFAULT_LATENCY) * (1 + 4 * endpoint.error_rate)
+
+    def choose(self, exclude=(), stream: bool = False):
+        """سالم‌ترین سرور در دسترس برای حالت درخواست (جریانی یا نه) یا None."""
+        candidates = [e for e in self.endpoints if e not in exclude and e.available()]
+        if not candidates:
+            return None
+        mode = 'stream' if stream else 'full'
+        return min(candidates, key=lambda endpoint: self._score(endpoint, mode))
+
+    def _hedge_delay(self, endpoint: Endpoint, stream: bool):
+        mode = 'stream' if stream else 'full'
+        if not self.hedge or len(self.endpoints) < 2 or endpoint.samples(mode) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, endpoint.percentile(0.95, mode))
+
+    async def complete(self, messages: list, params: dict, publish, stream: bool) -> str:
+        """متن پاسخ را برمی‌گرداند؛ در حالت جریانی متن جزئی با publish اعلام می‌شود."""
+        tried = set()
+        last_error = None
+        while True:
+            endpoint = self.choose(exclude=tried, stream=stream)
+            if endpoint is None:
+                if last_error is not None:
+                    raise last_error
+                raise NoEndpointAvailable()
+            if tried:
+                self.failovers += 1
+            tried.add(endpoint)
+            race = _Race(publish)
+            try:
+                return await self._hedged(endpoint, messages, params, stream, race, tried)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if race.winner is not None:
+                    # بخشی از پاسخ به کاربر نمایش داده شده؛ تکرار روی سرور دیگر ممکن نیست
+                    raise
+                logger.warning("Model endpoint %s failed, trying another: %s", endpoint.name, e, extra={'endpoint': endpoint.name, 'model': endpoint.model})
+                last_error = e
+
+    async def _hedged(self, endpoint: Endpoint, messages, params, stream, race: _Race, tried: set) -> str:
+        first = asyncio.create_task(self._attempt(endpoint, messages, params, stream, race))
+        owners = {first: endpoint}
+        tasks = {first}
+        delay = self._hedge_delay(endpoint, stream)
+        try:
+            if delay is not None:
+                started = asyncio.ensure_future(race.started.wait())
+                try:
+                    await asyncio.wait(tasks | {started}, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    started.cancel()
+                if not race.started.is_set() and not any(task.done() for task in tasks):
+                    backup = self.choose(exclude=tried, stream=stream)
+                    if backup is not None:
+                        tried.add(backup)
+                        self.hedged += 1
+                        logger.info("Hedging slow request on %s with %s after %.2fs.", endpoint.name, backup.name, delay, extra={'endpoint': endpoint.name})
+                        task = asyncio.create_task(self._attempt(backup, messages, params, stream, race))
+                        owners[task] = backup
+                        tasks.add(task)
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        if race.winner is not None and race.winner is owners[task]:
+                            raise error
+                    elif task.result() is not None:
+                        winner, text = task.result()
+                        if winner is not endpoint:
+                            self.hedge_wins += 1
+                        return text
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _attempt(self, endpoint: Endpoint, messages, params, stream: bool, race: _Race):
+        """یک درخواست به یک سرور؛ (سرور، متن) برای برنده و None برای بازنده برمی‌گرداند.
+
+        نتیجه (موفق یا خطا) فقط پس از پایان کامل درخواست ثبت می‌شود تا خطای پس از اولین توکن هم به
+        مدارشکن برسد. در حالت جریانی تأخیر تا اولین توکن و در حالت غیرجریانی تأخیر کل در سری جداگانه
+        ثبت می‌شود، چون هر کدام مبنای تصمیم درخواست پشتیبان در همان حالت است.
+        """
+        endpoint.begin()
+        start = time.monotonic()
+        first_token = None
+
+        def claim() -> bool:
+            """این سرور را (در صورت نبودن برنده) برنده اعلام می‌کند؛ False یعنی سرور دیگری برنده شده است."""
+            nonlocal first_token
+            if race.winner is None:
+                race.winner = endpoint
+                race.started.set()
+                first_token = time.monotonic() - start
+            return race.winner is endpoint
+
+        def lost():
+            # بازنده نتیجه‌ای ندارد؛ فقط مجوز درخواست آزمایشی مدارشکن آزاد می‌شود
+            endpoint.release_probe()
+
+        try:
+            if endpoint.batcher is not None:
+                def on_text(partial: str):
+                    # اولین توکن تعیین‌کننده برنده است؛ خروجی بازنده نادیده گرفته می‌شود
+                    if claim():
+                        race.publish(partial)
+
+                text = await endpoint.batcher.submit(messages, params, on_text if stream else None)
+                if not claim():
+                    return lost()
+            elif stream:
+                response = await endpoint.client.chat.completions.create(
+                    model=endpoint.model, messages=messages, stream=True, **params
+                )
+                text = ""
+                try:
+                    async for chunk in response:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if not delta:
+                            continue
+                        # اولین توکن تعیین‌کننده برنده است
+                        if not claim():
+                            return lost()
+                        text += delta
+                        race.publish(text)
+                finally:
+                    # در صورت لغو یا باخت، اتصال جریانی بسته می‌شود تا تولید پاسخ در سرور هم متوقف شود
+                    await response.close()
+                # پاسخ خالی بدون هیچ توکنی
+                if not claim():
+                    return lost()
+            else:
+                response = await endpoint.client.chat.completions.create(
+                    model=endpoint.model, messages=messages, stream=False, **params
+                )
+                text = response.choices[0].message.content or ""
+                if not claim():
+                    return lost()
+            elapsed = time.monotonic() - start
+            endpoint.record_success(first_token if stream else elapsed, 'stream' if stream else 'full')
+            latency_metrics.record('upstream', elapsed, endpoint.model)
+            return endpoint, text
+        except asyncio.CancelledError:
+            endpoint.release_probe()
+            raise
+        except Exception:
+            endpoint.record_failure()
+            raise
+
+    async def close(self):
+        """ارسال‌های دسته‌ای در حال اجرا را پیش از خاموش شدن به پایان می‌رساند."""
+        for endpoint in self.endpoints:
+            if endpoint.batcher is not None:
+                await endpoint.batcher.close()
+
+    def stats(self) -> list:
+        return [
+            {
+                'name': e.name,
+                'model': e.model,
+                'state': e.state,
+                'p50': e.percentile(0.5),
+                'p95': e.percentile(0.95),
+                'ttft_p50': e.percentile(0.5, 'stream'),
+                'ttft_p95': e.percentile(0.95, 'stream'),
+                'error_rate': e.error_rate,
+                'requests': e.requests,
+                'failures': e.failures,
+                'avg_batch': e.batcher.average_batch if e.batcher is not None else None,
+            }
+            for e in self.endpoints
+        ]
+
+
+# --- پیکربندی ---
+# ROUTER_ENDPOINTS یک لیست JSON از سرورهاست، مثلاً:
+# [{"name": "hf", "base_url": "https://router.huggingface.co/v1", "model": "...", "api_key_env": "HF_TOKEN"}]
+# برای سرورهای خودمیزبانی که پردازش دسته‌ای دارند (مثل vLLM) می‌توان دسته‌بندی را فعال کرد:
+# {"name": "gpu", ..., "batch": true, "template": "gemma", "batch_window_ms": 20, "batch_max": 16, "max_tokens": 1024}
+DEFAULT_ENDPOINTS = [{
+    "name": "huggingface",
+    "base_url": "https://router.huggingface.co/v1",
+    "model": "huihui-ai/gemma-3-27b-it-abliterated:featherless-ai",
+    "api_key_env": "HF_TOKEN",
+}]
+ROUTER_HEDGE = os.environ.get("ROUTER_HEDGE", "1").lower() in ("1", "true", "yes", "on")
+
+
+def build_router(http_client) -> ModelRouter:
+    """روتر را از روی ROUTER_ENDPOINTS (یا سرور پیش‌فرض) با کلاینت HTTP مشترک می‌سازد."""
+    raw = os.environ.get("ROUTER_ENDPOINTS")
+    configs = json.loads(raw) if raw else DEFAULT_ENDPOINTS
+    endpoints = []
+    for index, config in enumerate(configs):
+        client = AsyncOpenAI(
+            base_url=config["base_url"],
+            api_key=os.environ[config.get("api_key_env", "HF_TOKEN")],
+            http_client=http_client,
+        )
+        batcher = None
+        if config.get("batch"):
+            batcher = MicroBatcher(
+                client, config["model"],
+                template=config.get("template", "gemma"),
+                window=config.get("batch_window_ms", 20) / 1000,
+                max_batch=config.get("batch_max", 16),
+                max_tokens=config.get("max_tokens", 1024),
+            )
+        endpoints.append(Endpoint(config.get("name", f"endpoint-{index + 1}"), config["model"], client, batcher=batcher))
+    return ModelRouter(endpoints, hedge=ROUTER_HEDGE)
+
+
+# --- کلاینت HTTP مشترک بهینه‌سازی‌شده و نمونه سراسری روتر ---
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=30.0),
+    timeout=httpx.Timeout(timeout=60.0, connect=10.0, read=45.0, write=10.0)
+)
+
+router = build_router(http_client)
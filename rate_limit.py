@@ -0,0 +1,138 @@
+# rate_limit.py
+
+import os
+import time
+from collections import OrderedDict
+
+ALLOWED = "allowed"
+USER_LIMITED = "user_limited"
+GLOBAL_LIMITED = "global_limited"
+
+
+class TokenBucket:
+    """سطل توکن: هر درخواست یک توکن مصرف می‌کند و توکن‌ها با نرخ `rate` در ثانیه تا سقف `capacity` پر می‌شوند."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'warned')
+
+    def __init__(self, rate: float, capacity: float, now: float = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+        self.warned = False
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def consume(self, now: float = None, amount: float = 1.0) -> bool:
+        """در صورت وجود توکن کافی آن را مصرف کرده و True برمی‌گرداند."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def delay(self, now: float = None, amount: float = 1.0) -> float:
+        """مدت زمانی (ثانیه) که تا در دسترس بودن توکن کافی باید صبر کرد."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= amount or self.rate <= 0:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def idle_full(self, now: float) -> bool:
+        """آیا سطل تا این لحظه دوباره کاملاً پر شده است (و نگه‌داشتن آن بی‌فایده است)؟"""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """محدودکننده نرخ پیام‌های ورودی: یک سطل توکن برای هر کاربر فعال و یک سطل سراسری.
+
+    سطل‌ها به ترتیب آخرین استفاده نگه داشته می‌شوند و سطل‌هایی که دوباره پر شده‌اند (یعنی
+    کاربر مدتی پیام نداده) از ابتدای صف حذف می‌شوند؛ بنابراین حافظه فقط به تعداد کاربران
+    فعال اخیر وابسته است. نرخ‌ها بر حسب پیام در دقیقه و 0 یعنی بدون محدودیت.
+    """
+
+    def __init__(self, user_per_minute: float, user_burst: int, global_per_minute: float, global_burst: int):
+        self._buckets = OrderedDict()
+        self.configure(user_per_minute, user_burst, global_per_minute, global_burst)
+        self.rejected = 0
+
+    def configure(self, user_per_minute=None, user_burst=None, global_per_minute=None, global_burst=None):
+        """تنظیم محدودیت‌ها؛ پارامترهای None بدون تغییر می‌مانند."""
+        if user_per_minute is not None:
+            self.user_per_minute = float(user_per_minute)
+        if user_burst is not None:
+            self.user_burst = max(1, int(user_burst))
+        if global_per_minute is not None:
+            self.global_per_minute = float(global_per_minute)
+        if global_burst is not None:
+            self.global_burst = max(1, int(global_burst))
+        # سطل‌های موجود با تنظیمات جدید از نو ساخته می‌شوند
+        self._buckets.clear()
+        self._global = TokenBucket(self.global_per_minute / 60, self.global_burst)
+
+    def settings(self) -> dict:
+        return {
+            'user_per_minute': self.user_per_minute,
+            'user_burst': self.user_burst,
+            'global_per_minute': self.global_per_minute,
+            'global_burst': self.global_burst,
+        }
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def check(self, user_id: int) -> str:
+        """بررسی و ثبت یک پیام ورودی؛ ALLOWED یا دلیل رد شدن را برمی‌گرداند."""
+        now = time.monotonic()
+        self._evict(now)
+
+        if self.user_per_minute > 0:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(self.user_per_minute / 60, self.user_burst, now)
+            else:
+                self._buckets.move_to_end(user_id)
+            if not bucket.consume(now):
+                self.rejected += 1
+                return USER_LIMITED
+
+        if self.global_per_minute > 0 and not self._global.consume(now):
+            if self.user_per_minute > 0:
+                # پیام رد شده نباید سهمیه کاربر را مصرف کند
+                bucket.tokens += 1
+            self.rejected += 1
+            return GLOBAL_LIMITED
+
+        if self.user_per_minute > 0:
+            bucket.warned = False
+        return ALLOWED
+
+    def should_warn(self, user_id: int) -> bool:
+        """فقط یک بار در هر دوره محدودیت به کاربر هشدار داده شود."""
+        bucket = self._buckets.get(user_id)
+        if bucket is None or bucket.warned:
+            return False
+        bucket.warned = True
+        return True
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            user_id = next(iter(buckets))
+            if not buckets[user_id].idle_full(now):
+                break
+            del buckets[user_id]
+
+
+# --- نمونه سراسری (تنظیمات ذخیره شده توسط ادمین هنگام راه‌اندازی اعمال می‌شوند) ---
+limiter = RateLimiter(
+    float(os.environ.get("RATE_LIMIT_USER_PER_MIN", "12")),
+    int(os.environ.get("RATE_LIMIT_USER_BURST", "5")),
+    float(os.environ.get("RATE_LIMIT_GLOBAL_PER_MIN", "0")),
+    int(os.environ.get("RATE_LIMIT_GLOBAL_BURST", "100")),
+)
@@ -0,0 +1,86 @@
+# request_coalescer.py
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """یک درخواست در حال اجرا که چند منتظر نتیجه آن را به اشتراک می‌گذارند."""
+
+    __slots__ = ('task', 'text', 'listeners', 'waiters')
+
+    def __init__(self):
+        self.task = None
+        self.text = ""
+        self.listeners = set()
+        self.waiters = 0
+
+    def publish(self, text: str):
+        """متن جزئی تولید شده تا این لحظه را به همه منتظرها اعلام می‌کند."""
+        self.text = text
+        for event in self.listeners:
+            event.set()
+
+
+class SingleFlight:
+    """ادغام درخواست‌های یکسان هم‌زمان (single-flight).
+
+    اولین فراخوانی با یک کلید، تولیدکننده را در یک وظیفه مستقل اجرا می‌کند و فراخوانی‌های بعدی
+    با همان کلید تا پایان آن به همان نتیجه متصل می‌شوند. لغو شدن یکی از منتظرها (مثلاً وقتی کاربر
+    پیام جدیدی می‌فرستد) درخواست مشترک را لغو نمی‌کند؛ فقط وقتی هیچ منتظری باقی نماند درخواست
+    بالادستی لغو می‌شود.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._flights)
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def run(self, key, producer, on_text=None):
+        """نتیجه producer(publish) را برمی‌گرداند؛ on_text با هر متن جزئی جدید فراخوانی می‌شود."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.create_task(producer(flight.publish))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self._flights[key] = flight
+        else:
+            self.coalesced += 1
+            logger.debug("Coalesced request joined in-flight key %.12s (%s waiting).", key, flight.waiters)
+
+        flight.waiters += 1
+        event = asyncio.Event()
+        if on_text is not None:
+            flight.listeners.add(event)
+            if flight.text:
+                event.set()
+        try:
+            while not flight.task.done():
+                if on_text is None:
+                    # shield: لغو این منتظر نباید وظیفه مشترک را لغو کند
+                    await asyncio.shield(flight.task)
+                    break
+                changed = asyncio.ensure_future(event.wait())
+                try:
+                    await asyncio.wait({flight.task, changed}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    changed.cancel()
+                if event.is_set() and not flight.task.done():
+                    event.clear()
+                    await on_text(flight.text)
+            return flight.task.result()
+        finally:
+            flight.listeners.discard(event)
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+                # تا اجرای done callback، درخواست تکراری نباید به این پرواز لغو شده متصل شود
+                self._forget(key, flight)
@@ -0,0 +1,185 @@
+# response_cache.py
+
+import os
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(text: str) -> str:
+    """پیام را برای کلید کش یکسان‌سازی می‌کند (حروف کوچک و فاصله‌های تکراری)."""
+    return " ".join(text.split()).lower()
+
+
+def make_key(messages, model: str, params: dict) -> str:
+    """کلید کش را از پیام‌های یکسان‌سازی شده، نام مدل و پارامترهای نمونه‌برداری می‌سازد."""
+    payload = json.dumps(
+        {
+            "messages": [[m["role"], normalize_prompt(m["content"])] for m in messages],
+            "model": model,
+            "params": params,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _DiskTier:
+    """لایه دوم کش روی دیسک (SQLite) که پس از راه‌اندازی مجدد هم باقی می‌ماند."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache(expires)")
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0], row[1]
+
+    def put(self, key: str, value: str, expires: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires) VALUES (?, ?, ?)", (key, value, expires)
+            )
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache WHERE expires < ?", (time.time(),))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """کش پاسخ‌های مدل با حذف LRU بر اساس سقف حجم و انقضای TTL و لایه اختیاری روی دیسک."""
+
+    def __init__(self, max_bytes: int, ttl: float, disk_path: str = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expires, size)
+        self._bytes = 0
+        self._disk = _DiskTier(disk_path) if disk_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def _store(self, key: str, value: str, expires: float):
+        size = len(value.encode('utf-8')) + len(key)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        self._entries[key] = (value, expires, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    async def get(self, key: str):
+        """پاسخ کش شده یا None را برمی‌گرداند."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] >= time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self._entries[key]
+            self._bytes -= entry[2]
+
+        if self._disk is not None:
+            try:
+                found = await asyncio.to_thread(self._disk.get, key)
+            except Exception as e:
+                logger.warning("Response cache disk read failed: %s", e)
+                found = None
+            if found is not None:
+                value, expires = found
+                self._store(key, value, expires)
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, value: str):
+        """پاسخ را در کش حافظه (و در صورت فعال بودن، روی دیسک) ذخیره می‌کند."""
+        expires = time.time() + self.ttl
+        self._store(key, value, expires)
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.put, key, value, expires)
+            except Exception as e:
+                logger.warning("Response cache disk write failed: %s", e)
+
+    async def clear(self):
+        """تمام ورودی‌های کش (حافظه و دیسک) را پاک می‌کند."""
+        self._entries.clear()
+        self._bytes = 0
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.clear)
+
+    async def purge_expired(self):
+        """ورودی‌های منقضی شده را از حافظه و دیسک حذف می‌کند."""
+        now = time.time()
+        for key in [k for k, (_, expires, _) in self._entries.items() if expires < now]:
+            self._bytes -= self._entries.pop(key)[2]
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.purge_expired)
+
+    async def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            'disk_entries': await asyncio.to_thread(self._disk.count) if self._disk is not None else None,
+        }
+
+
+# --- نمونه سراسری کش ---
+# RESPONSE_CACHE_FILE خالی یعنی فقط کش درون حافظه
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_FILE = os.environ.get("RESPONSE_CACHE_FILE", "")
+
+cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_FILE or None) \
+    if RESPONSE_CACHE_ENABLED else None
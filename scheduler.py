@@ -0,0 +1,237 @@
+# scheduler.py
+
+import os
+import time
+import heapq
+import logging
+from datetime import datetime, timedelta
+
+import data_manager
+import broadcast
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# تعداد ارسال‌های انجام شده‌ای که در بایگانی نگه داشته می‌شوند
+SCHEDULE_ARCHIVE_SIZE = int(os.environ.get("SCHEDULE_ARCHIVE_SIZE", "50"))
+
+
+# --- عبارت‌های زمان‌بندی تکرارشونده (مشابه cron) ---
+class CronExpression:
+    """عبارت پنج‌بخشی cron: «دقیقه ساعت روز-ماه ماه روز-هفته» به وقت محلی.
+
+    هر بخش می‌تواند `*`، عدد، بازه (`1-5`)، گام (`*/15` یا `0-30/10`) یا لیستی از این‌ها با کاما
+    باشد. روز هفته از 0 (یکشنبه) تا 6 است و 7 هم یکشنبه حساب می‌شود. اگر هر دو بخش روز-ماه و
+    روز-هفته محدود شده باشند، تطابق با هر کدام کافی است (مانند cron استاندارد).
+    """
+
+    _FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+
+    def __init__(self, expr: str):
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError("عبارت cron باید دقیقاً ۵ بخش داشته باشد.")
+        self.expr = " ".join(parts)
+        values = [self._parse_field(part, low, high) for part, (_, low, high) in zip(parts, self._FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        self.weekdays = {d % 7 for d in weekdays}
+        self._day_restricted = parts[2] != '*'
+        self._weekday_restricted = parts[4] != '*'
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> set:
+        values = set()
+        for item in field.split(','):
+            range_part, _, step = item.partition('/')
+            step = int(step) if step else 1
+            if range_part == '*':
+                start, end = low, high
+            elif '-' in range_part:
+                start, end = map(int, range_part.split('-', 1))
+            else:
+                start = end = int(range_part)
+            if step < 1 or start < low or end > high or start > end:
+                raise ValueError(f"بخش نامعتبر در عبارت cron: {item}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekdays
+        if self._day_restricted and self._weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, ts: float) -> int:
+        """اولین زمان (epoch) بعد از ts که با عبارت تطابق دارد."""
+        dt = datetime.fromtimestamp(ts).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return int(dt.timestamp())
+        raise ValueError(f"عبارت cron «{self.expr}» هیچ زمان اجرایی ندارد.")
+
+
+# --- زمان‌بند ---
+# ارسال‌های در انتظار در DATA['scheduled_broadcasts'] و ارسال‌های انجام شده در DATA['scheduled_archive']
+# نگه داشته می‌شوند. یک min-heap از (زمان، شناسه) فقط برای ارسال‌های در انتظار ساخته می‌شود و همیشه
+# فقط یک callback یک‌باره در job_queue برای نزدیک‌ترین ارسال تنظیم است؛ بدون ارسال در انتظار هیچ
+# کاری انجام نمی‌شود. ورودی‌های حذف یا تغییر یافته هنگام رسیدن به سر heap نادیده گرفته می‌شوند.
+_heap = []
+_job_queue = None
+_armed_job = None
+_armed_ts = None
+
+
+def _pending() -> list:
+    return data_manager.DATA['scheduled_broadcasts']
+
+def _find(entry_id: int):
+    for entry in _pending():
+        if entry['id'] == entry_id:
+            return entry
+    return None
+
+def _migrate_entries():
+    """ورودی‌های قدیمی (بدون شناسه و زمان epoch) را به قالب جدید تبدیل و ارسال‌شده‌ها را بایگانی می‌کند."""
+    entries = _pending()
+    archive = data_manager.DATA['scheduled_archive']
+    next_id = max((e.get('id', 0) for e in entries + archive), default=0) + 1
+    changed = False
+    for entry in list(entries):
+        if 'id' not in entry:
+            entry['id'] = next_id
+            next_id += 1
+            changed = True
+        if 'ts' not in entry:
+            entry['ts'] = int(datetime.strptime(entry['time'], TIME_FORMAT).timestamp())
+            changed = True
+        if entry.get('status') != 'pending':
+            entries.remove(entry)
+            archive.append(entry)
+            changed = True
+    if changed:
+        _trim_archive()
+        data_manager.mark_dirty(keys=('scheduled_broadcasts', 'scheduled_archive'))
+
+def _trim_archive():
+    archive = data_manager.DATA['scheduled_archive']
+    if len(archive) > SCHEDULE_ARCHIVE_SIZE:
+        del archive[:len(archive) - SCHEDULE_ARCHIVE_SIZE]
+
+def start(application):
+    """زمان‌بند را با ارسال‌های ذخیره شده راه‌اندازی و اولین callback را تنظیم می‌کند."""
+    global _job_queue
+    _job_queue = application.job_queue
+    _migrate_entries()
+    _heap[:] = [(entry['ts'], entry['id']) for entry in _pending()]
+    heapq.heapify(_heap)
+    _arm()
+
+def _arm():
+    """callback یک‌باره را برای نزدیک‌ترین ارسال در انتظار تنظیم می‌کند."""
+    global _armed_job, _armed_ts
+    while _heap:
+        ts, entry_id = _heap[0]
+        entry = _find(entry_id)
+        if entry is not None and entry['ts'] == ts:
+            break
+        heapq.heappop(_heap)
+
+    next_ts = _heap[0][0] if _heap else None
+    if next_ts == _armed_ts:
+        return
+    if _armed_job is not None:
+        _armed_job.schedule_removal()
+        _armed_job = None
+    _armed_ts = next_ts
+    if next_ts is None or _job_queue is None:
+        return
+    # misfire_grace_time=None: اگر ربات دیرتر از زمان مقرر بالا آمد، ارسال باز هم انجام شود
+    _armed_job = _job_queue.run_once(
+        _fire, when=max(0.0, next_ts - time.time()), name="scheduled_broadcast",
+        job_kwargs={'misfire_grace_time': None}
+    )
+
+async def _fire(context):
+    global _armed_job, _armed_ts
+    _armed_job = None
+    _armed_ts = None
+    now = time.time()
+    archive = data_manager.DATA['scheduled_archive']
+
+    while _heap and _heap[0][0] <= now:
+        ts, entry_id = heapq.heappop(_heap)
+        entry = _find(entry_id)
+        if entry is None or entry['ts'] != ts:
+            continue
+
+        job = broadcast.create_job(context.bot, entry['message'], label="scheduled")
+        archive.append({
+            'id': entry['id'],
+            'time': entry['time'],
+            'message': entry['message'],
+            'cron': entry.get('cron'),
+            'status': 'sent',
+            'sent_time': datetime.now().strftime(TIME_FORMAT),
+            'job_id': job['id'],
+        })
+        logger.info("Scheduled broadcast %s started as job #%s.", entry['id'], job['id'])
+
+        if entry.get('cron'):
+            # اجراهای از دست رفته (مثلاً هنگام خاموش بودن ربات) فقط یک بار جبران می‌شوند
+            entry['ts'] = CronExpression(entry['cron']).next_after(now)
+            entry['time'] = datetime.fromtimestamp(entry['ts']).strftime(TIME_FORMAT)
+            heapq.heappush(_heap, (entry['ts'], entry['id']))
+        else:
+            _pending().remove(entry)
+
+    _trim_archive()
+    data_manager.mark_dirty(keys=('scheduled_broadcasts', 'scheduled_archive'))
+    _arm()
+
+def add(message: str, when: datetime = None, cron: str = None) -> dict:
+    """یک ارسال زمان‌بندی شده (یک‌باره یا تکرارشونده) اضافه کرده و زمان‌بند را به‌روز می‌کند."""
+    if cron is not None:
+        ts = CronExpression(cron).next_after(time.time())
+    else:
+        ts = int(when.timestamp())
+    entries = _pending()
+    archive = data_manager.DATA['scheduled_archive']
+    entry = {
+        'id': max((e['id'] for e in entries + archive), default=0) + 1,
+        'time': datetime.fromtimestamp(ts).strftime(TIME_FORMAT),
+        'ts': ts,
+        'message': message,
+        'status': 'pending',
+        'cron': cron,
+    }
+    entries.append(entry)
+    data_manager.mark_dirty(keys=('scheduled_broadcasts', 'scheduled_archive'))
+    heapq.heappush(_heap, (ts, entry['id']))
+    _arm()
+    return entry
+
+def remove(index: int):
+    """ارسال در انتظار را با شماره ترتیبی آن (از 0) حذف کرده و برمی‌گرداند؛ در صورت نامعتبر بودن None."""
+    entries = _pending()
+    if not 0 <= index < len(entries):
+        return None
+    entry = entries.pop(index)
+    data_manager.mark_dirty(keys=('scheduled_broadcasts', 'scheduled_archive'))
+    _arm()
+    return entry
+
+def pending() -> list:
+    return list(_pending())
+
+def archived() -> list:
+    return list(data_manager.DATA['scheduled_archive'])
@@ -0,0 +1,376 @@
+# storage.py
+
+import os
+import copy
+import json
+import sqlite3
+import logging
+import tempfile
+import threading
+from datetime import datetime
+
+from user_store import UserRecord, UserStore
+
+logger = logging.getLogger(__name__)
+
+# کلیدهایی از DATA که در SQLite جدول اختصاصی دارند؛ بقیه کلیدها در جدول settings به‌صورت JSON ذخیره می‌شوند
+_TABLE_KEYS = ('users', 'banned_users', 'unreachable_users', 'stats', 'scheduled_broadcasts')
+# مجموعه‌هایی از شناسه کاربران که هر کدام در یک جدول تک‌ستونی با به‌روزرسانی تفاضلی ذخیره می‌شوند
+_ID_SET_KEYS = ('banned_users', 'unreachable_users')
+# قالب رشته‌ای زمان‌ها در فایل‌های JSON قدیمی
+LEGACY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class StorageBackend:
+    """رابط پایه برای لایه ذخیره‌سازی داده‌های ربات.
+
+    ذخیره‌سازی در دو مرحله انجام می‌شود: `prepare` روی حلقه رویداد (جایی که DATA تغییر می‌کند)
+    یک نسخه مستقل از داده‌های لازم می‌سازد و `write` آن را (معمولاً در یک ترد جداگانه) روی دیسک می‌نویسد.
+    تبدیل به JSON و هر کار متناسب با حجم کل داده‌ها باید در `write` انجام شود.
+    """
+
+    name = "base"
+    supports_queries = False
+
+    def load(self):
+        """داده‌های ذخیره شده را برمی‌گرداند یا اگر داده‌ای وجود نداشته باشد None."""
+        raise NotImplementedError
+
+    def prepare(self, data: dict, dirty_users=None, dirty_keys=None):
+        """داده‌های لازم برای نوشتن را آماده می‌کند؛ dirty_users=None یعنی ذخیره کامل.
+
+        dirty_keys کلیدهای سطح بالای DATA (به جز users) است که از نوبت قبل تغییر کرده‌اند؛ None یعنی همه.
+        """
+        raise NotImplementedError
+
+    def write(self, payload):
+        """داده‌های آماده شده را روی دیسک می‌نویسد."""
+        raise NotImplementedError
+
+    def save(self, data: dict, dirty_users=None):
+        """آماده‌سازی و نوشتن همگام داده‌ها."""
+        self.write(self.prepare(data, dirty_users))
+
+    def close(self):
+        """منابع باز لایه ذخیره‌سازی را آزاد می‌کند."""
+
+
+class JsonStorage(StorageBackend):
+    """ذخیره کل داده‌ها در یک فایل JSON با جایگزینی اتمیک.
+
+    بخش JSON هر کاربر و هر کلید سطح بالا در حافظه نگه داشته می‌شود و در هر نوبت فقط بخش‌های
+    تغییر کرده دوباره ساخته می‌شوند؛ روی حلقه رویداد فقط کپی تغییرات گرفته می‌شود و تبدیل به JSON
+    و سرهم کردن فایل در `write` (ترد ذخیره‌ساز) انجام می‌شود.
+    """
+
+    name = "json"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._user_parts = {}   # آیدی -> JSON رکورد کاربر
+        self._key_parts = {}    # کلید -> JSON مقدار
+        # تا اولین ذخیره کامل موفق، بخش‌های آماده کامل نیستند و نوبت بعد کامل نوشته می‌شود
+        self._complete = False
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def prepare(self, data: dict, dirty_users=None, dirty_keys=None):
+        if not self._complete:
+            dirty_users = None
+        return copy_changes(data, dirty_users, dirty_keys)
+
+    def write(self, changes: dict):
+        with self._lock:
+            if changes['full']:
+                self._user_parts, self._key_parts = {}, {}
+                self._complete = False
+            for row in changes['users']:
+                self._user_parts[row[0]] = _dumps(user_row_to_dict(row))
+            for key, value in changes['keys'].items():
+                self._key_parts[key] = _dumps(json_value(value))
+            parts = ['"users":{' + ','.join(f'"{uid}":{part}' for uid, part in self._user_parts.items()) + '}']
+            parts.extend(f'{_dumps(key)}:{part}' for key, part in self._key_parts.items())
+            atomic_write(self.path, '{' + ','.join(parts) + '}')
+            self._complete = True
+
+
+class SQLiteStorage(StorageBackend):
+    """ذخیره داده‌ها در SQLite (حالت WAL) با به‌روزرسانی تک‌سطری کاربران و کوئری‌های ایندکس‌دار."""
+
+    name = "sqlite"
+    supports_queries = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._written_sets = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                first_name TEXT,
+                username TEXT,
+                first_seen INTEGER,
+                last_seen INTEGER,
+                message_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users(last_seen);
+            CREATE INDEX IF NOT EXISTS idx_users_message_count ON users(message_count);
+            CREATE TABLE IF NOT EXISTS banned_users (user_id INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS unreachable_users (user_id INTEGER PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value REAL);
+            CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
+                id INTEGER PRIMARY KEY,
+                time TEXT,
+                status TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_scheduled_status_time ON scheduled_broadcasts(status, time);
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._migrate()
+
+    def _migrate(self):
+        """طرح پایگاه داده‌های قدیمی را با PRAGMA user_version به نسخه جاری ارتقا می‌دهد."""
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # نسخه ۱: زمان‌های first_seen و last_seen به‌جای متن به‌صورت epoch عددی ذخیره می‌شوند
+            columns = {row[1]: row[2] for row in self._conn.execute("PRAGMA table_info(users)")}
+            if columns.get('last_seen') == 'TEXT':
+                self._conn.executescript("""
+                    BEGIN;
+                    ALTER TABLE users RENAME TO users_v0;
+                    DROP INDEX IF EXISTS idx_users_last_seen;
+                    DROP INDEX IF EXISTS idx_users_message_count;
+                    CREATE TABLE users (
+                        user_id INTEGER PRIMARY KEY,
+                        first_name TEXT,
+                        username TEXT,
+                        first_seen INTEGER,
+                        last_seen INTEGER,
+                        message_count INTEGER NOT NULL DEFAULT 0
+                    );
+                    INSERT INTO users
+                        SELECT user_id, first_name, username,
+                               CAST(strftime('%s', first_seen, 'utc') AS INTEGER),
+                               CAST(strftime('%s', last_seen, 'utc') AS INTEGER),
+                               message_count
+                        FROM users_v0;
+                    DROP TABLE users_v0;
+                    CREATE INDEX idx_users_last_seen ON users(last_seen);
+                    CREATE INDEX idx_users_message_count ON users(message_count);
+                    COMMIT;
+                """)
+                logger.info("زمان‌های جدول users به قالب epoch منتقل شدند.")
+            self._conn.execute("PRAGMA user_version = 1")
+
+    def load(self):
+        with self._lock:
+            cur = self._conn.cursor()
+            if cur.execute("SELECT COUNT(*) FROM settings").fetchone()[0] == 0:
+                return None
+
+            data = {key: json.loads(value) for key, value in cur.execute("SELECT key, value FROM settings")}
+            data['users'] = {
+                str(user_id): {
+                    'first_name': first_name,
+                    'username': username,
+                    'first_seen': first_seen,
+                    'last_seen': last_seen,
+                    'message_count': message_count,
+                }
+                for user_id, first_name, username, first_seen, last_seen, message_count
+                in cur.execute("SELECT user_id, first_name, username, first_seen, last_seen, message_count FROM users")
+            }
+            for key in _ID_SET_KEYS:
+                data[key] = [row[0] for row in cur.execute(f"SELECT user_id FROM {key}")]
+                self._written_sets[key] = set(data[key])
+            data['stats'] = {key: value for key, value in cur.execute("SELECT key, value FROM stats")}
+            for key in ('total_messages', 'total_users', 'total_responses'):
+                if key in data['stats']:
+                    data['stats'][key] = int(data['stats'][key])
+            data['scheduled_broadcasts'] = [
+                json.loads(row[0]) for row in cur.execute("SELECT data FROM scheduled_broadcasts ORDER BY id")
+            ]
+            return data
+
+    def prepare(self, data: dict, dirty_users=None, dirty_keys=None):
+        return copy_changes(data, dirty_users, dirty_keys)
+
+    def write(self, changes: dict):
+        """فقط سطرهای کاربران و کلیدهای تغییر کرده نوشته می‌شوند؛ تبدیل به JSON همین‌جا (در ترد) انجام می‌شود."""
+        full = changes['full']
+        keys = changes['keys']
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                if full:
+                    cur.execute("DELETE FROM users")
+                cur.executemany(
+                    "INSERT INTO users (user_id, first_name, username, first_seen, last_seen, message_count) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET first_name=excluded.first_name, username=excluded.username, "
+                    "first_seen=excluded.first_seen, last_seen=excluded.last_seen, message_count=excluded.message_count",
+                    changes['users']
+                )
+
+                for key in _ID_SET_KEYS:
+                    if key not in keys:
+                        continue
+                    ids = set(keys[key])
+                    written = self._written_sets.get(key)
+                    if written is None or full:
+                        cur.execute(f"DELETE FROM {key}")
+                        cur.executemany(f"INSERT INTO {key} (user_id) VALUES (?)", [(uid,) for uid in ids])
+                    else:
+                        cur.executemany(f"INSERT OR IGNORE INTO {key} (user_id) VALUES (?)",
+                                        [(uid,) for uid in ids - written])
+                        cur.executemany(f"DELETE FROM {key} WHERE user_id = ?",
+                                        [(uid,) for uid in written - ids])
+
+                if 'stats' in keys:
+                    cur.executemany("INSERT OR REPLACE INTO stats (key, value) VALUES (?, ?)", keys['stats'].items())
+                if 'scheduled_broadcasts' in keys:
+                    cur.execute("DELETE FROM scheduled_broadcasts")
+                    cur.executemany(
+                        "INSERT INTO scheduled_broadcasts (time, status, data) VALUES (?, ?, ?)",
+                        [(b.get('time'), b.get('status'), _dumps(b)) for b in keys['scheduled_broadcasts']]
+                    )
+                cur.executemany(
+                    "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                    [(key, _dumps(value)) for key, value in keys.items() if key not in _TABLE_KEYS]
+                )
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            for key in _ID_SET_KEYS:
+                if key in keys:
+                    self._written_sets[key] = set(keys[key])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- کوئری‌های ایندکس‌دار ---
+
+    def _query_ids(self, sql: str, params=()) -> list:
+        with self._lock:
+            return [row[0] for row in self._conn.execute(sql, params)]
+
+    def user_ids_by_message_count(self, min_count: int) -> list:
+        """آیدی کاربران با حداقل تعداد پیام مشخص."""
+        return self._query_ids("SELECT user_id FROM users WHERE message_count >= ?", (min_count,))
+
+    def search_user_ids(self, term: str) -> list:
+        """آیدی کاربرانی که نام یا نام کاربری آن‌ها شامل عبارت جستجو است."""
+        pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return self._query_ids(
+            "SELECT user_id FROM users WHERE lower(first_name) LIKE ? ESCAPE '\\' "
+            "OR lower(username) LIKE ? ESCAPE '\\' ORDER BY last_seen DESC",
+            (pattern, pattern)
+        )
+
+
+def migrate_timestamps(users: dict) -> int:
+    """زمان‌های رشته‌ای فایل‌های قدیمی را به epoch تبدیل می‌کند و تعداد رکوردهای تغییر یافته را برمی‌گرداند."""
+    migrated = 0
+    for user_info in users.values():
+        changed = False
+        for key in ('first_seen', 'last_seen'):
+            value = user_info.get(key)
+            if isinstance(value, str):
+                try:
+                    user_info[key] = int(datetime.strptime(value, LEGACY_TIME_FORMAT).timestamp())
+                except ValueError:
+                    del user_info[key]
+                changed = True
+        migrated += changed
+    return migrated
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def json_value(value):
+    """مقدار یک کلید DATA در قالب قابل تبدیل به JSON (مجموعه‌ها به لیست)."""
+    return list(value) if isinstance(value, set) else value
+
+
+def user_row_to_dict(row) -> dict:
+    """تاپل (آیدی، فیلدهای UserRecord) کپی شده با copy_changes را به قالب ذخیره شده کاربر تبدیل می‌کند."""
+    return UserRecord(*row[1:]).to_dict()
+
+
+def copy_changes(data: dict, dirty_users=None, dirty_keys=None) -> dict:
+    """کپی مستقل تغییرات DATA برای نوشتن در ترد، بدون تبدیل به JSON (برای اجرا روی حلقه رویداد).
+
+    رکورد کاربران تغییر کرده (یا همه کاربران وقتی dirty_users=None) به تاپل کپی می‌شوند و از بقیه
+    کلیدها فقط کلیدهای dirty_keys (None یعنی همه) به‌همراه stats که با هر پیام تغییر می‌کند.
+    خروجی: {'full': ذخیره کامل، 'users': [(آیدی، first_name، username، first_seen، last_seen، message_count)]،
+    'keys': {کلید: کپی مقدار}}
+    """
+    full = dirty_users is None
+    users = data['users']
+    records = users.items() if full else [(uid, users.get(uid)) for uid in dirty_users if uid in users]
+    keys = {}
+    for key, value in data.items():
+        if key == 'users':
+            continue
+        if not full and dirty_keys is not None and key not in dirty_keys and key != 'stats':
+            continue
+        keys[key] = set(value) if isinstance(value, set) else copy.deepcopy(value)
+    return {
+        'full': full,
+        'users': [(uid, r.first_name, r.username, r.first_seen, r.last_seen, r.message_count) for uid, r in records],
+        'keys': keys,
+    }
+
+
+def atomic_write(path: str, payload: str):
+    """محتوا را در یک فایل موقت نوشته و سپس به‌صورت اتمیک جایگزین فایل مقصد می‌کند."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def create_backend(kind: str, json_path: str, sqlite_path: str) -> StorageBackend:
+    """لایه ذخیره‌سازی مناسب را بر اساس نام آن (json یا sqlite) می‌سازد."""
+    kind = (kind or "json").lower()
+    if kind == "sqlite":
+        backend = SQLiteStorage(sqlite_path)
+        # انتقال خودکار داده‌های فایل JSON قدیمی به پایگاه داده خالی
+        if backend.load() is None and os.path.exists(json_path):
+            legacy = JsonStorage(json_path).load()
+            if legacy:
+                # ستون‌های زمان در SQLite عددی‌اند؛ زمان‌های رشته‌ای قدیمی پیش از درج تبدیل می‌شوند
+                migrate_timestamps(legacy.get('users', {}))
+                legacy['users'] = UserStore.from_dict(legacy.get('users', {}))
+                legacy.setdefault('banned_users', [])
+                legacy.setdefault('stats', {})
+                legacy.setdefault('scheduled_broadcasts', [])
+                backend.save(legacy)
+                logger.info("داده‌های %s به پایگاه داده SQLite در %s منتقل شدند.", json_path, sqlite_path)
+        return backend
+    if kind != "json":
+        logger.warning("لایه ذخیره‌سازی ناشناخته «%s»؛ از JSON استفاده می‌شود.", kind)
+    return JsonStorage(json_path)
@@ -0,0 +1,104 @@
+# stream_writer.py
+
+import asyncio
+import logging
+import time
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# حداکثر طول متن یک پیام تلگرام
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+def _split_point(text: str, limit: int) -> int:
+    """بهترین نقطه برش متن طولانی (ترجیحاً روی خط جدید یا فاصله) را برمی‌گرداند."""
+    for sep in ('\n', ' '):
+        idx = text.rfind(sep, limit // 2, limit)
+        if idx != -1:
+            return idx + 1
+    return limit
+
+
+class TelegramStreamWriter:
+    """نمایش تدریجی پاسخ در حال تولید با ویرایش پیام تلگرام.
+
+    ویرایش‌ها حداکثر هر `edit_interval` ثانیه یک بار انجام می‌شوند تا از محدودیت نرخ ویرایش
+    تلگرام عبور نکنیم. وقتی متن از ۴۰۹۶ کاراکتر بیشتر شود، بخش پر شده نهایی شده و ادامه متن
+    در یک پیام جدید نمایش داده می‌شود.
+    """
+
+    def __init__(self, message, edit_interval: float = 1.0, limit: int = TELEGRAM_MESSAGE_LIMIT):
+        self._reply_to = message
+        self._edit_interval = edit_interval
+        self._limit = limit
+        self._messages = []      # پیام‌های ارسال شده
+        self._offsets = [0]      # شروع بخش متن هر پیام در کل متن
+        self._shown = []         # متنی که در حال حاضر در هر پیام نمایش داده می‌شود
+        self._next_edit = 0.0
+
+    async def update(self, text: str):
+        """متن کامل تا این لحظه را دریافت کرده و در صورت رسیدن نوبت، پیام را به‌روز می‌کند."""
+        if not text.strip():
+            return
+        # اولین بخش بلافاصله ارسال می‌شود تا کاربر سریع‌ترین پاسخ ممکن را ببیند
+        if self._messages and time.monotonic() < self._next_edit:
+            return
+        await self._render(text, final=False)
+
+    async def finish(self, text: str):
+        """متن نهایی را به‌طور کامل نمایش می‌دهد."""
+        if not text.strip():
+            return
+        await self._render(text, final=True)
+
+    async def _render(self, text: str, final: bool):
+        # نهایی کردن بخش‌هایی که از سقف طول پیام عبور کرده‌اند
+        while len(text) - self._offsets[-1] > self._limit:
+            start = self._offsets[-1]
+            self._offsets.append(start + _split_point(text[start:], self._limit))
+
+        for index, start in enumerate(self._offsets):
+            end = self._offsets[index + 1] if index + 1 < len(self._offsets) else len(text)
+            chunk = text[start:end]
+            if not chunk.strip():
+                break
+            if index < len(self._messages):
+                if self._shown[index] != chunk:
+                    await self._edit(index, chunk, final)
+            else:
+                await self._send(chunk)
+        self._next_edit = max(self._next_edit, time.monotonic() + self._edit_interval)
+
+    async def _send(self, chunk: str):
+        while True:
+            try:
+                message = await self._reply_to.reply_text(chunk)
+                break
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+        self._messages.append(message)
+        self._shown.append(chunk)
+
+    async def _edit(self, index: int, chunk: str, final: bool):
+        while True:
+            try:
+                await self._messages[index].edit_text(chunk)
+                self._shown[index] = chunk
+                return
+            except RetryAfter as e:
+                if not final:
+                    # ویرایش‌های میانی را رها می‌کنیم و تا پایان زمان انتظار ویرایش نمی‌کنیم
+                    self._next_edit = time.monotonic() + e.retry_after
+                    return
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    self._shown[index] = chunk
+                    return
+                raise
+            except TelegramError as e:
+                if final:
+                    raise
+                logger.warning("Failed to edit streamed message: %s", e)
+                return
@@ -0,0 +1,12 @@
+# tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+# ماژول‌های ربات در ریشه مخزن هستند
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# نمونه‌های سراسری هنگام import پوشه داده می‌سازند؛ آزمون‌ها نباید به پوشه‌های واقعی ربات دست بزنند
+os.environ.setdefault("ACTIVITY_JOURNAL_DIR", tempfile.mkdtemp(prefix="activity-test-"))
+os.environ.setdefault("BACKUP_DIR", tempfile.mkdtemp(prefix="backups-test-"))
@@ -0,0 +1,30 @@
+# tests/test_activity_index.py
+
+import time
+
+from activity_index import ActivityIndex
+
+
+def _index(now: int) -> ActivityIndex:
+    index = ActivityIndex()
+    index.build([(1, now - 7200), (2, now - 3600), (3, now - 3599), (4, now - 10)])
+    return index
+
+
+def test_count_and_ids_agree_on_cutoff_boundary():
+    now = int(time.time())
+    index = _index(now)
+    for cutoff in (now - 3600, now - 3599, now - 7200, now - 7201, now):
+        ids = index.ids_since(cutoff)
+        assert index.count_since(cutoff) == len(ids), cutoff
+    # کاربری که دقیقاً در لحظه cutoff فعال بوده شمرده می‌شود
+    assert sorted(index.ids_since(now - 3600)) == [2, 3, 4]
+
+
+def test_touch_moves_user_to_newest():
+    now = int(time.time())
+    index = _index(now)
+    index.touch(1, now - 5)
+    assert index.recent(2) == [1, 4]
+    assert index.count_since(now - 60) == 2
+    assert sum(index.hourly_histogram()) == 4
@@ -0,0 +1,118 @@
+# tests/test_activity_journal.py
+
+import os
+import time
+import shutil
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import activity_journal
+from activity_journal import ActivityJournal, Rollups, ROLLUPS_FILE, RECORD
+
+# 2024-03-04 (دوشنبه) ساعت 10 به وقت UTC
+MONDAY = int(datetime(2024, 3, 4, 10, tzinfo=timezone.utc).timestamp())
+HOUR, DAY = 3600, 86400
+
+
+@pytest.fixture(autouse=True)
+def utc(monkeypatch):
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def _feed(target, events):
+    for user_id, ts, first_seen in events:
+        if isinstance(target, ActivityJournal):
+            target.record(user_id, 0.5, first_seen=first_seen, now=ts)
+        else:
+            target.apply(user_id, ts, 0.5, activity_journal.local_day(first_seen))
+
+
+EVENTS = [
+    (1, MONDAY, MONDAY),
+    (1, MONDAY + 60, MONDAY),
+    (2, MONDAY + 120, MONDAY),
+    (1, MONDAY + HOUR, MONDAY),
+    (1, MONDAY + DAY, MONDAY),
+    (3, MONDAY + DAY + 60, MONDAY + DAY),
+]
+
+
+def test_daily_series_counts_unique_and_new_users():
+    rollups = Rollups()
+    _feed(rollups, EVENTS)
+    (_, m0, u0, lat0, new0), (_, m1, u1, _, new1) = rollups.daily_series(2, now=MONDAY + DAY + 120)
+    assert (m0, u0, new0) == (4, 2, 2)
+    assert (m1, u1, new1) == (2, 2, 1)
+    assert lat0 == pytest.approx(0.5)
+
+
+def test_hourly_matrix_and_weekly_unique_users():
+    rollups = Rollups()
+    _feed(rollups, EVENTS)
+    matrix = rollups.weekday_hour_matrix(7, now=MONDAY + DAY + 120)
+    assert matrix[0][10] == 3 and matrix[0][11] == 1 and matrix[1][10] == 2
+    assert rollups.hour_of_day(1, now=MONDAY + 120)[10] == 2
+    assert rollups.wau(1, now=MONDAY + DAY)[0][1] == 3
+    assert activity_journal.day_label(rollups.wau(1, now=MONDAY + DAY)[0][0]) == "2024-03-04"
+
+
+def test_retention_by_cohort():
+    rollups = Rollups()
+    _feed(rollups, EVENTS)
+    rows = {cohort: (size, ages) for cohort, size, ages in rollups.retention(2, now=MONDAY + DAY)}
+    monday = activity_journal.local_day(MONDAY)
+    assert rows[monday] == (2, {1: 50.0, 7: None, 30: None})
+    assert rows[monday + 1][0] == 1
+
+
+def _journal(path) -> ActivityJournal:
+    return ActivityJournal(str(path), keep_days=10_000)
+
+
+def _recovered(path) -> dict:
+    journal = _journal(path)
+    asyncio.run(journal.recover())
+    return journal.rollups.to_dict()
+
+
+def test_recover_loads_saved_rollups(tmp_path):
+    journal = _journal(tmp_path)
+    _feed(journal, EVENTS)
+    asyncio.run(journal.flush())
+    assert _recovered(tmp_path) == journal.rollups.to_dict()
+
+
+def test_recover_replays_records_after_checkpoint(tmp_path):
+    journal = _journal(tmp_path)
+    _feed(journal, EVENTS[:3])
+    asyncio.run(journal.flush())
+    saved = tmp_path / "saved.json"
+    shutil.copy(tmp_path / ROLLUPS_FILE, saved)
+    _feed(journal, EVENTS[3:])
+    asyncio.run(journal.flush())
+    # فایل تجمیع‌ها از ذخیره قبلی است؛ رکوردهای بعد از checkpoint باید دوباره اعمال شوند
+    os.replace(saved, tmp_path / ROLLUPS_FILE)
+    assert _recovered(tmp_path) == journal.rollups.to_dict()
+
+
+def test_recover_rebuilds_without_rollups_and_drops_partial_record(tmp_path):
+    journal = _journal(tmp_path)
+    _feed(journal, EVENTS)
+    asyncio.run(journal.flush())
+    os.remove(tmp_path / ROLLUPS_FILE)
+    last_day = max(journal._journal_days())
+    path = journal._path(last_day)
+    size = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(b"\x01" * (RECORD.size // 2))
+    expected = journal.rollups.to_dict()
+    recovered = _recovered(tmp_path)
+    assert recovered['daily'] == expected['daily']
+    assert recovered['cohorts'] == expected['cohorts']
+    assert os.path.getsize(path) == size
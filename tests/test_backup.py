@@ -0,0 +1,33 @@
+# tests/test_backup.py
+
+import time
+
+from backup import BackupManager
+from user_store import UserRecord, UserStore
+
+
+def _data():
+    users = UserStore()
+    users.add(1, UserRecord("a", None, 1700000000))
+    return {'users': users, 'stats': {'total_messages': 1}, 'banned_users': {5}, 'admins_seen': {7}}
+
+
+def test_delta_with_set_valued_keys_restores(tmp_path):
+    manager = BackupManager(str(tmp_path), snapshot_interval=3600, keep_snapshots=2, max_delta_bytes=1 << 20)
+    data = _data()
+    manager.write(manager.prepare(data))
+
+    data['users'].add(2, UserRecord("b", None, 1700000100))
+    data['banned_users'].add(6)
+    data['admins_seen'].add(8)
+    data['stats']['total_messages'] = 2
+    job = manager.prepare(data, dirty_users={2}, dirty_keys={'banned_users', 'admins_seen'})
+    assert job[0] == 'delta'
+    manager.write(job)
+
+    restored = manager.restore(time.time() + 1)
+    assert set(restored['users']) == {'1', '2'}
+    assert sorted(restored['banned_users']) == [5, 6]
+    assert sorted(restored['admins_seen']) == [7, 8]
+    assert restored['stats'] == {'total_messages': 2}
+    assert not manager._force_snapshot
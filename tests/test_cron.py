@@ -0,0 +1,61 @@
+# tests/test_cron.py
+
+import sys
+import types
+import importlib
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def CronExpression(monkeypatch):
+    # import کردن data_manager فایل داده واقعی ربات را می‌خواند و ذخیره می‌کند؛ CronExpression
+    # به آن و broadcast نیازی ندارد، پس scheduler با ماژول‌های خالی به جای آن‌ها بارگذاری می‌شود.
+    for name in ("data_manager", "broadcast"):
+        monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+    monkeypatch.delitem(sys.modules, "scheduler", raising=False)
+    scheduler = importlib.import_module("scheduler")
+    yield scheduler.CronExpression
+    sys.modules.pop("scheduler", None)
+
+
+def _next(cron, expr: str, after: datetime) -> datetime:
+    return datetime.fromtimestamp(cron(expr).next_after(after.timestamp()))
+
+
+def test_step_is_strictly_after(CronExpression):
+    assert _next(CronExpression, "*/15 * * * *", datetime(2024, 3, 8, 10, 7)) == datetime(2024, 3, 8, 10, 15)
+    assert _next(CronExpression, "*/15 * * * *", datetime(2024, 3, 8, 10, 15)) == datetime(2024, 3, 8, 10, 30)
+    assert _next(CronExpression, "0-30/10 * * * *", datetime(2024, 3, 8, 10, 31)) == datetime(2024, 3, 8, 11, 0)
+
+
+def test_weekday_range_skips_weekend(CronExpression):
+    # 2024-03-08 جمعه است
+    assert _next(CronExpression, "0 9 * * 1-5", datetime(2024, 3, 8, 10, 0)) == datetime(2024, 3, 11, 9, 0)
+
+
+def test_seven_means_sunday(CronExpression):
+    assert CronExpression("0 0 * * 7").weekdays == {0}
+    assert _next(CronExpression, "0 12 * * 7", datetime(2024, 3, 8)) == datetime(2024, 3, 10, 12, 0)
+
+
+def test_day_of_month_or_weekday_when_both_restricted(CronExpression):
+    assert _next(CronExpression, "0 0 13 * 5", datetime(2024, 3, 1)) == datetime(2024, 3, 8)
+    assert _next(CronExpression, "0 0 13 * 5", datetime(2024, 3, 8)) == datetime(2024, 3, 13)
+
+
+def test_rolls_over_months_and_years(CronExpression):
+    assert _next(CronExpression, "30 6 1 1 *", datetime(2024, 6, 1)) == datetime(2025, 1, 1, 6, 30)
+    assert _next(CronExpression, "0 0 29 2 *", datetime(2024, 3, 1)) == datetime(2028, 2, 29)
+
+
+@pytest.mark.parametrize("expr", ["* * * *", "60 * * * *", "5-1 * * * *", "*/0 * * * *", "0 0 0 * *", "x * * * *"])
+def test_invalid_expressions(CronExpression, expr):
+    with pytest.raises(ValueError):
+        CronExpression(expr)
+
+
+def test_impossible_schedule(CronExpression):
+    with pytest.raises(ValueError):
+        CronExpression("0 0 31 2 *").next_after(datetime(2024, 1, 1).timestamp())
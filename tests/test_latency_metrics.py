@@ -0,0 +1,61 @@
+# tests/test_latency_metrics.py
+
+import random
+
+import pytest
+
+from latency_metrics import LogHistogram
+
+# خطای نسبی هر صدک حداکثر حدود نصف ضریب رشد سطل‌هاست
+TOLERANCE = LogHistogram.GROWTH - 1
+
+
+def _exact(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, int(q * len(ordered) + 0.5) - 1)]
+
+
+def test_empty_histogram():
+    histogram = LogHistogram()
+    assert histogram.percentile(0.5) is None
+    assert histogram.mean == 0.0
+
+
+@pytest.mark.parametrize("q", [0.5, 0.9, 0.99])
+def test_percentiles_within_bucket_error(q):
+    rng = random.Random(42)
+    values = [rng.lognormvariate(0, 1) for _ in range(10000)]
+    histogram = LogHistogram()
+    for value in values:
+        histogram.record(value)
+    assert histogram.percentile(q) == pytest.approx(_exact(values, q), rel=TOLERANCE)
+
+
+def test_percentile_never_exceeds_max_and_tiny_values_share_first_bucket():
+    histogram = LogHistogram()
+    for value in (0.0, 0.0005, 0.2):
+        histogram.record(value)
+    assert histogram.percentile(1.0) <= 0.2
+    assert histogram.percentile(1.0) == pytest.approx(0.2, rel=TOLERANCE)
+    assert histogram.percentile(0.5) <= LogHistogram.MIN_VALUE * LogHistogram.GROWTH
+    assert histogram.max == 0.2
+
+
+def test_merge_and_round_trip():
+    a, b = LogHistogram(), LogHistogram()
+    for value in (0.1, 0.2, 0.3):
+        a.record(value)
+    for value in (1.0, 2.0):
+        b.record(value)
+    merged = LogHistogram.from_dict(a.to_dict()).merge(b)
+    assert merged.count == 5
+    assert merged.mean == pytest.approx(0.72)
+    assert merged.max == 2.0
+    assert merged.percentile(0.4) == pytest.approx(0.2, rel=TOLERANCE)
+
+
+def test_cumulative_counts():
+    histogram = LogHistogram()
+    for value in (0.01, 0.1, 1.0, 10.0):
+        histogram.record(value)
+    assert histogram.cumulative([0.05, 0.5, 5.0, 50.0]) == [1, 2, 3, 4]
@@ -0,0 +1,181 @@
+# tests/test_model_router.py
+#
+# آزمون روتر مدل در برابر سرورهای HTTP محلی سازگار با OpenAI (بدون شبکه): failover، درخواست پشتیبان،
+# سری‌های تأخیر جداگانه جریانی/غیرجریانی و رسیدن خطای وسط جریان به مدارشکن.
+
+import os
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+os.environ.setdefault("HF_TOKEN", "test")
+
+from openai import AsyncOpenAI  # noqa: E402
+from model_router import Endpoint, ModelRouter  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "سلام"}]
+
+
+class _StandIn(BaseHTTPRequestHandler):
+    """سرور جایگزین endpoint گفتگو؛ رفتار از `server.behavior` خوانده می‌شود."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        behavior = self.server.behavior
+        self.server.requests += 1
+        time.sleep(behavior.get("delay", 0))
+        if behavior.get("status", 200) != 200:
+            payload = json.dumps({"error": {"message": "boom"}}).encode()
+            self.send_response(behavior["status"])
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        tokens = behavior.get("tokens", ["سلام", " دنیا"])
+        if not body.get("stream"):
+            payload = json.dumps({
+                "id": "x", "object": "chat.completion", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, token in enumerate(tokens):
+            if index:
+                time.sleep(behavior.get("token_delay", 0))
+            chunk = {"id": "x", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                     "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            self._chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            if behavior.get("die_after") == index + 1:
+                # قطع اتصال وسط جریان بدون پایان chunked
+                self.wfile.flush()
+                self.connection.shutdown(2)
+                return
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(**behavior):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StandIn)
+        server.daemon_threads = True
+        server.behavior = behavior
+        server.requests = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+def _endpoint(name: str, server) -> Endpoint:
+    client = AsyncOpenAI(base_url=f"http://127.0.0.1:{server.server_address[1]}/v1", api_key="test", max_retries=0)
+    return Endpoint(name, "stand-in", client)
+
+
+def _complete(router: ModelRouter, stream: bool):
+    published = []
+    text = asyncio.run(router.complete(MESSAGES, {}, published.append, stream=stream))
+    return text, published
+
+
+def test_non_streaming_records_full_latency_only(servers):
+    endpoint = _endpoint("a", servers(delay=0.05))
+    text, _ = _complete(ModelRouter([endpoint], hedge=False), stream=False)
+    assert text == "سلام دنیا"
+    assert endpoint.samples('full') == 1
+    assert endpoint.samples('stream') == 0
+    assert endpoint.percentile(0.5) >= 0.05
+
+
+def test_streaming_records_time_to_first_token(servers):
+    endpoint = _endpoint("a", servers(token_delay=0.2))
+    text, published = _complete(ModelRouter([endpoint], hedge=False), stream=True)
+    assert text == "سلام دنیا"
+    assert published[-1] == "سلام دنیا"
+    assert endpoint.samples('stream') == 1
+    assert endpoint.samples('full') == 0
+    # اولین توکن پیش از مکث بین توکن‌ها رسیده است
+    assert endpoint.percentile(0.5, 'stream') < 0.2
+
+
+def test_failure_after_first_token_reaches_circuit_breaker(servers):
+    endpoint = _endpoint("a", servers(tokens=["a", "b", "c"], die_after=1))
+    router = ModelRouter([endpoint], hedge=False)
+    for _ in range(Endpoint.FAILURE_THRESHOLD):
+        with pytest.raises(Exception):
+            _complete(router, stream=True)
+    assert endpoint.failures == Endpoint.FAILURE_THRESHOLD
+    assert endpoint.samples('stream') == 0
+    assert endpoint.state == "open"
+
+
+def test_failover_to_next_endpoint(servers):
+    broken = _endpoint("broken", servers(status=500))
+    healthy = _endpoint("healthy", servers())
+    router = ModelRouter([broken, healthy], hedge=False)
+    text, _ = _complete(router, stream=False)
+    assert text == "سلام دنیا"
+    assert broken.failures == 1
+    assert router.failovers == 1
+    assert healthy.samples('full') == 1
+
+
+def test_hedged_request_wins_on_backup(servers):
+    slow = _endpoint("slow", servers(delay=1.0))
+    fast = _endpoint("fast", servers())
+    for _ in range(20):
+        slow.record_success(0.01)
+    fast.record_success(5.0)
+    router = ModelRouter([slow, fast], hedge=True, hedge_min_samples=20, hedge_min_delay=0.05)
+    started = time.monotonic()
+    text, _ = _complete(router, stream=False)
+    assert text == "سلام دنیا"
+    assert time.monotonic() - started < 0.9
+    assert router.hedged == 1
+    assert router.hedge_wins == 1
+
+
+def test_modes_do_not_share_latency_series(servers):
+    a = _endpoint("a", servers())
+    b = _endpoint("b", servers())
+    for _ in range(10):
+        # a پاسخ کامل سریع ولی اولین توکن کند دارد؛ b برعکس
+        a.record_success(0.1, 'full')
+        a.record_success(3.0, 'stream')
+        b.record_success(3.0, 'full')
+        b.record_success(0.1, 'stream')
+    router = ModelRouter([a, b], hedge=False)
+    assert router.choose(stream=False) is a
+    assert router.choose(stream=True) is b
@@ -0,0 +1,36 @@
+# tests/test_rate_limit.py
+
+import pytest
+
+from rate_limit import TokenBucket
+
+
+def test_burst_then_refill():
+    bucket = TokenBucket(rate=1.0, capacity=3, now=0.0)
+    assert [bucket.consume(0.0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay(0.0) == pytest.approx(1.0)
+    assert not bucket.consume(0.5)
+    assert bucket.delay(0.5) == pytest.approx(0.5)
+    assert bucket.consume(1.0)
+
+
+def test_refill_is_capped_at_capacity():
+    bucket = TokenBucket(rate=2.0, capacity=2, now=0.0)
+    assert bucket.consume(0.0, amount=2)
+    assert bucket.idle_full(1.0)
+    assert bucket.consume(100.0, amount=2)
+    assert not bucket.consume(100.0)
+
+
+def test_clock_going_backwards_does_not_refill():
+    bucket = TokenBucket(rate=1.0, capacity=1, now=10.0)
+    assert bucket.consume(10.0)
+    assert not bucket.consume(5.0)
+    assert bucket.updated == 10.0
+
+
+def test_zero_rate_never_reports_a_delay():
+    bucket = TokenBucket(rate=0.0, capacity=1, now=0.0)
+    assert bucket.consume(0.0)
+    assert not bucket.consume(1000.0)
+    assert bucket.delay(1000.0) == 0.0
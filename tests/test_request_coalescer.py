@@ -0,0 +1,66 @@
+# tests/test_request_coalescer.py
+
+import asyncio
+
+import pytest
+
+from request_coalescer import SingleFlight
+
+
+def _producer(calls, result="پاسخ", delay=0.05):
+    async def produce(publish):
+        calls.append(result)
+        publish(result[:1])
+        await asyncio.sleep(delay)
+        return result
+    return produce
+
+
+def test_identical_requests_share_one_call():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+        results = await asyncio.gather(*(flights.run("k", _producer(calls)) for _ in range(3)))
+        return flights, calls, results
+
+    flights, calls, results = asyncio.run(scenario())
+    assert results == ["پاسخ"] * 3
+    assert calls == ["پاسخ"]
+    assert flights.coalesced == 2
+    assert len(flights) == 0
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+        first = asyncio.create_task(flights.run("k", _producer(calls)))
+        second = asyncio.create_task(flights.run("k", _producer(calls)))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return calls, await second
+
+    calls, result = asyncio.run(scenario())
+    assert result == "پاسخ"
+    assert calls == ["پاسخ"]
+
+
+def test_join_after_last_waiter_abandoned_starts_new_call():
+    async def scenario():
+        flights, calls, texts = SingleFlight(), [], []
+
+        async def on_text(text):
+            texts.append(text)
+
+        first = asyncio.create_task(flights.run("k", _producer(calls), on_text=on_text))
+        await asyncio.sleep(0.01)
+        # مسیر «لغو درخواست قبلی و ارسال دوباره»: منتظر جدید بلافاصله پس از رها شدن پرواز می‌رسد
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return calls, await flights.run("k", _producer(calls, "دوباره")), len(flights)
+
+    calls, result, remaining = asyncio.run(scenario())
+    assert result == "دوباره"
+    assert calls == ["پاسخ", "دوباره"]
+    assert remaining == 0
@@ -0,0 +1,70 @@
+# tests/test_user_store.py
+
+from datetime import datetime
+
+import pytest
+
+from storage import LEGACY_TIME_FORMAT, migrate_timestamps
+from user_store import UserRecord, UserStore
+
+SAVED = {
+    "123": {"first_name": "Ali", "username": "ali", "first_seen": 1700000000, "message_count": 4,
+            "last_seen": 1700000500},
+    "456": {"first_name": None, "username": None, "first_seen": 1700001000, "message_count": 0},
+}
+
+
+def test_round_trip_keeps_saved_format():
+    assert UserStore.from_dict(SAVED).to_dict() == SAVED
+
+
+def test_legacy_string_dates_become_epoch():
+    first, last = datetime(2023, 5, 1, 8, 30), datetime(2023, 5, 2, 9, 0)
+    legacy = {"789": {"first_name": "Sara", "username": None, "message_count": 2,
+                      "first_seen": first.strftime(LEGACY_TIME_FORMAT),
+                      "last_seen": last.strftime(LEGACY_TIME_FORMAT)},
+              "790": {"first_name": "x", "username": None, "message_count": 0, "first_seen": "not a date"}}
+    assert migrate_timestamps(legacy) == 2
+    store = UserStore.from_dict(legacy)
+    record = store.get(789)
+    assert record.first_seen == int(first.timestamp())
+    assert record.last_seen == int(last.timestamp())
+    assert store.get(790).first_seen is None
+    assert store.to_dict()["789"]["first_seen"] == int(first.timestamp())
+
+
+def test_lookup_by_int_id_not_legacy_str_key():
+    store = UserStore.from_dict(SAVED)
+    assert 123 in store and "123" not in store
+    assert store.get(123).username == "ali"
+    assert store.get("123") is None
+    assert sorted(store) == [123, 456]
+
+
+def test_missing_fields_default_and_last_seen_omitted():
+    record = UserRecord.from_dict({})
+    assert (record.first_name, record.username, record.first_seen, record.last_seen, record.message_count) == \
+        (None, None, None, None, 0)
+    assert "last_seen" not in record.to_dict()
+
+
+def test_records_have_slots_only():
+    record = UserRecord("Ali")
+    assert not hasattr(record, "__dict__")
+    with pytest.raises(AttributeError):
+        record.nickname = "a"
+    assert not hasattr(UserStore(), "__dict__")
+
+
+def test_accessor_api():
+    store = UserStore.from_dict(SAVED)
+    added = store.add(999, UserRecord("New", None, 1700002000))
+    assert store.get(999) is added
+    assert len(store) == 3
+    ids = store.ids()
+    ids.append(1)
+    assert len(store) == 3
+    assert dict(store.items())[123].message_count == 4
+    assert sum(record.message_count for record in store.values()) == 4
+    added.message_count += 1
+    assert store.to_dict()["999"]["message_count"] == 1
@@ -0,0 +1,61 @@
+# tests/test_word_filter.py
+
+import pytest
+
+from word_filter import BlockedWordMatcher, MATCH_SUBSTRING, MATCH_WORD, normalize_text
+
+
+def test_substring_mode_matches_inside_words():
+    matcher = BlockedWordMatcher(["bad", "spam"], MATCH_SUBSTRING)
+    assert matcher.search("this is BADly written") == "bad"
+    assert matcher.matches("antispam")
+    assert not matcher.matches("all good")
+
+
+def test_word_mode_requires_word_boundaries():
+    matcher = BlockedWordMatcher(["bad", "spam"], MATCH_WORD)
+    assert matcher.search("a bad day") == "bad"
+    assert matcher.search("spam!") == "spam"
+    assert not matcher.matches("badly")
+    assert not matcher.matches("antispam")
+    assert not matcher.matches("spam_bot")
+
+
+def test_word_mode_keeps_scanning_after_rejected_occurrence():
+    matcher = BlockedWordMatcher(["bad"], MATCH_WORD)
+    assert matcher.search("badly bad") == "bad"
+
+
+def test_overlapping_patterns_use_failure_links():
+    # «he» داخل «she» و «hers» فقط از راه پیوند شکست پیدا می‌شود
+    matcher = BlockedWordMatcher(["hers", "he"], MATCH_SUBSTRING)
+    assert matcher.search("ushe") == "he"
+    matcher = BlockedWordMatcher(["abcd", "bc"], MATCH_SUBSTRING)
+    assert matcher.search("xabcx") == "bc"
+
+
+def test_duplicates_and_empty_words_are_ignored():
+    matcher = BlockedWordMatcher(["Spam", "spam", ""])
+    assert len(matcher) == 1
+    assert not BlockedWordMatcher().matches("anything")
+
+
+def test_surrounding_spaces_are_part_of_the_entry():
+    # مانند رفتار قبلی (word in text)، فاصله‌های اطراف کلمه مسدود شده هم باید تطبیق داده شوند
+    matcher = BlockedWordMatcher([" bad "])
+    assert matcher.matches("a bad day")
+    assert not matcher.matches("badge")
+    assert not matcher.matches("bad")
+
+
+def test_persian_normalization():
+    matcher = BlockedWordMatcher(["کلمه"], MATCH_WORD, normalize=True)
+    assert matcher.matches("این كلمه است")
+    assert matcher.matches("این کلـمه است")
+    assert not BlockedWordMatcher(["کلمه"], MATCH_WORD).matches("این كلمه است")
+    assert normalize_text("يك‌كتاب", unicode_variants=True) == "یککتاب"
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        BlockedWordMatcher(["bad"], "regex")
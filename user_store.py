@@ -0,0 +1,87 @@
+# user_store.py
+
+
+class UserRecord:
+    """رکورد فشرده یک کاربر؛ با __slots__ و بدون دیکشنری اختصاصی برای هر کاربر."""
+
+    __slots__ = ('first_name', 'username', 'first_seen', 'last_seen', 'message_count')
+
+    def __init__(self, first_name=None, username=None, first_seen=None, last_seen=None, message_count=0):
+        self.first_name = first_name
+        self.username = username
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.message_count = message_count
+
+    @classmethod
+    def from_dict(cls, info: dict) -> "UserRecord":
+        return cls(
+            info.get('first_name'),
+            info.get('username'),
+            info.get('first_seen'),
+            info.get('last_seen'),
+            info.get('message_count', 0),
+        )
+
+    def to_dict(self) -> dict:
+        info = {
+            'first_name': self.first_name,
+            'username': self.username,
+            'first_seen': self.first_seen,
+            'message_count': self.message_count,
+        }
+        if self.last_seen is not None:
+            info['last_seen'] = self.last_seen
+        return info
+
+    def __repr__(self):
+        return (f"UserRecord(first_name={self.first_name!r}, username={self.username!r}, "
+                f"first_seen={self.first_seen}, last_seen={self.last_seen}, message_count={self.message_count})")
+
+
+class UserStore:
+    """مخزن کاربران با کلید عددی (آیدی تلگرام) و رکوردهای UserRecord.
+
+    در فایل JSON کاربران همچنان با کلید رشته‌ای و مقدار دیکشنری ذخیره می‌شوند تا قالب فایل تغییر نکند.
+    """
+
+    __slots__ = ('_records',)
+
+    def __init__(self, records=None):
+        self._records = {} if records is None else records
+
+    @classmethod
+    def from_dict(cls, users: dict) -> "UserStore":
+        """مخزن را از قالب ذخیره شده ({آیدی رشته‌ای: دیکشنری}) می‌سازد."""
+        return cls({int(user_id): UserRecord.from_dict(info) for user_id, info in users.items()})
+
+    def to_dict(self) -> dict:
+        """مخزن را به قالب قابل ذخیره در JSON تبدیل می‌کند."""
+        return {str(user_id): record.to_dict() for user_id, record in self._records.items()}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, user_id):
+        return user_id in self._records
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def get(self, user_id):
+        """رکورد کاربر یا None."""
+        return self._records.get(user_id)
+
+    def add(self, user_id: int, record: UserRecord) -> UserRecord:
+        self._records[user_id] = record
+        return record
+
+    def ids(self) -> list:
+        """کپی لیست آیدی همه کاربران (برای پیمایش امن در حین تغییر مخزن)."""
+        return list(self._records)
+
+    def items(self):
+        return self._records.items()
+
+    def values(self):
+        return self._records.values()
@@ -0,0 +1,213 @@
+# web_server.py
+
+import os
+import time
+import asyncio
+import signal
+import logging
+from aiohttp import web
+from telegram import Update
+
+import data_manager
+import broadcast
+from admission import controller as admission
+from rate_limit import limiter as rate_limiter
+from response_cache import cache as response_cache
+from conversation import store as conversation_store
+from model_router import router as model_router
+from latency_metrics import metrics as latency_metrics
+
+logger = logging.getLogger(__name__)
+
+# مرزهای سطل‌های هیستوگرام Prometheus (ثانیه)
+HISTOGRAM_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+LOOP_LAG_INTERVAL = 0.5
+# با تنظیم METRICS_TOKEN درخواست /metrics باید هدر Authorization: Bearer <token> داشته باشد
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+
+_started_at = time.time()
+_loop_lag = 0.0
+
+
+# --- تأخیر حلقه رویداد ---
+async def _monitor_loop_lag():
+    """اختلاف زمان بیدار شدن واقعی با زمان مورد انتظار، معیار مسدود شدن حلقه رویداد است."""
+    global _loop_lag
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        _loop_lag = max(0.0, loop.time() - expected)
+        latency_metrics.record('event_loop_lag', _loop_lag)
+
+
+def _rss_bytes() -> int:
+    """حافظه مقیم فرایند؛ از /proc خوانده می‌شود تا نیازی به psutil نباشد."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        # در لینوکس بر حسب کیلوبایت و بیشینه مصرف است، نه مقدار فعلی
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# --- خروجی متنی Prometheus ---
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class _Exposition:
+    """سازنده خروجی متنی؛ هر خانواده متریک یک بار HELP و TYPE می‌گیرد."""
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name: str, kind: str, help_text: str):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value, labels: dict = None):
+        self.lines.append(f"{name}{_labels(labels)} {value}")
+
+    def metric(self, name: str, kind: str, help_text: str, value, labels: dict = None):
+        self.family(name, kind, help_text)
+        self.sample(name, value, labels)
+
+    def histogram(self, name: str, histogram, labels: dict):
+        for bound, count in zip(HISTOGRAM_BOUNDS, histogram.cumulative(HISTOGRAM_BOUNDS)):
+            self.sample(f"{name}_bucket", count, {**labels, 'le': bound})
+        self.sample(f"{name}_bucket", histogram.count, {**labels, 'le': "+Inf"})
+        self.sample(f"{name}_sum", round(histogram.total, 6), labels)
+        self.sample(f"{name}_count", histogram.count, labels)
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def render_metrics() -> str:
+    """همه متریک‌ها از شمارنده‌های درون حافظه خوانده می‌شوند و هیچ پیمایشی روی کاربران انجام نمی‌شود."""
+    out = _Exposition()
+    stats = data_manager.DATA['stats']
+
+    out.metric("bot_messages_total", "counter", "Text messages handled.", stats.get('total_messages', 0))
+    out.metric("bot_responses_total", "counter", "Replies delivered to users.", stats.get('total_responses', 0))
+    out.metric("bot_users", "gauge", "Registered users.", data_manager.user_count())
+    out.metric("bot_unreachable_users", "gauge", "Users that blocked the bot.", len(data_manager.DATA['unreachable_users']))
+    out.metric("bot_rate_limited_total", "counter", "Messages dropped by the rate limiter.", rate_limiter.rejected)
+
+    out.metric("bot_queue_depth", "gauge", "Requests waiting for an upstream slot.", admission.queued)
+    out.metric("bot_inflight_requests", "gauge", "Upstream requests in flight.", admission.inflight)
+    out.metric("bot_admission_admitted_total", "counter", "Requests admitted to the model.", admission.admitted)
+    out.metric("bot_admission_rejected_total", "counter", "Requests rejected because the queue was full.", admission.rejected)
+
+    if response_cache is not None:
+        out.family("bot_cache_hits_total", "counter", "Response cache hits by tier.")
+        out.sample("bot_cache_hits_total", response_cache.hits, {'tier': "memory"})
+        out.sample("bot_cache_hits_total", response_cache.disk_hits, {'tier': "disk"})
+        out.metric("bot_cache_misses_total", "counter", "Response cache misses.", response_cache.misses)
+        out.metric("bot_cache_entries", "gauge", "Entries in the in-memory response cache.", len(response_cache))
+    if conversation_store is not None:
+        out.metric("bot_conversations", "gauge", "Conversations held in memory.", len(conversation_store))
+
+    out.family("bot_upstream_requests_total", "counter", "Requests sent to each model endpoint.")
+    for endpoint in model_router.endpoints:
+        out.sample("bot_upstream_requests_total", endpoint.requests, {'endpoint': endpoint.name})
+    out.family("bot_upstream_failures_total", "counter", "Failed requests per model endpoint.")
+    for endpoint in model_router.endpoints:
+        out.sample("bot_upstream_failures_total", endpoint.failures, {'endpoint': endpoint.name})
+    out.family("bot_upstream_circuit_closed", "gauge", "1 when the endpoint circuit breaker is closed.")
+    for endpoint in model_router.endpoints:
+        out.sample("bot_upstream_circuit_closed", int(endpoint.state == "closed"), {'endpoint': endpoint.name})
+
+    broadcaster = broadcast.broadcaster
+    out.family("bot_broadcast_messages_total", "counter", "Broadcast deliveries by outcome.")
+    out.sample("bot_broadcast_messages_total", broadcaster.sent, {'outcome': "sent"})
+    out.sample("bot_broadcast_messages_total", broadcaster.failed, {'outcome': "failed"})
+    out.sample("bot_broadcast_messages_total", broadcaster.blocked, {'outcome': "blocked"})
+    out.metric("bot_broadcast_flood_waits_total", "counter", "RetryAfter responses during broadcasts.", broadcaster.flood_waits)
+    out.metric("bot_broadcast_rate", "gauge", "Current broadcast send rate (messages/s).", round(broadcaster.current_rate, 3))
+    out.metric("bot_broadcast_active_jobs", "gauge", "Broadcast jobs pending or running.", len(broadcast.active_jobs()))
+
+    out.family("bot_latency_seconds", "histogram", "Latency per stage (total, queue_wait, upstream, telegram_send, save_data, event_loop_lag).")
+    for stage, model, histogram in latency_metrics.series():
+        out.histogram("bot_latency_seconds", histogram, {'stage': stage, 'model': model})
+
+    out.metric("bot_event_loop_lag_seconds", "gauge", "Most recent event-loop scheduling delay.", round(_loop_lag, 6))
+    out.metric("process_resident_memory_bytes", "gauge", "Resident memory size in bytes.", _rss_bytes())
+    out.metric("bot_uptime_seconds", "gauge", "Seconds since the process started.", round(time.time() - _started_at, 1))
+    return out.render()
+
+
+# --- مسیرهای وب ---
+def build_web_app(application, url_path: str) -> web.Application:
+    async def webhook(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception as e:
+            logger.warning("Rejected malformed webhook payload: %s", e)
+            return web.Response(status=400)
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def metrics(request: web.Request) -> web.Response:
+        if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+            return web.Response(status=401)
+        return web.Response(body=render_metrics().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="OK")
+
+    app = web.Application()
+    app.router.add_post(f"/{url_path}", webhook)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/", health)
+    return app
+
+
+async def run(application, port: int, webhook_url: str, url_path: str = "webhook"):
+    """ربات را با سرور aiohttp اجرا می‌کند که webhook تلگرام، /metrics و / را هم‌زمان سرویس می‌دهد.
+
+    جایگزین `Application.run_webhook` است، بنابراین post_init و post_shutdown هم اینجا فراخوانی می‌شوند.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    runner = web.AppRunner(build_web_app(application, url_path))
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(url=webhook_url, allowed_updates=Update.ALL_TYPES,
+                                          secret_token=WEBHOOK_SECRET or None)
+        await application.start()
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", port).start()
+        lag_monitor = asyncio.create_task(_monitor_loop_lag())
+        logger.info("Web server listening on port %s (webhook, /metrics).", port)
+        try:
+            await stop.wait()
+        finally:
+            lag_monitor.cancel()
+            await runner.cleanup()
+            if application.running:
+                await application.stop()
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
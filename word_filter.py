@@ -0,0 +1,123 @@
+# word_filter.py
+
+from collections import deque
+
+# --- یکسان‌سازی حروف فارسی/عربی ---
+# گونه‌های عربی حروف به معادل فارسی تبدیل و اعراب، کشیده و نیم‌فاصله حذف می‌شوند
+# تا «كلمه»، «کلمه» و «کلـمه» همگی یکسان تطبیق داده شوند.
+_PERSIAN_NORMALIZATION = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا',
+    'ؤ': 'و',
+    '\u0640': None,  # کشیده (ـ)
+    '\u200c': None,  # نیم‌فاصله
+    '\u200d': None,
+    **{chr(code): None for code in range(0x064B, 0x0660)},  # اعراب
+    '\u0670': None,
+})
+
+MATCH_SUBSTRING = "substring"
+MATCH_WORD = "word"
+MATCH_MODES = (MATCH_SUBSTRING, MATCH_WORD)
+
+
+def normalize_text(text: str, unicode_variants: bool = False) -> str:
+    """متن را برای تطبیق آماده می‌کند: حروف کوچک و در صورت نیاز یکسان‌سازی حروف فارسی/عربی."""
+    text = text.lower()
+    if unicode_variants:
+        text = text.translate(_PERSIAN_NORMALIZATION)
+    return text
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == '_'
+
+
+class BlockedWordMatcher:
+    """تطبیق‌دهنده چندالگویی Aho-Corasick برای کلمات مسدود شده.
+
+    اتوماتون فقط هنگام تغییر لیست کلمات ساخته می‌شود و بررسی هر پیام فارغ از تعداد کلمات
+    مسدود شده در زمان O(طول متن) انجام می‌شود.
+    mode=MATCH_SUBSTRING هر رخداد کلمه در متن را تطبیق می‌دهد (رفتار قبلی) و
+    mode=MATCH_WORD فقط رخدادهایی که در مرز کلمه قرار دارند.
+    """
+
+    def __init__(self, words=(), mode: str = MATCH_SUBSTRING, normalize: bool = False):
+        if mode not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode: {mode}")
+        self.mode = mode
+        self.normalize = normalize
+        # هر گره: دیکشنری انتقال‌ها، پیوند شکست و طول الگوهایی که در آن گره پایان می‌یابند
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        self._size = 0
+        for word in words:
+            self._add(word)
+        self._build_failure_links()
+
+    def __len__(self):
+        return self._size
+
+    def _add(self, word: str):
+        word = normalize_text(word, self.normalize)
+        if not word:
+            return
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            node = nxt
+        if len(word) not in self._out[node]:
+            self._out[node] = self._out[node] + (len(word),)
+            self._size += 1
+
+    def _build_failure_links(self):
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(ch, 0)
+                # خروجی‌های گره شکست هم در این گره پایان می‌یابند
+                out[child] = out[child] + out[fail[child]]
+
+    def search(self, text: str):
+        """اولین کلمه مسدود شده یافت شده در متن (به شکل یکسان‌سازی شده) یا None را برمی‌گرداند."""
+        if not self._size:
+            return None
+        text = normalize_text(text, self.normalize)
+        goto, fail, out = self._goto, self._fail, self._out
+        whole_word = self.mode == MATCH_WORD
+        last = len(text) - 1
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if not out[node]:
+                continue
+            for length in out[node]:
+                start = i - length + 1
+                if whole_word and (
+                    (start > 0 and _is_word_char(text[start - 1]))
+                    or (i < last and _is_word_char(text[i + 1]))
+                ):
+                    continue
+                return text[start:i + 1]
+        return None
+
+    def matches(self, text: str) -> bool:
+        """بررسی می‌کند آیا متن حاوی یکی از کلمات مسدود شده است یا خیر."""
+        return self.search(text) is not None